@@ -20,6 +20,13 @@ async def list_cashiers(token: CurrentAuthToken, cashier_service: ContextCashier
     return normalize_list(await cashier_service.list_cashiers(token=token, node_id=node_id))
 
 
+@router.get("/shift-stats", response_model=dict[int, CashierShiftStats])
+async def get_current_shift_stats_for_cashiers(
+    token: CurrentAuthToken, cashier_service: ContextCashierService, node_id: Optional[int] = None
+):
+    return await cashier_service.get_current_shift_stats_for_cashiers(token=token, node_id=node_id)
+
+
 @router.get("/{cashier_id}", response_model=Cashier)
 async def get_cashier(
     token: CurrentAuthToken, cashier_id: int, cashier_service: ContextCashierService, node_id: Optional[int] = None
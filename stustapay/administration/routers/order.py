@@ -1,11 +1,18 @@
-from typing import Optional
+from typing import Annotated, Optional
 
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import StreamingResponse
 
 from stustapay.core.http.auth_user import CurrentAuthToken
 from stustapay.core.http.context import ContextOrderService
 from stustapay.core.http.normalize_data import NormalizedList, normalize_list
-from stustapay.core.schema.order import CompletedSaleProducts, EditSaleProducts, Order
+from stustapay.core.schema.order import (
+    CompletedSaleProducts,
+    EditSaleProducts,
+    Order,
+    OrderFilter,
+    OrderPage,
+)
 
 router = APIRouter(
     prefix="/orders",
@@ -33,6 +40,37 @@ async def list_orders(
     )
 
 
+@router.get("/paginated", response_model=OrderPage)
+async def list_orders_paginated(
+    token: CurrentAuthToken,
+    order_service: ContextOrderService,
+    order_filter: Annotated[OrderFilter, Depends()],
+    cursor: Optional[str] = None,
+    limit: int = 100,
+    node_id: Optional[int] = None,
+):
+    return await order_service.list_orders_paginated(
+        token=token, order_filter=order_filter, cursor=cursor, limit=limit, node_id=node_id
+    )
+
+
+@router.get("/export", response_class=StreamingResponse)
+async def export_orders(
+    token: CurrentAuthToken,
+    order_service: ContextOrderService,
+    order_filter: Annotated[OrderFilter, Depends()],
+    node_id: Optional[int] = None,
+):
+    """all orders matching the filter as newline delimited json"""
+    orders = await order_service.stream_orders(token=token, order_filter=order_filter, node_id=node_id)
+
+    async def order_lines():
+        async for order in orders:
+            yield order.model_dump_json() + "\n"
+
+    return StreamingResponse(order_lines(), media_type="application/x-ndjson")
+
+
 @router.get("/{order_id}", response_model=Order)
 async def get_order(
     token: CurrentAuthToken, order_id: int, order_service: ContextOrderService, node_id: Optional[int] = None
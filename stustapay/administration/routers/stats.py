@@ -1,10 +1,12 @@
+import asyncio
 from datetime import datetime
 from typing import Optional
 
-from fastapi import APIRouter
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, status
 
 from stustapay.core.http.auth_user import CurrentAuthToken
 from stustapay.core.http.context import ContextOrderService
+from stustapay.core.service.common.error import ServiceException
 from stustapay.core.service.order.stats import (
     ProductStats,
     TimeseriesStats,
@@ -73,3 +75,35 @@ async def get_top_up_stats(
         query=TimeseriesStatsQuery(to_time=to_timestamp, from_time=from_timestamp),
         node_id=node_id,
     )
+
+
+@router.websocket("/live")
+async def live_stats(websocket: WebSocket, order_service: ContextOrderService, node_id: int, token: str):
+    """
+    pushes a snapshot of the running order stats of a node followed by an update after every order.
+    Browsers cannot set headers on websocket connections, therefore the token is passed as query parameter.
+    """
+    try:
+        subscription = await order_service.stats.subscribe_live_stats(token=token, node_id=node_id)
+    except ServiceException as e:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=str(e))
+        return
+
+    await websocket.accept()
+    async with subscription as queue:
+
+        async def send_stats():
+            while True:
+                message = await queue.get()
+                await websocket.send_text(message.model_dump_json())
+
+        sender = asyncio.create_task(send_stats())
+        try:
+            # we do not expect any messages from the client, but need to receive to notice it disconnecting
+            while True:
+                await websocket.receive_text()
+        except WebSocketDisconnect:
+            pass
+        finally:
+            sender.cancel()
+            await asyncio.gather(sender, return_exceptions=True)
@@ -4,20 +4,25 @@ import logging
 
 from stustapay.core import database
 from stustapay.core.config import Config
+from stustapay.core.deferred_deltas import apply_deferred_deltas
 from stustapay.core.healthcheck import run_healthcheck
 from stustapay.core.http.context import Context
 from stustapay.core.http.server import Server
 from stustapay.core.service.account import AccountService
+from stustapay.core.service.auth import user_privilege_cache
 from stustapay.core.service.cashier import CashierService
+from stustapay.core.service.common.cache import listen_for_invalidations
 from stustapay.core.service.config import ConfigService
 from stustapay.core.service.customer.customer import CustomerService
 from stustapay.core.service.order import OrderService
+from stustapay.core.service.order.live_stats import live_order_stats
 from stustapay.core.service.product import ProductService
 from stustapay.core.service.sumup import SumUpService
 from stustapay.core.service.tax_rate import TaxRateService
 from stustapay.core.service.terminal import TerminalService
 from stustapay.core.service.ticket import TicketService
 from stustapay.core.service.till import TillService
+from stustapay.core.service.tree.common import node_tree_snapshot
 from stustapay.core.service.tree.service import TreeService
 from stustapay.core.service.tse import TseService
 from stustapay.core.service.user import AuthService, UserService
@@ -96,7 +101,7 @@ class Api:
         self.server = get_server(config)
 
     async def run(self):
-        db_pool = await self.server.db_connect(self.cfg.database)
+        db_pool = await self.server.db_connect(self.cfg.database, pool_config=self.cfg.administration.db_pool)
         await database.check_revision_version(db_pool)
 
         auth_service = AuthService(db_pool=db_pool, config=self.cfg)
@@ -128,6 +133,11 @@ class Api:
         )
         try:
             self.server.add_task(asyncio.create_task(run_healthcheck(db_pool=db_pool, service_name="administration")))
+            self.server.add_task(
+                asyncio.create_task(listen_for_invalidations(db_pool, [node_tree_snapshot, user_privilege_cache]))
+            )
+            self.server.add_task(asyncio.create_task(live_order_stats.listen(db_pool)))
+            self.server.add_task(asyncio.create_task(apply_deferred_deltas(db_pool, self.cfg.deferred_deltas)))
             await self.server.run(self.cfg, context)
         finally:
             await db_pool.close()
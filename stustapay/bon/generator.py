@@ -10,7 +10,9 @@ from asyncpg.exceptions import PostgresError
 from stustapay.bon.bon import generate_bon
 from stustapay.core.config import Config
 from stustapay.core.healthcheck import run_healthcheck
+from stustapay.core.service.common.cache import listen_for_invalidations
 from stustapay.core.service.common.dbhook import DBHook
+from stustapay.core.service.tree.common import event_settings_cache
 from stustapay.framework.async_utils import AsyncThread
 from stustapay.framework.database import Connection, create_db_pool
 
@@ -40,7 +42,7 @@ class GeneratorWorker:
     async def run(self):
         # start all database connections and start the hook to listen for bon requests
         self.logger.info(f"Starting Bon Generator worker {self.worker_id}")
-        self.pool = await create_db_pool(self.config.database)
+        self.pool = await create_db_pool(self.config.database, pool_config=self.config.bon.db_pool)
 
         # initial processing of pending bons
         await self.cleanup_pending_bons()
@@ -51,6 +53,9 @@ class GeneratorWorker:
             asyncio.create_task(self.db_hook.run()),
             asyncio.create_task(run_healthcheck(db_pool=self.pool, service_name=f"bon{self.worker_id}")),
         ]
+        if self.worker_id == 0:
+            # the in-process caches are shared by the worker threads, a single listener keeps them up to date
+            self.tasks.append(asyncio.create_task(listen_for_invalidations(self.pool, [event_settings_cache])))
 
         try:
             await asyncio.gather(
@@ -3,8 +3,9 @@ from typing import Annotated, Optional
 
 import typer
 
+from stustapay.core.schema.tse import TseType
 from stustapay.tse.signature_processor import SignatureProcessor
-from stustapay.tse.simulator import Simulator
+from stustapay.tse.simulator import FiskalySimulator, Simulator
 from stustapay.tse.tse_switchover import TseSwitchover
 
 tse_cli = typer.Typer()
@@ -18,8 +19,14 @@ def signature_processor(ctx: typer.Context):
 
 @tse_cli.command()
 def simulator(
+    tse_type: Annotated[
+        TseType, typer.Option("--type", "-t", help="type of TSE to simulate")
+    ] = TseType.diebold_nixdorf,
     host: Annotated[str, typer.Option(help="local bind address")] = "localhost",
-    port: Annotated[int, typer.Option("--port", "-p", help="port for websocket to listen, default 10001")] = 10001,
+    port: Annotated[
+        Optional[int],
+        typer.Option("--port", "-p", help="port to listen on, default 10001 (diebold_nixdorf) or 10002 (fiskaly)"),
+    ] = None,
     delay: Annotated[
         float, typer.Option("--delay", "-d", help="artificial delay for signature to mimic real TSE, default 0.25s")
     ] = 0.25,
@@ -32,10 +39,31 @@ def simulator(
     ] = None,
     gen_key: Annotated[bool, typer.Option("--gen_key", "-g", help="generate new secret key")] = False,
     broken: Annotated[bool, typer.Option("--broken", "-b", help="simulator with error")] = False,
+    latency: Annotated[float, typer.Option(help="fiskaly only: delay of every response in seconds")] = 0.05,
+    latency_jitter: Annotated[
+        float, typer.Option(help="fiskaly only: random additional delay of every response in seconds")
+    ] = 0.02,
+    error_rate: Annotated[
+        float, typer.Option(help="fiskaly only: fraction of requests failing with an internal server error")
+    ] = 0.0,
+    token_validity: Annotated[int, typer.Option(help="fiskaly only: seconds an access token is valid")] = 300,
 ):
+    if tse_type == TseType.fiskaly:
+        fiskaly_sim = FiskalySimulator(
+            host=host,
+            port=port or 10002,
+            latency=0 if fast else latency,
+            latency_jitter=0 if fast else latency_jitter,
+            error_rate=error_rate,
+            token_validity=token_validity,
+            private_key_hex=secret_key,
+        )
+        asyncio.run(fiskaly_sim.run())
+        return
+
     sim = Simulator(
         host,
-        port,
+        port or 10001,
         delay,
         fast,
         even_more_realistic,
@@ -1,15 +1,16 @@
 import os
 
 import yaml
-from pydantic import BaseModel
+from pydantic import BaseModel, model_validator
 
-from stustapay.framework.database import DatabaseConfig
+from stustapay.framework.database import DatabaseConfig, DBPoolConfig
 
 
 class HTTPServerConfig(BaseModel):
     base_url: str
     host: str
     port: int
+    db_pool: DBPoolConfig = DBPoolConfig()
 
 
 class AdministrationApiConfig(HTTPServerConfig):
@@ -18,10 +19,53 @@ class AdministrationApiConfig(HTTPServerConfig):
     port: int = 8081
 
 
+# database connections a terminal server worker needs to serve requests, besides those of its notification listeners
+MIN_TERMINALSERVER_REQUEST_CONNECTIONS = 2
+
+
 class TerminalApiConfig(HTTPServerConfig):
     base_url: str
     host: str = "localhost"
     port: int = 8080
+    # number of server processes sharing the listening socket, each with its own database connection pool
+    n_workers: int = 1
+    # total number of database connections, split evenly between all workers.
+    # This determines the max_size of the pool of each worker, the max_size of db_pool is not used.
+    db_connection_budget: int = 10
+    # seconds a worker gets to finish its running requests when shutting down before it is killed
+    shutdown_timeout: float = 10
+
+    @model_validator(mode="after")  # type: ignore
+    @classmethod
+    def check_db_connection_budget(cls, m: "TerminalApiConfig"):
+        if m.n_workers < 1:
+            raise ValueError("the terminal server needs at least one worker")
+        # the connections needed by the notification listeners are only known at startup, see
+        # check_db_connections_per_worker
+        if m.db_connection_budget < m.n_workers * MIN_TERMINALSERVER_REQUEST_CONNECTIONS:
+            raise ValueError(
+                f"a db connection budget of {m.db_connection_budget} is too small for {m.n_workers} terminal server "
+                f"workers, each worker needs at least {MIN_TERMINALSERVER_REQUEST_CONNECTIONS} connections"
+            )
+        return m
+
+    @property
+    def db_connections_per_worker(self) -> int:
+        return self.db_connection_budget // self.n_workers
+
+    def check_db_connections_per_worker(self, n_listener_connections: int):
+        """each worker needs one connection per notification listener and the rest to serve requests"""
+        min_connections = n_listener_connections + MIN_TERMINALSERVER_REQUEST_CONNECTIONS
+        if self.db_connections_per_worker < min_connections:
+            raise ValueError(
+                f"a db connection budget of {self.db_connection_budget} is too small for {self.n_workers} terminal "
+                f"server workers, each worker needs at least {min_connections} connections"
+            )
+
+    @property
+    def worker_db_pool(self) -> DBPoolConfig:
+        max_size = self.db_connections_per_worker
+        return self.db_pool.model_copy(update={"min_size": min(self.db_pool.min_size, max_size), "max_size": max_size})
 
 
 class CoreConfig(BaseModel):
@@ -42,6 +86,29 @@ class CustomerPortalApiConfig(HTTPServerConfig):
 
 class BonConfig(BaseModel):
     n_workers: int = 1
+    # per worker, each keeps two connections for its notification listeners and needs one to generate bons
+    db_pool: DBPoolConfig = DBPoolConfig(min_size=3, max_size=4)
+
+
+class TseConfig(BaseModel):
+    # number of signatures a TSE works on at once, each for a different till. Signatures of the same till are always
+    # created one after another in the order they were booked.
+    signature_concurrency: int = 1
+    # per TSE name, overrides signature_concurrency
+    signature_concurrency_per_tse: dict[str, int] = {}
+    # every TSE keeps one connection and needs one more per concurrent signature
+    db_pool: DBPoolConfig = DBPoolConfig()
+
+    def get_signature_concurrency(self, tse_name: str) -> int:
+        return self.signature_concurrency_per_tse.get(tse_name, self.signature_concurrency)
+
+
+class DeferredDeltasConfig(BaseModel):
+    # seconds between applying the deferred account balance changes and order stats recorded by bookings
+    interval: float = 5.0
+    # a warning is logged if more deltas of one kind were pending when applying them
+    pending_warning_threshold: int = 10000
+
 
 class FiskalyConfig(BaseModel):
     base_url: str
@@ -56,8 +123,9 @@ class Config(BaseModel):
     terminalserver: TerminalApiConfig
     customerportal: CustomerPortalApiConfig
     bon: BonConfig = BonConfig()
+    tse: TseConfig = TseConfig()
+    deferred_deltas: DeferredDeltasConfig = DeferredDeltasConfig()
     fiskaly: FiskalyConfig
-    
 
 
 def read_config(config_path: os.PathLike) -> Config:
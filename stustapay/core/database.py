@@ -15,7 +15,7 @@ from .schema import DATA_PATH, DB_CODE_PATH, REVISION_PATH
 
 logger = logging.getLogger(__name__)
 
-CURRENT_REVISION = "99999999"
+CURRENT_REVISION = "5c2e9a71"
 
 
 def list_revisions():
@@ -0,0 +1,63 @@
+"""
+applying the deltas which bookings record instead of updating rows changed by many concurrent bookings,
+see account_balance_delta and order_stats_hourly_delta
+"""
+
+import asyncio
+import logging
+from typing import Optional
+
+import asyncpg
+from pydantic import BaseModel
+
+from stustapay.core.config import DeferredDeltasConfig
+from stustapay.framework.database import Connection
+
+# the servers running the job take this advisory lock while applying the deltas, so only one of them does at a time
+DEFERRED_DELTAS_LOCK_NAME = "apply_deferred_deltas"
+
+logger = logging.getLogger(__name__)
+
+
+class AppliedDeltas(BaseModel):
+    account_balances: int
+    order_stats: int
+
+
+async def apply_pending_deltas(conn: Connection) -> Optional[AppliedDeltas]:
+    """apply all pending deltas, None if another server is applying them right now"""
+    async with conn.transaction():
+        if not await conn.fetchval(
+            "select pg_try_advisory_xact_lock(hashtextextended($1, 0))", DEFERRED_DELTAS_LOCK_NAME
+        ):
+            return None
+        return AppliedDeltas(
+            account_balances=await conn.fetchval("select apply_account_balance_deltas()"),
+            order_stats=await conn.fetchval("select apply_order_stats_hourly_deltas()"),
+        )
+
+
+async def apply_deferred_deltas(db_pool: asyncpg.Pool, config: DeferredDeltasConfig):
+    """
+    Periodically apply the recorded deferred account balance changes and order stats until cancelled.
+    Reading through account_with_history and order_stats_hourly_with_deltas is correct at any time, this only keeps
+    the number of pending deltas small. A warning is logged if more deltas than configured were pending, e.g. because
+    the job did not run for a while.
+    """
+    while True:
+        try:
+            async with db_pool.acquire() as conn:
+                applied = await apply_pending_deltas(conn)
+            if applied is not None:
+                logger.debug(
+                    f"Applied {applied.account_balances} deferred account balance changes "
+                    f"and {applied.order_stats} deferred order stats"
+                )
+                if max(applied.account_balances, applied.order_stats) > config.pending_warning_threshold:
+                    logger.warning(
+                        f"{applied.account_balances} deferred account balance changes and {applied.order_stats} "
+                        f"deferred order stats were pending, more than {config.pending_warning_threshold}"
+                    )
+        except (asyncpg.PostgresError, OSError):
+            logger.exception("Error while applying deferred deltas")
+        await asyncio.sleep(config.interval)
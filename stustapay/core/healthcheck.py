@@ -5,17 +5,30 @@ import os
 import traceback
 from datetime import datetime
 from pathlib import Path
+from typing import Optional
 
 import asyncpg
 from pydantic import BaseModel
 
 from stustapay.core.database import check_revision_version
+from stustapay.core.service.common.cache import CacheStats, cache_stats
+from stustapay.core.service.common.retry import RetryStats, retry_stats
+from stustapay.framework.database import (
+    Pool,
+    PoolStats,
+    StatementStats,
+    statement_stats,
+)
 
 
 class Healtcheck(BaseModel):
     timestamp: str
     service_name: str
     healthy: bool
+    db_pool: Optional[PoolStats] = None
+    transaction_retries: list[RetryStats] = []
+    caches: list[CacheStats] = []
+    statements: list[StatementStats] = []
 
 
 def get_healthcheck_dir() -> Path:
@@ -40,7 +53,15 @@ async def write_healtcheck_status(db_pool: asyncpg.Pool, healthcheck_dir: Path,
         healthy = False
 
     try:
-        status = Healtcheck(timestamp=datetime.now().isoformat(), service_name=service_name, healthy=healthy)
+        status = Healtcheck(
+            timestamp=datetime.now().isoformat(),
+            service_name=service_name,
+            healthy=healthy,
+            db_pool=db_pool.stats() if isinstance(db_pool, Pool) else None,
+            transaction_retries=retry_stats(),
+            caches=cache_stats(),
+            statements=statement_stats(),
+        )
         status_file_name = healthcheck_dir / f"{service_name}.json"
         status_file_name.parent.mkdir(parents=True, exist_ok=True)
         with status_file_name.open("w+") as f:
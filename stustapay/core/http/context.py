@@ -7,6 +7,7 @@ from typing import Annotated, AsyncGenerator, Optional, Union
 
 import asyncpg
 from fastapi import Depends, Request, WebSocket
+from starlette.requests import HTTPConnection
 from starlette.types import ASGIApp, Receive, Scope, Send
 
 from stustapay.core.config import Config
@@ -130,7 +131,7 @@ def get_db_pool(request: Request) -> asyncpg.Pool:
     return request.state.context.db_pool
 
 
-def get_order_service(request: Request) -> OrderService:
+def get_order_service(request: HTTPConnection) -> OrderService:
     return request.state.context.order_service
 
 
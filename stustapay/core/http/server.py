@@ -4,6 +4,8 @@ http server base class
 
 import asyncio
 import logging
+import socket
+from typing import Optional
 from urllib.parse import urlparse
 
 import asyncpg
@@ -29,7 +31,7 @@ from stustapay.core.service.common.error import (
     ServiceException,
     Unauthorized,
 )
-from stustapay.framework.database import create_db_pool
+from stustapay.framework.database import DBPoolConfig, create_db_pool
 
 
 def use_route_names_as_operation_ids(app: FastAPI) -> None:
@@ -100,10 +102,14 @@ class Server:
     def get_openapi_spec(self) -> dict:
         return self.api.openapi()
 
-    async def db_connect(self, cfg: DatabaseConfig):
-        return await create_db_pool(cfg)
+    async def db_connect(self, cfg: DatabaseConfig, pool_config: DBPoolConfig):
+        return await create_db_pool(cfg, pool_config=pool_config)
 
-    async def run(self, cfg, context: Context):
+    def bind_socket(self) -> socket.socket:
+        """bind the configured address, used to share one listening socket between multiple worker processes"""
+        return self.uvicorn_config.bind_socket()
+
+    async def run(self, cfg, context: Context, sockets: Optional[list[socket.socket]] = None):
         del cfg
 
         # register service instances so they are available in api routes
@@ -114,7 +120,7 @@ class Server:
             context=context,
         )
         webserver = uvicorn.Server(self.uvicorn_config)
-        await webserver.serve()
+        await webserver.serve(sockets=sockets)
 
         for task in self.tasks:
             task.cancel()
@@ -24,6 +24,14 @@ class OrderWithBon(Order):
     bon_generated: Optional[bool]
 
 
+class OrderWithBonPage(BaseModel):
+    """orders sorted by descending booking time"""
+
+    orders: list[OrderWithBon]
+    # pass as cursor to fetch the next page, None if there are no more orders
+    next_cursor: Optional[str]
+
+
 class CustomerCheckout(BaseModel):
     checkout_reference: uuid.UUID
     amount: float
@@ -0,0 +1,6 @@
+-- revision: b9a18c00
+-- requires: 99999999
+
+-- keyset pagination of orders by booking time
+create index on ordr (booked_at, id);
+create index on ordr (till_id, booked_at, id);
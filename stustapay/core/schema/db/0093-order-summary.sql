@@ -0,0 +1,48 @@
+-- revision: cb83da6b
+-- requires: b9a18c00
+
+-- totals and line items of each order, written once the order has been booked.
+-- order_value reads them from here instead of aggregating all line items of an order on every query.
+create table order_summary (
+    order_id     bigint primary key references ordr (id),
+    total_price  numeric not null,
+    total_tax    numeric not null,
+    total_no_tax numeric not null,
+    -- line items including their product, as returned by the line_item_json view
+    line_items   json    not null
+);
+
+-- backfill all existing orders. The views only exist after all revisions have been applied, so the product
+-- representation of product_with_tax_and_restrictions is repeated here.
+insert into order_summary (order_id, total_price, total_tax, total_no_tax, line_items)
+select
+    o.id,
+    coalesce(sum(l.total_price), 0),
+    coalesce(sum(l.total_tax), 0),
+    coalesce(sum(l.total_price - l.total_tax), 0),
+    coalesce(json_agg(l order by l.item_id) filter (where l.order_id is not null), json_build_array())
+from
+    ordr o
+    left join (
+        select
+            li.*,
+            row_to_json(p) as product
+        from
+            line_item li
+            join (
+                select
+                    p.*,
+                    p.price / p.price_in_vouchers               as price_per_voucher,
+                    t.name                                      as tax_name,
+                    t.rate                                      as tax_rate,
+                    coalesce(pr.restrictions, '{}'::text array) as restrictions
+                from
+                    product p
+                    join tax_rate t on p.tax_rate_id = t.id
+                    left join (
+                        select r.id, array_agg(r.restriction) as restrictions from product_restriction r group by r.id
+                    ) pr on pr.id = p.id
+            ) p on li.product_id = p.id
+    ) l on l.order_id = o.id
+group by
+    o.id;
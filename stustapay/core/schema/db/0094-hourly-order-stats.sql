@@ -0,0 +1,29 @@
+-- revision: 33a69a64
+-- requires: cb83da6b
+
+-- sold quantity and revenue per node, product and hour, added up once an order has been committed.
+-- the order statistics read these instead of scanning all orders and line items of an event.
+create table order_stats_hourly (
+    node_id    bigint      not null references node (id),
+    product_id bigint      not null references product (id),
+    -- start of the hour in which the orders were booked
+    hour       timestamptz not null,
+    primary key (node_id, product_id, hour),
+    quantity   bigint      not null,
+    revenue    numeric     not null
+);
+
+-- backfill all existing orders
+insert into order_stats_hourly (node_id, product_id, hour, quantity, revenue)
+select
+    t.node_id,
+    li.product_id,
+    date_trunc('hour', o.booked_at, 'UTC'),
+    sum(li.quantity),
+    sum(li.total_price)
+from
+    ordr o
+    join till t on o.till_id = t.id
+    join line_item li on o.id = li.order_id
+group by
+    t.node_id, li.product_id, date_trunc('hour', o.booked_at, 'UTC');
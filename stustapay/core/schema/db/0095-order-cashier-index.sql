@@ -0,0 +1,5 @@
+-- revision: 351c83d6
+-- requires: 33a69a64
+
+-- orders booked by a cashier during a shift, used for the cashier shift stats
+create index on ordr (cashier_id, booked_at);
@@ -0,0 +1,5 @@
+-- revision: eee7ac7e
+-- requires: 351c83d6
+
+-- order history of a customer account, paginated by booking time
+create index on ordr (customer_account_id, booked_at desc, id desc);
@@ -0,0 +1,28 @@
+-- revision: 143b1cbf
+-- requires: eee7ac7e
+
+-- system accounts which take part in almost every order, e.g. the sale exit, would serialize all bookings on their
+-- single row. Their balance changes are appended to account_balance_delta instead and added to the account
+-- periodically, see apply_account_balance_deltas.
+alter table account_type add column deferred_balance boolean not null default false;
+
+update account_type set deferred_balance = true
+where name in (
+    'sale_exit',
+    'cash_entry',
+    'cash_exit',
+    'cash_topup_source',
+    'cash_imbalance',
+    'sumup_entry',
+    'sumup_online_entry',
+    'voucher_create'
+);
+
+create table account_balance_delta (
+    id             bigint primary key generated always as identity,
+    account_id     bigint  not null references account (id),
+    balance_delta  numeric not null,
+    vouchers_delta bigint  not null
+);
+
+create index on account_balance_delta (account_id);
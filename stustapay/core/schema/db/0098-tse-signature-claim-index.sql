@@ -0,0 +1,10 @@
+-- revision: bd5e88e2
+-- requires: 143b1cbf
+
+-- the till of the order, the signatures of a till are claimed by the TSE the till is assigned to one after another
+alter table tse_signature add column till_id bigint references till (id);
+
+update tse_signature s set till_id = o.till_id from ordr o where o.id = s.id and o.till_id is not null;
+
+-- signatures which still have to be created or are being created, per till in the order of the orders
+create index on tse_signature (till_id, id) where signature_status in ('new', 'pending');
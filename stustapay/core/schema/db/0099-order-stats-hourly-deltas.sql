@@ -0,0 +1,14 @@
+-- revision: 5c2e9a71
+-- requires: bd5e88e2
+
+-- committing orders no longer upserts the shared per node, product and hour rows of order_stats_hourly, concurrent
+-- serializable bookings of the same products would conflict on them. The stats of every order are appended here and
+-- added to order_stats_hourly periodically, see apply_order_stats_hourly_deltas.
+create table order_stats_hourly_delta (
+    id         bigint primary key generated always as identity,
+    node_id    bigint      not null references node (id),
+    product_id bigint      not null references product (id),
+    hour       timestamptz not null,
+    quantity   bigint      not null,
+    revenue    numeric     not null
+);
@@ -66,14 +66,28 @@ create view user_with_privileges as
             group by utr.user_id
         ) privs on usr.id = privs.user_id;
 
+-- the balance of accounts with a deferred balance includes the changes not yet applied to the account row.
+-- these are only read for such accounts, as subqueries in a case are only evaluated when needed.
 create view account_with_history as
     select
-        a.*,
+        a.id,
+        a.user_tag_uid,
+        a.type,
+        a.name,
+        a.comment,
+        case when at.deferred_balance then
+            a.balance + (select coalesce(sum(d.balance_delta), 0) from account_balance_delta d where d.account_id = a.id)
+        else a.balance end as balance,
+        case when at.deferred_balance then
+            a.vouchers + (select coalesce(sum(d.vouchers_delta), 0) from account_balance_delta d where d.account_id = a.id)
+        else a.vouchers end as vouchers,
+        a.node_id,
         ut.comment                             as user_tag_comment,
         ut.restriction,
         coalesce(hist.tag_history, '[]'::json) as tag_history
     from
         account a
+        join account_type at on a.type = at.name
         left join user_tag ut on a.user_tag_uid = ut.uid
         left join (
             select
@@ -267,37 +281,27 @@ create view till_layout_with_buttons_and_tickets as
             group by tltt.layout_id
                   ) t_view on t.id = t_view.layout_id;
 
-create view line_item_aggregated_json as
-    with line_item_json as (
-        select
-            l.*,
-            row_to_json(p) as product
-        from
-            line_item as l
-            join product_with_tax_and_restrictions p on l.product_id = p.id
-    )
+create view line_item_json as
     select
-        order_id,
-        sum(total_price)                                       as total_price,
-        sum(total_tax)                                         as total_tax,
-        sum(total_price - total_tax)                           as total_no_tax,
-        coalesce(json_agg(line_item_json), json_build_array()) as line_items
+        l.*,
+        row_to_json(p) as product
     from
-        line_item_json
-    group by
-        order_id;
+        line_item as l
+        join product_with_tax_and_restrictions p on l.product_id = p.id;
 
+-- the line items including their product are read from order_summary, which is written when the order is booked.
+-- The products therefore show the state at booking time, later changes to a product do not alter booked orders.
 create view order_value as
     select
         ordr.*,
-        a.user_tag_uid                              as customer_tag_uid,
-        coalesce(li.total_price, 0)                 as total_price,
-        coalesce(li.total_tax, 0)                   as total_tax,
-        coalesce(li.total_no_tax, 0)                as total_no_tax,
-        coalesce(li.line_items, json_build_array()) as line_items
+        a.user_tag_uid                             as customer_tag_uid,
+        coalesce(s.total_price, 0)                 as total_price,
+        coalesce(s.total_tax, 0)                   as total_tax,
+        coalesce(s.total_no_tax, 0)                as total_no_tax,
+        coalesce(s.line_items, json_build_array()) as line_items
     from
         ordr
-        left join line_item_aggregated_json li on ordr.id = li.order_id
+        left join order_summary s on ordr.id = s.order_id
         left join account a on ordr.customer_account_id = a.id;
 
 -- show all line items
@@ -324,6 +328,22 @@ create view order_tax_rates as
     group by
         ordr.id, tax_rate, tax_name;
 
+-- order stats per node, product and hour including the deltas which have not yet been added to order_stats_hourly
+create view order_stats_hourly_with_deltas as
+    select
+        s.node_id,
+        s.product_id,
+        s.hour,
+        sum(s.quantity) as quantity,
+        sum(s.revenue)  as revenue
+    from (
+        select node_id, product_id, hour, quantity, revenue from order_stats_hourly
+        union all
+        select node_id, product_id, hour, quantity, revenue from order_stats_hourly_delta
+    ) s
+    group by
+        s.node_id, s.product_id, s.hour;
+
 create view order_value_with_bon as
     select
         o.*,
@@ -145,6 +145,8 @@ $$
     cashier_account_id    bigint;
     transport_account_id  bigint;
 begin
+    perform pg_notify('user_privileges', NEW.user_id::text);
+
     select
         ur.privileges
     into locals.role_privileges
@@ -222,6 +224,64 @@ create trigger user_to_role_updated_trigger
     for each row
 execute function user_to_role_updated();
 
+-- notify in-process caches of logged-in users about changes,
+-- the payload is the affected user or empty if roles and thereby possibly all users are affected
+create or replace function user_privileges_changed() returns trigger as
+$$
+begin
+    if TG_LEVEL = 'STATEMENT' then
+        perform pg_notify('user_privileges', '');
+    elsif TG_TABLE_NAME = 'usr' then
+        perform pg_notify('user_privileges', OLD.id::text);
+    elsif TG_TABLE_NAME = 'usr_session' then
+        perform pg_notify('user_privileges', OLD.usr::text);
+    else
+        perform pg_notify('user_privileges', OLD.user_id::text);
+        if TG_OP = 'UPDATE' then
+            perform pg_notify('user_privileges', NEW.user_id::text);
+        end if;
+    end if;
+
+    return null;
+end;
+$$ language plpgsql
+    set search_path = "$user", public;
+
+drop trigger if exists user_to_role_privileges_changed_trigger on user_to_role;
+create trigger user_to_role_privileges_changed_trigger
+    after update or delete
+    on user_to_role
+    for each row
+execute function user_privileges_changed();
+
+drop trigger if exists usr_privileges_changed_trigger on usr;
+create trigger usr_privileges_changed_trigger
+    after update or delete
+    on usr
+    for each row
+execute function user_privileges_changed();
+
+drop trigger if exists usr_session_privileges_changed_trigger on usr_session;
+create trigger usr_session_privileges_changed_trigger
+    after delete
+    on usr_session
+    for each row
+execute function user_privileges_changed();
+
+drop trigger if exists user_role_privileges_changed_trigger on user_role;
+create trigger user_role_privileges_changed_trigger
+    after update or delete or truncate
+    on user_role
+    for each statement
+execute function user_privileges_changed();
+
+drop trigger if exists user_role_to_privilege_privileges_changed_trigger on user_role_to_privilege;
+create trigger user_role_to_privilege_privileges_changed_trigger
+    after insert or update or delete or truncate
+    on user_role_to_privilege
+    for each statement
+execute function user_privileges_changed();
+
 create or replace function check_account_balance() returns trigger as
 $$
 <<locals>> declare
@@ -296,6 +356,10 @@ $$
 begin
     NEW.active_cash_register_id := null;
 
+    if NEW.terminal_id is not null then
+        perform pg_notify('terminal_session', NEW.terminal_id::text);
+    end if;
+
     select t.id into locals.tax_rate_none_id
     from tax_rate t join node n on t.node_id = n.event_node_id
     where n.id = NEW.node_id and t.name = 'none';
@@ -331,6 +395,7 @@ begin
             values (
                 locals.new_order_id, 0, 7, locals.new_cash_register_balance, 1, locals.tax_rate_none_id, 'none', 0
             );
+            perform update_order_summary(locals.new_order_id);
             NEW.active_cash_register_id := locals.new_cash_register_id;
         end if;
     end if;
@@ -362,6 +427,7 @@ begin
             values (
                 locals.old_order_id, 0, 7, -locals.old_cash_register_balance, 1, locals.tax_rate_none_id, 'none', 0
             );
+            perform update_order_summary(locals.old_order_id);
         end if;
     end if;
 
@@ -378,6 +444,41 @@ create trigger handle_till_user_login_trigger
     when (OLD.active_user_id is distinct from NEW.active_user_id)
 execute function handle_till_user_login();
 
+-- notify in-process caches of logged-in terminals about changes, the payload is the affected terminal
+create or replace function terminal_session_changed() returns trigger as
+$$
+begin
+    if TG_TABLE_NAME = 'terminal' then
+        perform pg_notify('terminal_session', OLD.id::text);
+        return null;
+    end if;
+
+    if OLD.terminal_id is not null then
+        perform pg_notify('terminal_session', OLD.terminal_id::text);
+    end if;
+    if TG_OP = 'UPDATE' and NEW.terminal_id is not null then
+        perform pg_notify('terminal_session', NEW.terminal_id::text);
+    end if;
+
+    return null;
+end;
+$$ language plpgsql
+    set search_path = "$user", public;
+
+drop trigger if exists terminal_session_changed_trigger on terminal;
+create trigger terminal_session_changed_trigger
+    after update or delete
+    on terminal
+    for each row
+execute function terminal_session_changed();
+
+drop trigger if exists till_terminal_session_changed_trigger on till;
+create trigger till_terminal_session_changed_trigger
+    after update or delete
+    on till
+    for each row
+execute function terminal_session_changed();
+
 create or replace function deny_in_trigger() returns trigger
     language plpgsql as
 $$
@@ -400,10 +501,10 @@ begin
 
     -- insert a new tse signing request and notify for it
     insert into tse_signature(
-        id
+        id, till_id
     )
     values (
-        NEW.id
+        NEW.id, NEW.till_id
     );
     perform pg_notify('tse_signature', NEW.id::text);
 
@@ -411,6 +512,9 @@ begin
     perform pg_notify('order',
                       json_build_object('order_id', NEW.id, 'order_uuid', NEW.uuid, 'cashier_id', NEW.cashier_id,
                                         'till_id', NEW.till_id)::text);
+    if NEW.customer_account_id is not null then
+        perform pg_notify('customer_orders', NEW.customer_account_id::text);
+    end if;
 
     return NEW;
 end;
@@ -424,6 +528,27 @@ create trigger new_order_trigger
     for each row
 execute function new_order_added();
 
+-- orders are expected to be summarized right after their line items have been inserted, see update_order_summary.
+-- This catches all orders which were not, e.g. ones inserted manually.
+-- The hourly stats are recorded here, at commit, once all line items of the order have been inserted.
+create or replace function summarize_new_order() returns trigger as
+$$
+begin
+    if not exists(select from order_summary where order_id = NEW.id) then
+        perform update_order_summary(NEW.id);
+    end if;
+    perform add_order_to_hourly_stats(NEW.id);
+    return null;
+end;
+$$ language plpgsql
+    set search_path = "$user", public;
+
+create constraint trigger summarize_new_order_trigger
+    after insert
+    on ordr deferrable initially deferred
+    for each row
+execute function summarize_new_order();
+
 create or replace function tse_signature_update_trigger_procedure() returns trigger as
 $$
 begin
@@ -465,6 +590,187 @@ create trigger tse_signature_finished_trigger
     when (NEW.signature_status = 'done' or NEW.signature_status = 'failure')
 execute function tse_signature_finished_trigger_procedure();
 
+-- notify in-process customer order histories once the bon of an order has been generated
+create or replace function bon_changed() returns trigger as
+$$
+<<locals>> declare
+    customer_account_id bigint;
+begin
+    select o.customer_account_id into locals.customer_account_id from ordr o where o.id = NEW.id;
+    if locals.customer_account_id is not null then
+        perform pg_notify('customer_orders', locals.customer_account_id::text);
+    end if;
+
+    return null;
+end;
+$$ language plpgsql
+    set search_path = "$user", public;
+
+drop trigger if exists bon_changed_trigger on bon;
+create trigger bon_changed_trigger
+    after insert or update of generated
+    on bon
+    for each row
+execute function bon_changed();
+
+-- notify in-process node tree snapshots about changes, the payload is the node whose subtree has to be reloaded
+create or replace function node_tree_changed() returns trigger as
+$$
+<<locals>> declare
+    changed record;
+    node_id bigint;
+begin
+    if TG_OP = 'DELETE' then
+        locals.changed := OLD;
+    else
+        locals.changed := NEW;
+    end if;
+
+    if TG_TABLE_NAME = 'node' then
+        locals.node_id := locals.changed.id;
+    elsif TG_TABLE_NAME = 'event' then
+        select n.id into locals.node_id from node n where n.event_id = locals.changed.id;
+    elsif TG_TABLE_NAME = 'translation_text' then
+        select n.id into locals.node_id from node n where n.event_id = locals.changed.event_id;
+    else
+        -- forbidden objects at node or in its subtree
+        locals.node_id := locals.changed.node_id;
+    end if;
+
+    if locals.node_id is not null then
+        perform pg_notify('node_tree', locals.node_id::text);
+    end if;
+
+    return null;
+end;
+$$ language plpgsql
+    set search_path = "$user", public;
+
+drop trigger if exists node_node_tree_changed_trigger on node;
+create trigger node_node_tree_changed_trigger
+    after insert or update or delete
+    on node
+    for each row
+execute function node_tree_changed();
+
+drop trigger if exists forbidden_objects_at_node_node_tree_changed_trigger on forbidden_objects_at_node;
+create trigger forbidden_objects_at_node_node_tree_changed_trigger
+    after insert or update or delete
+    on forbidden_objects_at_node
+    for each row
+execute function node_tree_changed();
+
+drop trigger if exists forbidden_objects_in_subtree_at_node_node_tree_changed_trigger on forbidden_objects_in_subtree_at_node;
+create trigger forbidden_objects_in_subtree_at_node_node_tree_changed_trigger
+    after insert or update or delete
+    on forbidden_objects_in_subtree_at_node
+    for each row
+execute function node_tree_changed();
+
+drop trigger if exists event_node_tree_changed_trigger on event;
+create trigger event_node_tree_changed_trigger
+    after insert or update or delete
+    on event
+    for each row
+execute function node_tree_changed();
+
+drop trigger if exists translation_text_node_tree_changed_trigger on translation_text;
+create trigger translation_text_node_tree_changed_trigger
+    after insert or update or delete
+    on translation_text
+    for each row
+execute function node_tree_changed();
+
+-- notify in-process caches of till profiles, layouts and their products about changes
+create or replace function till_profile_config_changed() returns trigger as
+$$
+begin
+    perform pg_notify('till_profile_config', TG_TABLE_NAME);
+    return null;
+end;
+$$ language plpgsql
+    set search_path = "$user", public;
+
+drop trigger if exists product_till_profile_config_changed_trigger on product;
+create trigger product_till_profile_config_changed_trigger
+    after insert or update or delete or truncate
+    on product
+    for each statement
+execute function till_profile_config_changed();
+
+drop trigger if exists product_restriction_till_profile_config_changed_trigger on product_restriction;
+create trigger product_restriction_till_profile_config_changed_trigger
+    after insert or update or delete or truncate
+    on product_restriction
+    for each statement
+execute function till_profile_config_changed();
+
+drop trigger if exists tax_rate_till_profile_config_changed_trigger on tax_rate;
+create trigger tax_rate_till_profile_config_changed_trigger
+    after insert or update or delete or truncate
+    on tax_rate
+    for each statement
+execute function till_profile_config_changed();
+
+drop trigger if exists till_button_till_profile_config_changed_trigger on till_button;
+create trigger till_button_till_profile_config_changed_trigger
+    after insert or update or delete or truncate
+    on till_button
+    for each statement
+execute function till_profile_config_changed();
+
+drop trigger if exists till_button_product_till_profile_config_changed_trigger on till_button_product;
+create trigger till_button_product_till_profile_config_changed_trigger
+    after insert or update or delete or truncate
+    on till_button_product
+    for each statement
+execute function till_profile_config_changed();
+
+drop trigger if exists till_layout_till_profile_config_changed_trigger on till_layout;
+create trigger till_layout_till_profile_config_changed_trigger
+    after insert or update or delete or truncate
+    on till_layout
+    for each statement
+execute function till_profile_config_changed();
+
+drop trigger if exists till_layout_to_button_till_profile_config_changed_trigger on till_layout_to_button;
+create trigger till_layout_to_button_till_profile_config_changed_trigger
+    after insert or update or delete or truncate
+    on till_layout_to_button
+    for each statement
+execute function till_profile_config_changed();
+
+drop trigger if exists till_profile_till_profile_config_changed_trigger on till_profile;
+create trigger till_profile_till_profile_config_changed_trigger
+    after insert or update or delete or truncate
+    on till_profile
+    for each statement
+execute function till_profile_config_changed();
+
+-- notify in-process caches of event settings about changes
+create or replace function event_settings_changed() returns trigger as
+$$
+begin
+    perform pg_notify('event_settings', TG_TABLE_NAME);
+    return null;
+end;
+$$ language plpgsql
+    set search_path = "$user", public;
+
+drop trigger if exists event_event_settings_changed_trigger on event;
+create trigger event_event_settings_changed_trigger
+    after insert or update or delete or truncate
+    on event
+    for each statement
+execute function event_settings_changed();
+
+drop trigger if exists translation_text_event_settings_changed_trigger on translation_text;
+create trigger translation_text_event_settings_changed_trigger
+    after insert or update or delete or truncate
+    on translation_text
+    for each statement
+execute function event_settings_changed();
+
 create or replace function update_account_user_tag_association_to_user() returns trigger as
 $$
 <<locals>> declare
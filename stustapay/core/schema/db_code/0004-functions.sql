@@ -42,8 +42,8 @@ begin
     returning id into locals.transaction_id;
 
     -- update account values
-    update account set balance = balance - amount, vouchers = vouchers - vouchers_amount where id = source_account_id;
-    update account set balance = balance + amount, vouchers = vouchers + vouchers_amount where id = target_account_id;
+    perform change_account_balance(source_account_id, -amount, -vouchers_amount);
+    perform change_account_balance(target_account_id, amount, vouchers_amount);
 
     return locals.transaction_id;
 
@@ -51,6 +51,155 @@ end;
 $$ language plpgsql
     set search_path = "$user", public;
 
+-- add to the balance of an account. for accounts with a deferred balance the change is only recorded in
+-- account_balance_delta, so concurrent bookings do not all update the same row.
+create or replace function change_account_balance(
+    account_id bigint,
+    balance_delta numeric,
+    vouchers_delta bigint
+) returns void as
+$$
+begin
+    if (
+        select at.deferred_balance
+        from account a join account_type at on a.type = at.name
+        where a.id = change_account_balance.account_id
+    ) then
+        insert into account_balance_delta (account_id, balance_delta, vouchers_delta)
+        values (change_account_balance.account_id, change_account_balance.balance_delta, change_account_balance.vouchers_delta);
+    else
+        update account a
+        set
+            balance = a.balance + change_account_balance.balance_delta,
+            vouchers = a.vouchers + change_account_balance.vouchers_delta
+        where a.id = change_account_balance.account_id;
+    end if;
+end;
+$$ language plpgsql
+    set search_path = "$user", public;
+
+-- add all recorded balance changes of accounts with a deferred balance to the accounts.
+-- returns the number of applied changes.
+create or replace function apply_account_balance_deltas() returns bigint as
+$$
+    with applied as (
+        delete from account_balance_delta returning account_id, balance_delta, vouchers_delta
+    ), account_delta as (
+        select
+            account_id,
+            sum(balance_delta)  as balance_delta,
+            sum(vouchers_delta) as vouchers_delta,
+            count(*)            as n_deltas
+        from applied
+        group by account_id
+    ), updated_account as (
+        update account a
+        set balance = a.balance + account_delta.balance_delta, vouchers = a.vouchers + account_delta.vouchers_delta
+        from account_delta
+        where a.id = account_delta.account_id
+        returning account_delta.n_deltas
+    )
+    select coalesce(sum(n_deltas), 0)::bigint from updated_account;
+$$ language sql
+    set search_path = "$user", public;
+
+-- book multiple transactions belonging to one order at once.
+-- the i-th transaction is described by the i-th element of each input array, descriptions may be null.
+-- account balances are updated with one aggregated update per account, returns the new transaction ids.
+-- accounts with a deferred balance get one aggregated entry in account_balance_delta instead.
+create or replace function book_transactions(
+    order_id bigint,
+    source_account_ids bigint array,
+    target_account_ids bigint array,
+    amounts numeric array,
+    vouchers_amounts bigint array,
+    descriptions text array default null,
+    booked_at timestamptz default now(),
+    conducting_user_id bigint default null
+) returns setof bigint as
+$$
+begin
+    if cardinality(source_account_ids) != cardinality(target_account_ids)
+        or cardinality(source_account_ids) != cardinality(amounts)
+        or cardinality(source_account_ids) != cardinality(vouchers_amounts) then
+        raise 'all booking arrays must have the same length';
+    end if;
+
+    if exists (select from unnest(amounts, vouchers_amounts) as b(amount, vouchers) where b.vouchers * b.amount < 0) then
+        raise 'vouchers_amount and amount must have the same sign';
+    end if;
+
+    if exists (
+        select from unnest(source_account_ids, target_account_ids) as b(source, target)
+        where b.source is null or b.target is null
+    ) then
+        raise 'source and target accounts of a transaction must not be null';
+    end if;
+
+    return query
+        with booking as (
+            -- swap accounts on negative amounts, as only non-negative transactions are allowed
+            select
+                case when b.amount < 0 or b.vouchers < 0 then b.target else b.source end as source_account,
+                case when b.amount < 0 or b.vouchers < 0 then b.source else b.target end as target_account,
+                abs(b.amount)                                                           as amount,
+                abs(b.vouchers)                                                         as vouchers,
+                coalesce(b.description, '')                                             as description,
+                b.idx
+            from
+                unnest(source_account_ids, target_account_ids, amounts, vouchers_amounts, descriptions)
+                    with ordinality as b(source, target, amount, vouchers, description, idx)
+        ), inserted as (
+            insert into transaction (
+                order_id, description, source_account, target_account, amount, vouchers, booked_at,
+                conducting_user_id
+            )
+            select
+                book_transactions.order_id,
+                booking.description,
+                booking.source_account,
+                booking.target_account,
+                booking.amount,
+                booking.vouchers,
+                book_transactions.booked_at,
+                book_transactions.conducting_user_id
+            from booking
+            order by booking.idx
+            returning id, source_account, target_account, amount, vouchers
+        ), account_delta as (
+            select
+                d.account_id,
+                sum(d.balance_delta)  as balance_delta,
+                sum(d.vouchers_delta) as vouchers_delta
+            from (
+                select i.source_account as account_id, -i.amount as balance_delta, -i.vouchers as vouchers_delta
+                from inserted i
+                union all
+                select i.target_account as account_id, i.amount as balance_delta, i.vouchers as vouchers_delta
+                from inserted i
+            ) d
+            group by d.account_id
+        ), account_delta_by_kind as (
+            select account_delta.*, at.deferred_balance
+            from account_delta join account a on account_delta.account_id = a.id join account_type at on a.type = at.name
+        ), updated_account as (
+            update account a
+            set balance = a.balance + d.balance_delta, vouchers = a.vouchers + d.vouchers_delta
+            from account_delta_by_kind d
+            where a.id = d.account_id and not d.deferred_balance
+            returning a.id
+        ), deferred_account_delta as (
+            insert into account_balance_delta (account_id, balance_delta, vouchers_delta)
+            select d.account_id, d.balance_delta, d.vouchers_delta
+            from account_delta_by_kind d
+            where d.deferred_balance
+            returning id
+        )
+        select inserted.id from inserted order by inserted.id;
+end;
+$$ language plpgsql
+    set search_path = "$user", public;
+
 create or replace function node_with_user_roles(
     user_id bigint
 )
@@ -86,3 +235,85 @@ $$ language sql
     stable
     security invoker
     set search_path = "$user", public;
+
+-- (re)compute the totals and line items stored in order_summary, has to be called once all line items of the order
+-- have been inserted
+create or replace function update_order_summary(
+    order_id bigint
+) returns void as
+$$
+insert into order_summary (order_id, total_price, total_tax, total_no_tax, line_items)
+select
+    update_order_summary.order_id,
+    coalesce(sum(l.total_price), 0),
+    coalesce(sum(l.total_tax), 0),
+    coalesce(sum(l.total_price - l.total_tax), 0),
+    coalesce(json_agg(l order by l.item_id), json_build_array())
+from
+    line_item_json l
+where
+    l.order_id = update_order_summary.order_id
+on conflict (order_id) do update set
+    total_price = excluded.total_price,
+    total_tax = excluded.total_tax,
+    total_no_tax = excluded.total_no_tax,
+    line_items = excluded.line_items
+$$ language sql
+    security invoker
+    set search_path = "$user", public;
+
+-- record the line items of a committed order in order_stats_hourly_delta, must only be called once per order.
+-- this happens in summarize_new_order at the end of the transaction, an order and its line items therefore have to be
+-- inserted in the same transaction.
+-- the rows are only appended, concurrent bookings never update the same row, see apply_order_stats_hourly_deltas.
+create or replace function add_order_to_hourly_stats(
+    order_id bigint
+) returns void as
+$$
+insert into order_stats_hourly_delta (node_id, product_id, hour, quantity, revenue)
+select
+    t.node_id,
+    li.product_id,
+    date_trunc('hour', o.booked_at, 'UTC') as hour,
+    sum(li.quantity),
+    sum(li.total_price)
+from
+    ordr o
+    join till t on o.till_id = t.id
+    join line_item li on o.id = li.order_id
+where
+    o.id = add_order_to_hourly_stats.order_id
+group by
+    t.node_id, li.product_id, hour
+$$ language sql
+    security invoker
+    set search_path = "$user", public;
+
+-- add all recorded order stats to order_stats_hourly, returns the number of applied deltas.
+-- rows are upserted in key order so concurrent runs touching the same rows cannot deadlock.
+create or replace function apply_order_stats_hourly_deltas() returns bigint as
+$$
+    with applied as (
+        delete from order_stats_hourly_delta returning node_id, product_id, hour, quantity, revenue
+    ), stats_delta as (
+        select
+            node_id,
+            product_id,
+            hour,
+            sum(quantity) as quantity,
+            sum(revenue)  as revenue,
+            count(*)      as n_deltas
+        from applied
+        group by node_id, product_id, hour
+    ), upserted as (
+        insert into order_stats_hourly (node_id, product_id, hour, quantity, revenue)
+        select node_id, product_id, hour, quantity, revenue
+        from stats_delta
+        order by node_id, product_id, hour
+        on conflict (node_id, product_id, hour) do update set
+            quantity = order_stats_hourly.quantity + excluded.quantity,
+            revenue = order_stats_hourly.revenue + excluded.revenue
+    )
+    select coalesce(sum(n_deltas), 0)::bigint from stats_delta;
+$$ language sql
+    set search_path = "$user", public;
@@ -310,6 +310,24 @@ class Order(BaseModel):
     line_items: list[LineItem]
 
 
+class OrderFilter(BaseModel):
+    till_id: Optional[int] = None
+    cashier_id: Optional[int] = None
+    customer_account_id: Optional[int] = None
+    order_type: Optional[OrderType] = None
+    # orders booked in the half open interval [booked_from, booked_until)
+    booked_from: Optional[datetime.datetime] = None
+    booked_until: Optional[datetime.datetime] = None
+
+
+class OrderPage(BaseModel):
+    """orders sorted by descending booking time"""
+
+    orders: list[Order]
+    # pass as cursor to fetch the next page, None if there are no more orders
+    next_cursor: Optional[str]
+
+
 class NewFreeTicketGrant(BaseModel):
     user_tag_uid: int
     initial_voucher_amount: int = 0
@@ -21,20 +21,32 @@ from stustapay.core.service.common.decorators import (
 from stustapay.core.service.common.error import InvalidArgument, NotFound
 from stustapay.core.service.transaction import book_transaction
 from stustapay.core.service.tree.common import fetch_node
-from stustapay.framework.database import Connection
+from stustapay.framework.database import Connection, register_statement
+
+_SYSTEM_ACCOUNT_STATEMENT = register_statement(
+    "system_account_for_node", "select * from account_with_history where type = $1 and node_id = any($2)"
+)
+# used while booking, reads neither the history nor the not yet applied balance changes of the account. reading the
+# latter would let concurrent serializable bookings on the same system account conflict with each other.
+_SYSTEM_ACCOUNT_ID_STATEMENT = register_statement(
+    "system_account_id_for_node", "select id from account where type = $1 and node_id = any($2)"
+)
+_ACCOUNT_BY_ID_STATEMENT = register_statement("account_by_id", "select * from account_with_history where id = $1")
 
 
 async def get_system_account_for_node(*, conn: Connection, node: Node, account_type: AccountType) -> Account:
-    return await conn.fetch_one(
-        Account,
-        "select * from account_with_history where type = $1 and node_id = any($2)",
-        account_type.value,
-        node.ids_to_event_node,
-    )
+    return await conn.fetch_one(Account, _SYSTEM_ACCOUNT_STATEMENT, account_type.value, node.ids_to_event_node)
+
+
+async def get_system_account_id_for_node(*, conn: Connection, node: Node, account_type: AccountType) -> int:
+    account_id = await conn.fetchval(_SYSTEM_ACCOUNT_ID_STATEMENT, account_type.value, node.ids_to_event_node)
+    if account_id is None:
+        raise NotFound(element_typ="account", element_id=account_type.value)
+    return account_id
 
 
 async def get_account_by_id(*, conn: Connection, account_id: int) -> Optional[Account]:
-    return await conn.fetch_maybe_one(Account, "select * from account_with_history where id = $1", account_id)
+    return await conn.fetch_maybe_one(Account, _ACCOUNT_BY_ID_STATEMENT, account_id)
 
 
 async def get_account_by_tag_uid(*, conn: Connection, tag_uid: int) -> Optional[Account]:
@@ -5,12 +5,16 @@ from jose import JWTError, jwt
 from pydantic import BaseModel, ValidationError
 
 from stustapay.core.schema.customer import Customer
-from stustapay.core.schema.terminal import CurrentTerminal, Terminal
-from stustapay.core.schema.till import Till
+from stustapay.core.schema.terminal import CurrentTerminal
+from stustapay.core.schema.tree import Node
 from stustapay.core.schema.user import CurrentUser
+from stustapay.core.service.common.cache import NotificationCache
 from stustapay.core.service.common.dbservice import DBService
-from stustapay.core.service.common.decorators import with_db_transaction
-from stustapay.framework.database import Connection
+from stustapay.core.service.common.decorators import (
+    fetch_user_privileges_at_node,
+    with_db_transaction,
+)
+from stustapay.framework.database import Connection, register_statement
 
 
 class UserTokenMetadata(BaseModel):
@@ -28,6 +32,67 @@ class TerminalTokenMetadata(BaseModel):
     session_uuid: uuid.UUID
 
 
+class UserPrivilegeCache(NotificationCache[tuple[int, int, Optional[str]], CurrentUser]):
+    """
+    Logged-in users by (user id, session id, node path), with their privileges at that node.
+    Without a node the privileges are the ones of all roles of the user.
+
+    The user_privileges_changed trigger sends the id of the user whose roles or sessions changed,
+    an empty payload if roles themselves changed.
+    """
+
+    def __init__(self):
+        super().__init__(name="user_privileges", channel="user_privileges", ttl=60)
+
+    async def handle_notification(self, payload: Optional[str]):
+        if not payload:
+            self.invalidate()
+            return
+
+        user_id = int(payload)
+        self.invalidate_matching(lambda key: key[0] == user_id)
+
+
+user_privilege_cache = UserPrivilegeCache()
+
+
+class TerminalSessionCache(NotificationCache[tuple[int, uuid.UUID], CurrentTerminal]):
+    """
+    Logged-in terminals by (terminal id, session uuid), together with their assigned till.
+
+    The terminal_session_changed trigger and till logins send the id of the affected terminal.
+    """
+
+    def __init__(self):
+        super().__init__(name="terminal_session", channel="terminal_session")
+
+    async def handle_notification(self, payload: Optional[str]):
+        if not payload:
+            self.invalidate()
+            return
+
+        terminal_id = int(payload)
+        self.invalidate_matching(lambda key: key[0] == terminal_id)
+
+
+terminal_session_cache = TerminalSessionCache()
+
+_USER_SESSION_STATEMENT = register_statement(
+    "user_session",
+    "select u.*, null as active_role_id "
+    "from user_with_privileges u join usr_session s on u.id = s.usr "
+    "where u.id = $1 and s.id = $2",
+)
+
+_TERMINAL_SESSION_STATEMENT = register_statement(
+    "terminal_session",
+    "select t.id, t.name, t.description, row_to_json(till) as till "
+    "from terminal t "
+    "join till on t.id = till.terminal_id "
+    "where t.id = $1 and t.session_uuid = $2",
+)
+
+
 class AuthService(DBService):
     """
     Extra service to check login tokens
@@ -64,20 +129,43 @@ class AuthService(DBService):
         encoded_jwt = jwt.encode(to_encode, self.cfg.core.secret_key, algorithm=self.cfg.core.jwt_token_algorithm)
         return encoded_jwt
 
-    @with_db_transaction(read_only=True)
-    async def get_user_from_token(self, *, conn: Connection, token: str) -> Optional[CurrentUser]:
-        token_payload = self.decode_user_jwt_payload(token)
-        if token_payload is None:
-            return None
-
-        return await conn.fetch_maybe_one(
+    @staticmethod
+    async def _fetch_user(
+        *, conn: Connection, token_payload: UserTokenMetadata, node: Optional[Node]
+    ) -> Optional[CurrentUser]:
+        user = await conn.fetch_maybe_one(
             CurrentUser,
-            "select u.*, null as active_role_id "
-            "from user_with_privileges u join usr_session s on u.id = s.usr "
-            "where u.id = $1 and s.id = $2",
+            _USER_SESSION_STATEMENT,
             token_payload.user_id,
             token_payload.session_id,
         )
+        if user is not None and node is not None:
+            user.privileges = await fetch_user_privileges_at_node(conn=conn, user_id=user.id, node=node)
+        return user
+
+    @with_db_transaction(read_only=True)
+    async def get_user_from_token(
+        self, *, conn: Connection, token: str, node: Optional[Node] = None
+    ) -> Optional[CurrentUser]:
+        """
+        get the user of a valid login session, if a node is given the user's privileges are the ones at this node.
+        Served from an in-process cache while its notification listener is running.
+        """
+        decoded_payload = self.decode_user_jwt_payload(token)
+        if decoded_payload is None:
+            return None
+        # bound to a non optional name, narrowing does not carry over into the loader
+        token_payload: UserTokenMetadata = decoded_payload
+
+        user = await user_privilege_cache.get_or_load(
+            (token_payload.user_id, token_payload.session_id, None if node is None else node.path),
+            lambda: self._fetch_user(conn=conn, token_payload=token_payload, node=node),
+            conn=conn,
+        )
+        if user is None:
+            return None
+        # the cached user is shared, callers may modify their copy
+        return user.model_copy()
 
     @with_db_transaction(read_only=True)
     async def get_customer_from_token(self, *, conn: Connection, token: str) -> Optional[Customer]:
@@ -111,28 +199,21 @@ class AuthService(DBService):
 
     @with_db_transaction(read_only=True)
     async def get_terminal_from_token(self, *, conn: Connection, token: str) -> Optional[CurrentTerminal]:
+        """
+        get a terminal with a valid login session which has a till assigned.
+        Served from an in-process cache while its notification listener is running.
+        """
         token_payload: TerminalTokenMetadata | None = self.decode_terminal_jwt_payload(token)
         if token_payload is None:
             return None
 
-        terminal = await conn.fetch_maybe_one(
-            Terminal,
-            "select t.*, till.id as till_id "
-            "from terminal t "
-            "left join till on t.id = till.terminal_id "
-            "where t.id = $1 and session_uuid = $2",
-            token_payload.terminal_id,
-            token_payload.session_uuid,
+        terminal_id, session_uuid = token_payload.terminal_id, token_payload.session_uuid
+        terminal = await terminal_session_cache.get_or_load(
+            (terminal_id, session_uuid),
+            lambda: conn.fetch_maybe_one(CurrentTerminal, _TERMINAL_SESSION_STATEMENT, terminal_id, session_uuid),
+            conn=conn,
         )
         if terminal is None:
             return None
-
-        till = await conn.fetch_maybe_one(
-            Till,
-            "select * from till where terminal_id = $1",
-            token_payload.terminal_id,
-        )
-        if till is None:
-            return None
-
-        return CurrentTerminal(id=terminal.id, name=terminal.name, description=terminal.description, till=till)
+        # the cached terminal is shared, callers may modify their copy
+        return terminal.model_copy()
@@ -28,7 +28,7 @@ from .order.booking import (
     book_money_transfer,
     book_order,
 )
-from .product import fetch_money_difference_product, fetch_product
+from .product import fetch_money_difference_product
 from .till.common import fetch_virtual_till
 from .user import AuthService
 
@@ -204,33 +204,58 @@ class CashierService(DBService):
             shift_start = shift.started_at
             shift_end = shift.ended_at
 
-        if shift_end is None:
-            rows = await conn.fetch(
-                "select li.product_id, sum(li.quantity) as quantity "
-                "from line_item li join ordr o on li.order_id = o.id "
-                "where o.cashier_id = $1 and o.booked_at >= $2 "
-                "group by li.product_id",
-                cashier_id,
-                shift_start,
-            )
-        else:
-            rows = await conn.fetch(
-                "select li.product_id, sum(li.quantity) as quantity "
-                "from line_item li join ordr o on li.order_id = o.id "
-                "where o.cashier_id = $1 and o.booked_at >= $2 and o.booked_at <= $3 "
-                "group by li.product_id",
-                cashier_id,
-                shift_start,
-                shift_end,
-            )
-        stats = CashierShiftStats(booked_products=[])
+        booked_products = await conn.fetch_many(
+            CashierShiftStats.CashierProductStats,
+            "select row_to_json(p) as product, s.quantity "
+            "from ( "
+            "   select li.product_id, sum(li.quantity) as quantity "
+            "   from line_item li join ordr o on li.order_id = o.id "
+            "   where o.cashier_id = $1 and o.booked_at >= $2 and ($3::timestamptz is null or o.booked_at <= $3) "
+            "   group by li.product_id "
+            ") s "
+            "join product_with_tax_and_restrictions p on s.product_id = p.id "
+            "where p.type = 'user_defined' and p.node_id = any($4) "
+            "order by p.id",
+            cashier_id,
+            shift_start,
+            shift_end,
+            node.ids_to_event_node,
+        )
+        return CashierShiftStats(booked_products=booked_products)
+
+    @with_db_transaction(read_only=True)
+    @requires_node()
+    @requires_user([Privilege.node_administration])
+    async def get_current_shift_stats_for_cashiers(
+        self, *, conn: Connection, node: Node
+    ) -> dict[int, CashierShiftStats]:
+        """stats of the current, not yet closed out shift of all cashiers visible at a node, keyed by cashier id"""
+        rows = await conn.fetch(
+            "select c.id as cashier_id, row_to_json(p) as product, s.quantity "
+            "from cashier c "
+            "left join ( "
+            "   select o.cashier_id, li.product_id, sum(li.quantity) as quantity "
+            "   from cashier c "
+            "   join ordr o on o.cashier_id = c.id and o.booked_at > coalesce(( "
+            "       select max(cs.ended_at) from cashier_shift cs where cs.cashier_id = c.id "
+            "   ), '1970-01-01'::timestamptz) "
+            "   join line_item li on li.order_id = o.id "
+            "   where c.node_id = any($1) "
+            "   group by o.cashier_id, li.product_id "
+            ") s on s.cashier_id = c.id "
+            "left join product_with_tax_and_restrictions p "
+            "   on s.product_id = p.id and p.type = 'user_defined' and p.node_id = any($1) "
+            "where c.node_id = any($1) "
+            "order by c.id, p.id",
+            node.ids_to_event_node,
+        )
+        stats: dict[int, CashierShiftStats] = {}
         for row in rows:
-            product = await fetch_product(conn=conn, node=node, product_id=row["product_id"])
-            if product is None:
-                continue
-            stats.booked_products.append(
-                CashierShiftStats.CashierProductStats(product=product, quantity=row["quantity"])
-            )
+            cashier_stats = stats.setdefault(row["cashier_id"], CashierShiftStats(booked_products=[]))
+            if row["product"] is not None:
+                cashier_stats.booked_products.append(
+                    CashierShiftStats.CashierProductStats(product=row["product"], quantity=row["quantity"])
+                )
         return stats
 
     @with_retryable_db_transaction()
@@ -0,0 +1,217 @@
+"""
+in-process caches invalidated by database notifications
+"""
+
+import logging
+import time
+from typing import Awaitable, Callable, Generic, Hashable, Optional, Sequence, TypeVar
+
+import asyncpg
+from pydantic import BaseModel, computed_field
+
+from stustapay.core.service.common.dbhook import DBHook
+from stustapay.framework.database import Connection
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class CacheStats(BaseModel):
+    name: str
+    enabled: bool
+    size: int
+    hits: int
+    misses: int
+    invalidations: int
+
+    @computed_field  # type: ignore[misc]
+    @property
+    def hit_rate(self) -> float:
+        if self.hits + self.misses == 0:
+            return 0.0
+        return self.hits / (self.hits + self.misses)
+
+
+# all caches of this process by name, for reporting their stats
+_caches: dict[str, "NotificationCache"] = {}
+
+
+class NotificationCache(Generic[K, V]):
+    """
+    In-process key value cache whose entries are dropped whenever a pg_notify notification arrives on its channel.
+
+    Entries are only handed out while the cache is subscribed to its channel, i.e. while `listen` is running.
+    Without a subscription we would not notice changes in the database, so every lookup is a miss.
+    The optional ttl is a fallback for notifications we might have missed while reconnecting to the database.
+    With max_entries the least recently used entries are dropped once the cache grows beyond this size.
+    """
+
+    def __init__(self, name: str, channel: str, ttl: Optional[float] = None, max_entries: Optional[int] = None):
+        self.name = name
+        self.channel = channel
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.logger = logging.getLogger(__name__)
+
+        self._entries: dict[K, tuple[float, V]] = {}
+        # incremented on each invalidation, values loaded before an invalidation must not be stored
+        self._generation = 0
+        # time.monotonic() of the last invalidation, values read from an older database snapshot must not be stored
+        self._invalidated_at = time.monotonic()
+        self._n_listeners = 0
+        self._db_pool: Optional[asyncpg.Pool] = None
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        _caches[name] = self
+
+    @property
+    def enabled(self) -> bool:
+        return self._n_listeners > 0
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def get(self, key: K) -> Optional[V]:
+        if not self.enabled:
+            return None
+
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        stored_at, value = entry
+        if self.ttl is not None and time.monotonic() - stored_at > self.ttl:
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None
+
+        if self.max_entries is not None:
+            # dicts keep their insertion order, the first entry is the least recently used one
+            self._entries[key] = self._entries.pop(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: K, value: V, generation: int):
+        """
+        store a value which was loaded while the cache was at the given generation.
+        If the cache was invalidated in the meantime the loaded value might already be outdated and is discarded.
+        """
+        if not self.enabled or generation != self._generation:
+            return
+        self._entries[key] = (time.monotonic(), value)
+        if self.max_entries is not None and len(self._entries) > self.max_entries:
+            del self._entries[next(iter(self._entries))]
+
+    async def get_or_load(
+        self, key: K, loader: Callable[[], Awaitable[Optional[V]]], conn: Optional[Connection] = None
+    ) -> Optional[V]:
+        """
+        get a cached value or load it with the given loader.
+        conn is the connection the loader reads from. If it is in a transaction the loaded value is only stored if the
+        transaction started after the last invalidation, an older snapshot might not contain the change which caused
+        the invalidation. Without conn the loader has to read from a snapshot taken after it was called.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        generation = self._generation
+        if conn is not None and conn.is_in_transaction():
+            snapshot_taken_after = conn.transaction_started_at
+        else:
+            snapshot_taken_after = time.monotonic()
+        value = await loader()
+        if value is not None and snapshot_taken_after is not None and snapshot_taken_after > self._invalidated_at:
+            self.put(key, value, generation)
+        return value
+
+    def invalidate(self, key: Optional[K] = None):
+        """drop a single entry or, if no key is given, all entries"""
+        self._generation += 1
+        self._invalidated_at = time.monotonic()
+        self.invalidations += 1
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+    def invalidate_matching(self, predicate: Callable[[K], bool]):
+        """drop all entries whose key matches the given predicate"""
+        self._generation += 1
+        self._invalidated_at = time.monotonic()
+        self.invalidations += 1
+        for key in [key for key in self._entries if predicate(key)]:
+            del self._entries[key]
+
+    async def handle_notification(self, payload: Optional[str]):
+        """
+        called for every notification on our channel, by default all entries are dropped.
+        The payload is None once after (re)connecting to the database, as we might have missed notifications.
+        Subclasses can override this to selectively invalidate entries based on the payload.
+        """
+        del payload
+        self.invalidate()
+
+    def _start_listening(self, db_pool: asyncpg.Pool):
+        self._db_pool = db_pool
+        self._n_listeners += 1
+        self.logger.info(f"Enabling cache {self.name}, listening for notifications on channel {self.channel}")
+
+    def _stop_listening(self):
+        self._n_listeners -= 1
+        self.invalidate()
+
+    async def listen(self, db_pool: asyncpg.Pool):
+        """subscribe to the notification channel of this cache and keep the cache enabled until cancelled"""
+        await listen_for_invalidations(db_pool, [self])
+
+    def stats(self) -> CacheStats:
+        return CacheStats(
+            name=self.name,
+            enabled=self.enabled,
+            size=len(self._entries),
+            hits=self.hits,
+            misses=self.misses,
+            invalidations=self.invalidations,
+        )
+
+
+def cache_stats() -> list[CacheStats]:
+    return [cache.stats() for cache in _caches.values()]
+
+
+async def listen_for_invalidations(db_pool: asyncpg.Pool, caches: Sequence[NotificationCache]):
+    """
+    Subscribe to the notification channels of all given caches and keep them enabled until cancelled.
+    All channels share a single listening database connection, so each process should listen for all of its caches
+    with one call.
+    """
+    caches_by_channel: dict[str, list[NotificationCache]] = {}
+    for cache in caches:
+        caches_by_channel.setdefault(cache.channel, []).append(cache)
+
+    def make_event_handler(channel_caches: list[NotificationCache]):
+        async def handle_notification(payload: Optional[str]):
+            for cache in channel_caches:
+                await cache.handle_notification(payload)
+
+        return handle_notification
+
+    hook = DBHook.for_channels(
+        pool=db_pool,
+        event_handlers={
+            channel: make_event_handler(channel_caches) for channel, channel_caches in caches_by_channel.items()
+        },
+        initial_run=True,
+    )
+    for cache in caches:
+        cache._start_listening(db_pool)  # pylint: disable=protected-access
+    try:
+        await hook.run()
+    finally:
+        for cache in caches:
+            cache._stop_listening()  # pylint: disable=protected-access
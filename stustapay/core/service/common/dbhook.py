@@ -12,17 +12,20 @@ import asyncpg.exceptions
 
 from stustapay.framework.database import Connection
 
+EventHandler = Callable[[Optional[str]], Awaitable[Optional[StopIteration]]]
+
 
 class DBHook:
     """
     Implements a database hook to subscribe to one specific pg_notify notification channel.
+    Several channels can share the connection of one hook, see for_channels.
     """
 
     def __init__(
         self,
         pool: asyncpg.Pool,
         channel: str,
-        event_handler: Callable[[Optional[str]], Awaitable[Optional[StopIteration]]],
+        event_handler: EventHandler,
         initial_run: bool = False,
         hook_timeout: int = 5,
     ):
@@ -36,12 +39,35 @@ class DBHook:
         self.channel = channel
         self.event_handler = event_handler
         assert inspect.iscoroutinefunction(event_handler)
+        self.event_handlers: dict[str, EventHandler] = {channel: event_handler}
         self.initial_run = initial_run
         self.timelimit = hook_timeout
 
-        self.events: asyncio.Queue[str | StopIteration] = asyncio.Queue(maxsize=2048)
+        self.events: asyncio.Queue[tuple[str, str] | StopIteration] = asyncio.Queue(maxsize=2048)
         self.logger = logging.getLogger(__name__)
 
+    @classmethod
+    def for_channels(
+        cls,
+        pool: asyncpg.Pool,
+        event_handlers: dict[str, EventHandler],
+        initial_run: bool = False,
+        hook_timeout: int = 5,
+    ) -> "DBHook":
+        """
+        subscribe to several channels on a single database connection, event_handlers maps each channel to its handler.
+        Notifications are handled one after another in the order they arrived, regardless of their channel.
+        """
+        assert len(event_handlers) > 0
+        channel, event_handler = next(iter(event_handlers.items()))
+        hook = cls(
+            pool=pool, channel=channel, event_handler=event_handler, initial_run=initial_run, hook_timeout=hook_timeout
+        )
+        for handler in event_handlers.values():
+            assert inspect.iscoroutinefunction(handler)
+        hook.event_handlers = dict(event_handlers)
+        return hook
+
     @contextlib.asynccontextmanager
     async def acquire_conn(self):
         async with self.db_pool.acquire() as conn:
@@ -52,10 +78,12 @@ class DBHook:
                 await self._deregister(conn=conn)
 
     async def _register(self, conn: Connection):
-        await conn.add_listener(self.channel, self.notification_callback)
+        for channel in self.event_handlers:
+            await conn.add_listener(channel, self.notification_callback)
 
     async def _deregister(self, conn: Connection):
-        await conn.remove_listener(self.channel, self.notification_callback)
+        for channel in self.event_handlers:
+            await conn.remove_listener(channel, self.notification_callback)
 
     def stop(self):
         # proper way of clearing asyncio queue
@@ -76,18 +104,20 @@ class DBHook:
             try:
                 async with self.acquire_conn():
                     if self.initial_run:
-                        # run the handler once to process pending data
-                        ret = await self.event_handler(None)
-                        if ret is StopIteration:
-                            return
+                        # run the handlers once to process pending data
+                        for event_handler in self.event_handlers.values():
+                            ret = await event_handler(None)
+                            if ret is StopIteration:
+                                return
 
                     # handle events
                     while True:
-                        event: str | StopIteration = await self.events.get()
+                        event: tuple[str, str] | StopIteration = await self.events.get()
                         if isinstance(event, StopIteration):
                             return
 
-                        ret = await asyncio.wait_for(self.event_handler(event), self.timelimit)
+                        channel, payload = event
+                        ret = await asyncio.wait_for(self.event_handlers[channel](payload), self.timelimit)
                         self.events.task_done()
                         if ret == StopIteration:
                             return
@@ -107,5 +137,5 @@ class DBHook:
         runs whenever we get a psql notification through pg_notify
         """
         del connection, pid
-        assert channel == self.channel
-        self.events.put_nowait(payload)
+        assert channel in self.event_handlers
+        self.events.put_nowait((channel, payload))
@@ -1,10 +1,11 @@
 import asyncio
+import contextlib
 import logging
-import random
+import time
 from functools import wraps
 from inspect import Parameter, signature
 from itertools import chain
-from typing import Awaitable, Callable, Optional, TypeVar, overload
+from typing import AsyncIterator, Awaitable, Callable, Optional, TypeVar, overload
 
 import asyncpg.exceptions
 
@@ -18,19 +19,40 @@ from stustapay.core.service.common.error import (
     ResourceNotAllowed,
     Unauthorized,
 )
+from stustapay.core.service.common.retry import (
+    CONFLICT_ERRORS,
+    DEFAULT_RETRY_POLICY,
+    RetryPolicy,
+    lock_customer_account,
+    register_retry_state,
+)
 from stustapay.core.service.tree.common import fetch_node
-from stustapay.framework.database import Connection
+from stustapay.framework.database import Connection, register_statement
 
 R = TypeVar("R")
 
 
+# waiting longer than this many seconds for a database connection is logged, the pool is probably too small
+SLOW_CONNECTION_WAIT = 0.1
+
+
+@contextlib.asynccontextmanager
+async def _acquire_connection(db_pool: asyncpg.Pool, func: Callable) -> AsyncIterator[Connection]:
+    start = time.monotonic()
+    async with db_pool.acquire() as conn:
+        wait = time.monotonic() - start
+        if wait > SLOW_CONNECTION_WAIT:
+            logging.warning(f"{func.__qualname__} waited {wait:.3f} seconds for a database connection")
+        yield conn
+
+
 def with_db_connection(func: Callable[..., Awaitable[R]]) -> Callable[..., Awaitable[R]]:
     @wraps(func)
     async def wrapper(self, **kwargs):
         if "conn" in kwargs:
             return await func(self, **kwargs)
 
-        async with self.db_pool.acquire() as conn:
+        async with _acquire_connection(self.db_pool, func) as conn:
             return await func(self, conn=conn, **kwargs)
 
     return wrapper
@@ -63,46 +85,84 @@ def with_db_isolation_transaction(func, read_only: bool = False):
         if "conn" in kwargs:
             return await func(self, **kwargs)
 
-        async with self.db_pool.acquire() as conn:
+        async with _acquire_connection(self.db_pool, func) as conn:
             async with conn.transaction(isolation=None if read_only else "serializable"):
                 return await func(self, conn=conn, **kwargs)
 
     return wrapper
 
 
+async def _authenticate_before_locking(self, conn: Connection, kwargs: dict) -> dict:
+    """
+    Resolve the terminal or user token of a call before it waits for a customer account lock, so only authenticated
+    calls can hold the lock. requires_terminal and requires_user take the resolved terminal or user from the arguments
+    and still check the till and the privileges in the transaction.
+    """
+    token = kwargs.get("token")
+    if token is None or "current_terminal" in kwargs or "current_user" in kwargs:
+        return kwargs
+
+    if self.__class__.__name__ == "AuthService":
+        auth_service = self
+    elif hasattr(self, "auth_service"):
+        auth_service = self.auth_service
+    else:
+        raise RuntimeError("authenticating a call needs self.auth_service to be a AuthService instance")
+
+    if auth_service.decode_terminal_jwt_payload(token) is not None:
+        terminal = await auth_service.get_terminal_from_token(conn=conn, token=token)
+        if terminal is None:
+            raise Unauthorized("invalid terminal token")
+        return {**kwargs, "current_terminal": terminal}
+
+    user = await auth_service.get_user_from_token(conn=conn, token=token)
+    if user is None:
+        raise Unauthorized("invalid user token")
+    return {**kwargs, "current_user": user}
+
+
 def with_retryable_db_transaction(
-    n_retries: int = 10, read_only: bool = False
+    read_only: bool = False,
+    retry_policy: RetryPolicy = DEFAULT_RETRY_POLICY,
+    lock_customer_tag_uid: Optional[Callable[[dict], Optional[int]]] = None,
 ) -> Callable[[Callable[..., Awaitable[R]]], Callable[..., Awaitable[R]]]:
+    """
+    Run the decorated function in a serializable transaction which is retried on serialization failures and deadlocks
+    according to the retry policy. The database connection is returned to the pool while waiting between retries.
+
+    lock_customer_tag_uid can return the customer tag uid from the keyword arguments of a call. Calls for the same
+    customer then take an advisory lock on the customer account and are run one after another instead of conflicting.
+    The token of such a call is checked before waiting for the lock.
+    """
+
     def f(func: Callable[..., Awaitable[R]]):
+        retry_state = register_retry_state(name=func.__qualname__, policy=retry_policy)
+
         @wraps(func)
         async def wrapper(self, **kwargs):
-            current_retries = n_retries
             if "conn" in kwargs:
                 return await func(self, **kwargs)
 
-            async with self.db_pool.acquire() as conn:
-                exception = None
-                while current_retries > 0:
-                    try:
-                        async with conn.transaction(isolation=None if read_only else "serializable"):
-                            return await func(self, conn=conn, **kwargs)
-                    except (asyncpg.exceptions.DeadlockDetectedError, asyncpg.exceptions.SerializationError) as e:
-                        current_retries -= 1
-                        # random quadratic back off, with a max of 1 second
-                        delay = min(random.random() * (n_retries - current_retries) ** 2 * 0.0001, 1.0)
-                        if delay == 1.0:
-                            logging.warning(
-                                "Max waiting time in quadratic back off of one second reached,"
-                                "check if there is any problem with your database transactions."
-                            )
-                        await asyncio.sleep(delay)
-
-                        exception = e
-
-                if exception:
-                    raise exception
-                else:
-                    raise RuntimeError("Unexpected error")
+            customer_tag_uid = lock_customer_tag_uid(kwargs) if lock_customer_tag_uid is not None else None
+            retry_state.record_call()
+            retry = 0
+            while True:
+                account_id = None
+                try:
+                    async with _acquire_connection(self.db_pool, func) as conn:
+                        if customer_tag_uid is not None:
+                            kwargs = await _authenticate_before_locking(self, conn, kwargs)
+                        async with lock_customer_account(conn, customer_tag_uid) as account_id:
+                            async with conn.transaction(isolation=None if read_only else "serializable"):
+                                return await func(self, conn=conn, **kwargs)
+                except CONFLICT_ERRORS as e:
+                    retry_state.record_conflict(e, account_id=account_id)
+                    delay = retry_state.next_backoff(retry)
+                    if delay is None:
+                        logging.warning(f"{func.__qualname__} failed after {retry} retries: {e}")
+                        raise
+                    retry += 1
+                    await asyncio.sleep(delay)
 
         return wrapper
 
@@ -156,6 +216,40 @@ def requires_node(
     return f
 
 
+_USER_PRIVILEGES_AT_NODE_STATEMENT = register_statement(
+    "user_privileges_at_node",
+    "select privileges "
+    "from user_to_role utr join user_role_with_privileges urwp on utr.role_id = urwp.id "
+    "where utr.node_id = any($1) and urwp.node_id = any($1) and utr.user_id = $2",
+)
+
+_TERMINAL_TILL_STATEMENT = register_statement(
+    "terminal_till", "select * from till_with_cash_register where terminal_id = $1"
+)
+
+_TILL_ACTIVE_USER_STATEMENT = register_statement(
+    "till_active_user",
+    "select "
+    "   usr.*, "
+    "   urwp.privileges as privileges, "
+    "   $2::bigint as active_role_id, "
+    "   urwp.name as active_role_name "
+    "from usr "
+    "join user_to_role utr on utr.user_id = usr.id "
+    "join user_role_with_privileges urwp on urwp.id = utr.role_id "
+    "where usr.id = $1 and utr.role_id = $2",
+)
+
+
+async def fetch_user_privileges_at_node(*, conn: Connection, user_id: int, node: Node) -> list[Privilege]:
+    role_privileges = await conn.fetch(
+        _USER_PRIVILEGES_AT_NODE_STATEMENT,
+        node.ids_to_root,
+        user_id,
+    )
+    return [Privilege(p) for p in set(chain.from_iterable(row["privileges"] for row in role_privileges))]
+
+
 def requires_user(
     privileges: list[Privilege] | None = None,
     node_required: bool = True,
@@ -183,36 +277,31 @@ def requires_user(
             token = kwargs.get("token")
             user: CurrentUser | None = kwargs.get("current_user")
             conn: Connection = kwargs["conn"]
+            node: Node | None = kwargs.get("node")
+            if node_required and node is None:
+                raise RuntimeError("requires_user needs requires_node to be placed before it")
+
             if user is None:
+                # the privileges of a user loaded from a token are already resolved at the given node
+                user_node = node if node_required else None
                 if self.__class__.__name__ == "AuthService":
-                    user = await self.get_user_from_token(conn=conn, token=token)
+                    user = await self.get_user_from_token(conn=conn, token=token, node=user_node)
                 elif hasattr(self, "auth_service"):
-                    user = await self.auth_service.get_user_from_token(conn=conn, token=token)
+                    user = await self.auth_service.get_user_from_token(conn=conn, token=token, node=user_node)
                 else:
                     raise RuntimeError("requires_user needs self.auth_service to be a AuthService instance")
 
-            if user is None:
-                raise Unauthorized("invalid user token")
-
-            if node_required:
-                node: Node | None = kwargs.get("node")
-                if node is None:
-                    raise RuntimeError("requires_user needs requires_node to be placed before it")
-                role_privileges = await conn.fetch(
-                    "select privileges "
-                    "from user_to_role utr join user_role_with_privileges urwp on utr.role_id = urwp.id "
-                    "where utr.node_id = any($1) and urwp.node_id = any($1) and utr.user_id = $2",
-                    node.ids_to_root,
-                    user.id,
-                )
-                user_privileges = set(chain.from_iterable(row["privileges"] for row in role_privileges))
-                user.privileges = list(user_privileges)
+                if user is None:
+                    raise Unauthorized("invalid user token")
+            elif node_required:
+                assert node is not None
+                user.privileges = await fetch_user_privileges_at_node(conn=conn, user_id=user.id, node=node)
 
-                if privileges:
-                    if not any([p.value in user_privileges for p in privileges]):
-                        raise AccessDenied(
-                            f"user does not have any of the required privileges: {[p.value for p in privileges]}"
-                        )
+            if node_required and privileges:
+                if not any([p in user.privileges for p in privileges]):
+                    raise AccessDenied(
+                        f"user does not have any of the required privileges: {[p.value for p in privileges]}"
+                    )
 
             if "current_user" in original_signature.parameters:
                 kwargs["current_user"] = user
@@ -328,25 +417,15 @@ def requires_terminal(
             if terminal is None:
                 raise Unauthorized("invalid terminal token")
 
-            till = await conn.fetch_maybe_one(
-                Till,
-                "select * from till_with_cash_register where terminal_id = $1",
-                terminal.id,
-            )
+            till = await conn.fetch_maybe_one(Till, _TERMINAL_TILL_STATEMENT, terminal.id)
             if till is None:
                 raise Unauthorized("terminal does not have a till ")
+            # the terminal might have been served from a cache, always hand out the current till state
+            terminal = terminal.model_copy(update={"till": till})
 
             logged_in_user = await kwargs["conn"].fetch_maybe_one(
                 CurrentUser,
-                "select "
-                "   usr.*, "
-                "   urwp.privileges as privileges, "
-                "   $2::bigint as active_role_id, "
-                "   urwp.name as active_role_name "
-                "from usr "
-                "join user_to_role utr on utr.user_id = usr.id "
-                "join user_role_with_privileges urwp on urwp.id = utr.role_id "
-                "where usr.id = $1 and utr.role_id = $2",
+                _TILL_ACTIVE_USER_STATEMENT,
                 till.active_user_id,
                 till.active_user_role_id,
             )
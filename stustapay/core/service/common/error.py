@@ -72,3 +72,17 @@ class Unauthorized(ServiceException):
 
     def __str__(self):
         return self.msg
+
+
+class ResourceBusy(ServiceException):
+    """
+    raised, when a resource is locked by a concurrent request for too long
+    """
+
+    id = "ResourceBusy"
+
+    def __init__(self, msg: str):
+        self.msg = msg
+
+    def __str__(self):
+        return self.msg
@@ -0,0 +1,174 @@
+"""
+retrying of database transactions which failed because of a conflict with a concurrent transaction
+"""
+
+import contextlib
+import random
+from collections import Counter
+from dataclasses import dataclass
+from typing import AsyncIterator, Optional
+
+import asyncpg.exceptions
+from pydantic import BaseModel
+
+from stustapay.core.service.common.error import ResourceBusy
+from stustapay.framework.database import Connection, register_statement
+
+# exceptions after which a transaction can simply be run again
+CONFLICT_ERRORS = (asyncpg.exceptions.SerializationError, asyncpg.exceptions.DeadlockDetectedError)
+
+# prefix of the account id which is hashed to the bigint key of the advisory lock on a customer account
+CUSTOMER_ACCOUNT_LOCK_NAMESPACE = "customer_account:"
+# seconds a call waits for the lock on a customer account before giving up
+CUSTOMER_ACCOUNT_LOCK_TIMEOUT = 5.0
+
+# number of accounts with the most conflicts which are reported in the retry stats
+N_REPORTED_CONFLICTING_ACCOUNTS = 10
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    # retries of a single call, after that the conflict is raised to the caller
+    max_retries: int = 10
+    # the n-th retry waits a random time between zero and base_delay * 2^n seconds, capped by max_delay
+    base_delay: float = 0.002
+    max_delay: float = 0.5
+    # Retries of a decorated function are limited by a budget: every call adds budget_ratio retries to it,
+    # up to budget_max. Once it is used up conflicts are raised without retrying until enough calls succeeded,
+    # so a conflict storm does not multiply the load on the database.
+    budget_ratio: float = 0.2
+    budget_max: float = 100.0
+
+    def backoff(self, retry: int) -> float:
+        return random.uniform(0, min(self.base_delay * 2**retry, self.max_delay))
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
+
+
+class RetryStats(BaseModel):
+    name: str
+    calls: int
+    serialization_failures: int
+    deadlocks: int
+    retries: int
+    # calls which failed with a conflict after running out of retries or budget
+    failures: int
+    budget_exhausted: int
+    # seconds spent waiting between retries
+    total_backoff: float
+    # (account id, number of conflicts) of the customer accounts locked by the conflicting transactions
+    conflicting_accounts: list[tuple[int, int]]
+
+
+class RetryState:
+    """retry budget and conflict counters of a function decorated with with_retryable_db_transaction"""
+
+    def __init__(self, name: str, policy: RetryPolicy):
+        self.name = name
+        self.policy = policy
+        self.budget = policy.budget_max
+
+        self.calls = 0
+        self.serialization_failures = 0
+        self.deadlocks = 0
+        self.retries = 0
+        self.failures = 0
+        self.budget_exhausted = 0
+        self.total_backoff = 0.0
+        self.conflicting_accounts: Counter[int] = Counter()
+
+    def record_call(self):
+        self.calls += 1
+        self.budget = min(self.budget + self.policy.budget_ratio, self.policy.budget_max)
+
+    def record_conflict(self, exception: Exception, account_id: Optional[int]):
+        if isinstance(exception, asyncpg.exceptions.DeadlockDetectedError):
+            self.deadlocks += 1
+        else:
+            self.serialization_failures += 1
+        if account_id is not None:
+            self.conflicting_accounts[account_id] += 1
+
+    def next_backoff(self, retry: int) -> Optional[float]:
+        """seconds to wait before the given retry, None if the call should give up"""
+        if retry >= self.policy.max_retries:
+            self.failures += 1
+            return None
+        if self.budget < 1:
+            self.budget_exhausted += 1
+            self.failures += 1
+            return None
+
+        self.budget -= 1
+        self.retries += 1
+        delay = self.policy.backoff(retry)
+        self.total_backoff += delay
+        return delay
+
+    def stats(self) -> RetryStats:
+        return RetryStats(
+            name=self.name,
+            calls=self.calls,
+            serialization_failures=self.serialization_failures,
+            deadlocks=self.deadlocks,
+            retries=self.retries,
+            failures=self.failures,
+            budget_exhausted=self.budget_exhausted,
+            total_backoff=self.total_backoff,
+            conflicting_accounts=self.conflicting_accounts.most_common(N_REPORTED_CONFLICTING_ACCOUNTS),
+        )
+
+
+_retry_states: dict[str, RetryState] = {}
+
+
+def register_retry_state(name: str, policy: RetryPolicy) -> RetryState:
+    state = RetryState(name=name, policy=policy)
+    _retry_states[name] = state
+    return state
+
+
+def retry_stats() -> list[RetryStats]:
+    return [state.stats() for state in _retry_states.values()]
+
+
+_LOCK_CUSTOMER_ACCOUNT_STATEMENT = register_statement(
+    "lock_customer_account",
+    "select a.id, k.lock_key, pg_advisory_lock(k.lock_key) "
+    "from account a, lateral (select hashtextextended($1 || a.id::text, 0) as lock_key) k "
+    "where a.user_tag_uid = $2 and a.type = 'private'",
+)
+_UNLOCK_CUSTOMER_ACCOUNT_STATEMENT = register_statement("unlock_customer_account", "select pg_advisory_unlock($1)")
+_SET_LOCK_TIMEOUT_STATEMENT = register_statement("set_lock_timeout", "select set_config('lock_timeout', $1, false)")
+
+
+@contextlib.asynccontextmanager
+async def lock_customer_account(conn: Connection, customer_tag_uid: Optional[int]) -> AsyncIterator[Optional[int]]:
+    """
+    Serialize transactions on the account of a customer by holding an advisory lock while they run.
+    The lock has to be held on the session and taken before the transaction starts, a serializable transaction waiting
+    for it would still work on a snapshot from before the transaction holding the lock committed.
+    Yields the id of the locked account, None if the tag does not belong to a customer.
+    Raises ResourceBusy if the lock is not granted within CUSTOMER_ACCOUNT_LOCK_TIMEOUT seconds.
+    """
+    if customer_tag_uid is None:
+        yield None
+        return
+
+    await conn.fetchval(_SET_LOCK_TIMEOUT_STATEMENT, f"{CUSTOMER_ACCOUNT_LOCK_TIMEOUT * 1000:.0f}ms")
+    try:
+        row = await conn.fetchrow(_LOCK_CUSTOMER_ACCOUNT_STATEMENT, CUSTOMER_ACCOUNT_LOCK_NAMESPACE, customer_tag_uid)
+    except asyncpg.exceptions.LockNotAvailableError:
+        raise ResourceBusy("the customer account is busy with another order, please try again") from None
+    finally:
+        await conn.execute("reset lock_timeout")
+
+    if row is None:
+        yield None
+        return
+    try:
+        yield row["id"]
+    finally:
+        if not conn.is_closed():
+            await conn.fetchval(_UNLOCK_CUSTOMER_ACCOUNT_STATEMENT, row["lock_key"])
@@ -9,9 +9,10 @@ from pydantic import BaseModel
 from schwifty import IBAN
 
 from stustapay.core.config import Config
-from stustapay.core.schema.customer import Customer, OrderWithBon
+from stustapay.core.schema.customer import Customer, OrderWithBon, OrderWithBonPage
 from stustapay.core.schema.tree import Language
 from stustapay.core.service.auth import AuthService, CustomerTokenMetadata
+from stustapay.core.service.common.cache import NotificationCache
 from stustapay.core.service.common.dbservice import DBService
 from stustapay.core.service.common.decorators import (
     requires_customer,
@@ -21,6 +22,11 @@ from stustapay.core.service.common.error import AccessDenied, InvalidArgument
 from stustapay.core.service.config import ConfigService
 from stustapay.core.service.customer.payout import PayoutService
 from stustapay.core.service.customer.sumup import SumupService
+from stustapay.core.service.order.order import (
+    ORDER_PAGE_MAX_SIZE,
+    decode_order_cursor,
+    encode_order_cursor,
+)
 from stustapay.core.service.tree.common import fetch_event_node_for_node
 from stustapay.framework.database import Connection
 
@@ -49,6 +55,60 @@ class CustomerBank(BaseModel):
     donation: float = 0.0
 
 
+class CustomerOrderHistoryCache(NotificationCache[tuple[int, Optional[str], int], OrderWithBonPage]):
+    """
+    Pages of the order history of a customer by (customer account id, cursor, page size).
+    Cursor and page size are chosen by the clients, the number of cached pages is therefore bounded.
+
+    New orders of a customer and their generated bons send the id of the customer account.
+    """
+
+    MAX_ENTRIES = 10_000
+
+    def __init__(self):
+        super().__init__(name="customer_orders", channel="customer_orders", ttl=300, max_entries=self.MAX_ENTRIES)
+
+    async def handle_notification(self, payload: Optional[str]):
+        if not payload:
+            self.invalidate()
+            return
+
+        customer_account_id = int(payload)
+        self.invalidate_matching(lambda key: key[0] == customer_account_id)
+
+
+customer_order_history_cache = CustomerOrderHistoryCache()
+
+
+async def _fetch_order_history_page(
+    *, conn: Connection, customer_account_id: int, cursor: Optional[str], limit: int
+) -> OrderWithBonPage:
+    if cursor is None:
+        orders = await conn.fetch_many(
+            OrderWithBon,
+            "select * from order_value_with_bon where customer_account_id = $1 "
+            "order by booked_at desc, id desc limit $2",
+            customer_account_id,
+            limit + 1,
+        )
+    else:
+        booked_at, order_id = decode_order_cursor(cursor)
+        orders = await conn.fetch_many(
+            OrderWithBon,
+            "select * from order_value_with_bon where customer_account_id = $1 and (booked_at, id) < ($2, $3) "
+            "order by booked_at desc, id desc limit $4",
+            customer_account_id,
+            booked_at,
+            order_id,
+            limit + 1,
+        )
+    # we fetched one more order than requested to know whether there is a next page
+    if len(orders) <= limit:
+        return OrderWithBonPage(orders=orders, next_cursor=None)
+    orders = orders[:limit]
+    return OrderWithBonPage(orders=orders, next_cursor=encode_order_cursor(orders[-1]))
+
+
 class CustomerService(DBService):
     def __init__(self, db_pool: asyncpg.Pool, config: Config, auth_service: AuthService, config_service: ConfigService):
         super().__init__(db_pool, config)
@@ -112,6 +172,24 @@ class CustomerService(DBService):
             current_customer.id,
         )
 
+    @with_db_transaction(read_only=True)
+    @requires_customer
+    async def get_orders_with_bon_paginated(
+        self, *, conn: Connection, current_customer: Customer, cursor: Optional[str] = None, limit: int = 20
+    ) -> OrderWithBonPage:
+        if not 0 < limit <= ORDER_PAGE_MAX_SIZE:
+            raise InvalidArgument(f"The page size must be between 1 and {ORDER_PAGE_MAX_SIZE}")
+
+        page = await customer_order_history_cache.get_or_load(
+            (current_customer.id, cursor, limit),
+            lambda: _fetch_order_history_page(
+                conn=conn, customer_account_id=current_customer.id, cursor=cursor, limit=limit
+            ),
+            conn=conn,
+        )
+        assert page is not None
+        return page
+
     @with_db_transaction
     @requires_customer
     async def update_customer_info(
@@ -156,7 +234,7 @@ class CustomerService(DBService):
             customer_bank.account_name,
             customer_bank.email,
             round(customer_bank.donation, 2),
-            current_customer.balance-customer_bank.donation
+            current_customer.balance - customer_bank.donation,
         )
 
     async def check_payout_run(self, conn: Connection, current_customer: Customer) -> None:
@@ -9,8 +9,34 @@ from stustapay.core.schema.order import OrderType, PaymentMethod
 from stustapay.core.schema.tree import Node
 from stustapay.core.service.common.error import InvalidArgument
 from stustapay.core.service.product import fetch_money_transfer_product
-from stustapay.core.service.transaction import book_transaction
-from stustapay.framework.database import Connection
+from stustapay.core.service.transaction import book_transactions
+from stustapay.framework.database import Connection, register_statement
+
+_TILL_Z_NR_STATEMENT = register_statement("till_z_nr", "select z_nr from till where id = $1")
+
+# duplicate uuids are detected by the unique index on ordr.uuid instead of checking for them up front
+_INSERT_ORDER_STATEMENT = register_statement(
+    "insert_order",
+    "insert into ordr (uuid, item_count, payment_method, order_type, cancels_order, cashier_id, "
+    "   till_id, customer_account_id, cash_register_id, z_nr) "
+    "values ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10) "
+    "on conflict (uuid) do nothing "
+    "returning id, uuid, booked_at",
+)
+
+# insert all line items of an order in one go, the i-th array element of each column belongs to the i-th line item
+_INSERT_LINE_ITEMS_STATEMENT = register_statement(
+    "insert_line_items",
+    "insert into line_item (order_id, item_id, product_id, product_price, quantity, tax_rate_id, tax_name, tax_rate) "
+    "select $1, li.item_id, li.product_id, li.product_price, li.quantity, li.tax_rate_id, t.name, t.rate "
+    "from unnest($2::bigint array, $3::bigint array, $4::numeric array, $5::bigint array, $6::bigint array) "
+    "   as li(item_id, product_id, product_price, quantity, tax_rate_id) "
+    "join tax_rate t on t.id = li.tax_rate_id",
+)
+
+
+# materialize the totals and line items read by order_value, see update_order_summary
+_UPDATE_ORDER_SUMMARY_STATEMENT = register_statement("update_order_summary", "select update_order_summary($1)")
 
 
 @dataclass(eq=True, frozen=True)
@@ -19,19 +45,44 @@ class BookingIdentifier:
     target_account_id: int
 
 
-async def book_prepared_bookings(*, conn: Connection, order_id: int, bookings: dict[BookingIdentifier, float]):
+async def book_prepared_bookings(
+    *,
+    conn: Connection,
+    order_id: int,
+    bookings: dict[BookingIdentifier, float],
+    voucher_bookings: Optional[dict[BookingIdentifier, int]] = None,
+):
     """
-    insert the selected bookings into the database.
-    bookings are (source, target, tax) -> amount
+    insert the selected bookings into the database with one round trip.
+    bookings are (source, target) -> amount, voucher_bookings are (source, target) -> number of vouchers
     """
+    voucher_bookings = voucher_bookings or {}
+    if len(bookings) == 0 and len(voucher_bookings) == 0:
+        return
+
+    source_account_ids = []
+    target_account_ids = []
+    amounts = []
+    voucher_amounts = []
     for booking_identifier, amount in bookings.items():
-        await book_transaction(
-            conn=conn,
-            order_id=order_id,
-            source_account_id=booking_identifier.source_account_id,
-            target_account_id=booking_identifier.target_account_id,
-            amount=amount,
-        )
+        source_account_ids.append(booking_identifier.source_account_id)
+        target_account_ids.append(booking_identifier.target_account_id)
+        amounts.append(amount)
+        voucher_amounts.append(0)
+    for booking_identifier, n_vouchers in voucher_bookings.items():
+        source_account_ids.append(booking_identifier.source_account_id)
+        target_account_ids.append(booking_identifier.target_account_id)
+        amounts.append(0.0)
+        voucher_amounts.append(n_vouchers)
+
+    await book_transactions(
+        conn=conn,
+        order_id=order_id,
+        source_account_ids=source_account_ids,
+        target_account_ids=target_account_ids,
+        amounts=amounts,
+        voucher_amounts=voucher_amounts,
+    )
 
 
 class NewLineItem(BaseModel):
@@ -41,6 +92,16 @@ class NewLineItem(BaseModel):
     tax_rate_id: int
 
 
+class OrderAlreadyBooked(InvalidArgument):
+    """
+    raised by book_order if an order with the given uuid has already been booked, e.g. for a retried terminal request
+    """
+
+    def __init__(self, uuid: UUID):
+        super().__init__("This order has already been booked, duplicate order uuid")
+        self.uuid = uuid
+
+
 @dataclass
 class OrderInfo:
     id: int
@@ -89,20 +150,20 @@ async def book_order(
     till_id: Optional[int],
     line_items: list[NewLineItem],
     bookings: dict[BookingIdentifier, float],
+    voucher_bookings: Optional[dict[BookingIdentifier, int]] = None,
     uuid: Optional[UUID] = None,
     cancels_order: Optional[int] = None,
     customer_account_id: Optional[int] = None,
     cash_register_id: Optional[int] = None,
 ) -> OrderInfo:
-    z_nr = await conn.fetchval("select z_nr from till where id = $1", till_id)
+    z_nr = await conn.fetchval(_TILL_Z_NR_STATEMENT, till_id)
     if z_nr is None:
         raise InvalidArgument("Till does not exist")
 
+    # nothing has been written for this order if the insert turns out to be a duplicate
     uuid = uuid or uuid4()
     order_row = await conn.fetchrow(
-        "insert into ordr (uuid, item_count, payment_method, order_type, cancels_order, cashier_id, "
-        "   till_id, customer_account_id, cash_register_id, z_nr) "
-        "values ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10) returning id, uuid, booked_at",
+        _INSERT_ORDER_STATEMENT,
         uuid,
         len(line_items),
         payment_method.name,
@@ -114,21 +175,21 @@ async def book_order(
         cash_register_id if payment_method == PaymentMethod.cash else None,
         z_nr,
     )
+    if order_row is None:
+        raise OrderAlreadyBooked(uuid=uuid)
     order_id = order_row["id"]
     booked_at = order_row["booked_at"]
 
-    for i, line_item in enumerate(line_items):
-        await conn.fetchval(
-            "insert into line_item (order_id, item_id, product_id, product_price, quantity, tax_rate_id, "
-            "   tax_name, tax_rate) "
-            "select $1, $2, $3, $4, $5, $6, t.name, t.rate "
-            "from tax_rate t where t.id = $6",
+    if len(line_items) > 0:
+        await conn.execute(
+            _INSERT_LINE_ITEMS_STATEMENT,
             order_id,
-            i,
-            line_item.product_id,
-            round(line_item.product_price,2),
-            line_item.quantity,
-            line_item.tax_rate_id,
+            list(range(len(line_items))),
+            [line_item.product_id for line_item in line_items],
+            [round(line_item.product_price, 2) for line_item in line_items],
+            [line_item.quantity for line_item in line_items],
+            [line_item.tax_rate_id for line_item in line_items],
         )
-    await book_prepared_bookings(conn=conn, order_id=order_id, bookings=bookings)
+    await conn.execute(_UPDATE_ORDER_SUMMARY_STATEMENT, order_id)
+    await book_prepared_bookings(conn=conn, order_id=order_id, bookings=bookings, voucher_bookings=voucher_bookings)
     return OrderInfo(id=order_id, uuid=uuid, booked_at=booked_at)
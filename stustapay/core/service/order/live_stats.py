@@ -0,0 +1,268 @@
+"""
+running order statistics kept in memory and updated from the order notification channel
+"""
+
+import asyncio
+import contextlib
+import json
+import logging
+from dataclasses import dataclass, field
+from decimal import Decimal
+from typing import AsyncIterator, Literal, Optional
+
+import asyncpg
+from pydantic import BaseModel
+
+from stustapay.core.service.common.dbhook import DBHook
+from stustapay.framework.database import Connection, register_statement
+
+
+class LiveProductStats(BaseModel):
+    product_id: int
+    quantity: int
+    revenue: float
+
+
+class LiveStats(BaseModel):
+    node_id: int
+    order_count: int
+    revenue: float
+    products: list[LiveProductStats]
+
+
+class LiveStatsMessage(BaseModel):
+    # a snapshot contains all products, an update only the ones which changed with the last order
+    type: Literal["snapshot", "update"]
+    stats: LiveStats
+
+
+@dataclass
+class _NodeCounters:
+    order_count: int = 0
+    # revenue of user defined products, in line with the order statistics
+    revenue: Decimal = Decimal(0)
+    # product id -> (quantity, revenue)
+    products: dict[int, tuple[int, Decimal]] = field(default_factory=dict)
+
+    def to_stats(self, node_id: int, product_ids: Optional[set[int]] = None) -> LiveStats:
+        return LiveStats(
+            node_id=node_id,
+            order_count=self.order_count,
+            revenue=float(self.revenue),
+            products=[
+                LiveProductStats(product_id=product_id, quantity=quantity, revenue=float(revenue))
+                for product_id, (quantity, revenue) in self.products.items()
+                if product_ids is None or product_id in product_ids
+            ],
+        )
+
+
+# line items of a single order summed up per product, together with the node of the till and all its parents
+_ORDER_LIVE_STATS_STATEMENT = register_statement(
+    "order_live_stats",
+    "select "
+    "   n.parent_ids || n.id as node_ids, "
+    "   li.product_id, "
+    "   p.type = 'user_defined' as is_revenue, "
+    "   sum(li.quantity) as quantity, "
+    "   sum(li.total_price) as revenue "
+    "from ordr o "
+    "join till t on o.till_id = t.id "
+    "join node n on t.node_id = n.id "
+    "left join line_item li on o.id = li.order_id "
+    "left join product p on li.product_id = p.id "
+    "where o.id = $1 "
+    "group by n.parent_ids, n.id, li.product_id, p.type",
+)
+
+
+class LiveOrderStats:
+    """
+    Order count, revenue and sold products per node including its whole subtree, kept up to date by applying each
+    order announced on the 'order' notification channel to the counters of its till's node and all parent nodes.
+
+    The counters are recomputed from the database after (re)connecting and every RECONCILE_INTERVAL seconds.
+    Orders which were already part of the last reconciliation are not applied a second time. To tell them apart we
+    remember the highest order id seen during the reconciliation as well as all lower ids which were not committed
+    at that time, looking back at most RECONCILE_ID_LOOKBACK ids.
+    """
+
+    RECONCILE_INTERVAL = 60.0
+    RECONCILE_ID_LOOKBACK = 1000
+    SUBSCRIBER_QUEUE_SIZE = 100
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+
+        self._db_pool: Optional[asyncpg.Pool] = None
+        self._counters: dict[int, _NodeCounters] = {}
+        self._max_reconciled_order_id = 0
+        self._unreconciled_order_ids: set[int] = set()
+        self._lock = asyncio.Lock()
+        self._loaded = False
+        self._subscribers: dict[int, set[asyncio.Queue[LiveStatsMessage]]] = {}
+
+        self.orders_applied = 0
+        self.reconciliations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._db_pool is not None and self._loaded
+
+    def get_stats(self, node_id: int) -> LiveStats:
+        return self._counters.get(node_id, _NodeCounters()).to_stats(node_id)
+
+    def _publish(self, queue: asyncio.Queue[LiveStatsMessage], message: LiveStatsMessage):
+        if queue.full():
+            # the subscriber does not keep up, replace everything it has not received yet by a fresh snapshot
+            while not queue.empty():
+                queue.get_nowait()
+            message = LiveStatsMessage(type="snapshot", stats=self.get_stats(message.stats.node_id))
+        queue.put_nowait(message)
+
+    def _publish_snapshots(self):
+        for node_id, queues in self._subscribers.items():
+            for queue in queues:
+                self._publish(queue, LiveStatsMessage(type="snapshot", stats=self.get_stats(node_id)))
+
+    @contextlib.asynccontextmanager
+    async def subscribe(self, node_id: int) -> AsyncIterator[asyncio.Queue[LiveStatsMessage]]:
+        """
+        subscribe to the stats of a node, the returned queue first receives a snapshot of the current stats followed
+        by an update after each order booked at a till within the subtree of the node
+        """
+        queue: asyncio.Queue[LiveStatsMessage] = asyncio.Queue(maxsize=self.SUBSCRIBER_QUEUE_SIZE)
+        queue.put_nowait(LiveStatsMessage(type="snapshot", stats=self.get_stats(node_id)))
+        self._subscribers.setdefault(node_id, set()).add(queue)
+        try:
+            yield queue
+        finally:
+            queues = self._subscribers[node_id]
+            queues.discard(queue)
+            if len(queues) == 0:
+                del self._subscribers[node_id]
+
+    async def _reconcile(self, conn: Connection):
+        counters: dict[int, _NodeCounters] = {}
+        async with conn.transaction(isolation="repeatable_read", readonly=True):
+            order_counts = await conn.fetch(
+                "select a.node_id, count(*) as order_count "
+                "from ordr o "
+                "join till t on o.till_id = t.id "
+                "join node n on t.node_id = n.id "
+                "cross join unnest(n.parent_ids || n.id) as a(node_id) "
+                "group by a.node_id"
+            )
+            products = await conn.fetch(
+                "select a.node_id, s.product_id, p.type = 'user_defined' as is_revenue, "
+                "   sum(s.quantity) as quantity, sum(s.revenue) as revenue "
+                "from ( "
+                "   select node_id, product_id, sum(quantity) as quantity, sum(revenue) as revenue "
+                "   from order_stats_hourly_with_deltas group by node_id, product_id "
+                ") s "
+                "join product p on s.product_id = p.id "
+                "join node n on s.node_id = n.id "
+                "cross join unnest(n.parent_ids || n.id) as a(node_id) "
+                "group by a.node_id, s.product_id, p.type"
+            )
+            recent_order_ids = await conn.fetch(
+                "select id from ordr where id > (select coalesce(max(id), 0) from ordr) - $1",
+                self.RECONCILE_ID_LOOKBACK,
+            )
+
+        for row in order_counts:
+            counters.setdefault(row["node_id"], _NodeCounters()).order_count = row["order_count"]
+        for row in products:
+            node_counters = counters.setdefault(row["node_id"], _NodeCounters())
+            node_counters.products[row["product_id"]] = (int(row["quantity"]), row["revenue"])
+            if row["is_revenue"]:
+                node_counters.revenue += row["revenue"]
+
+        committed_ids = {row["id"] for row in recent_order_ids}
+        max_order_id = max(committed_ids, default=0)
+        self._counters = counters
+        self._max_reconciled_order_id = max_order_id
+        self._unreconciled_order_ids = set(
+            range(max(max_order_id - self.RECONCILE_ID_LOOKBACK, 0) + 1, max_order_id + 1)
+        ).difference(committed_ids)
+        self._loaded = True
+        self.reconciliations += 1
+        self._publish_snapshots()
+
+    def _already_reconciled(self, order_id: int) -> bool:
+        if order_id > self._max_reconciled_order_id:
+            return False
+        if order_id in self._unreconciled_order_ids:
+            self._unreconciled_order_ids.remove(order_id)
+            return False
+        return True
+
+    async def _apply_order(self, conn: Connection, order_id: int):
+        rows = await conn.fetch(_ORDER_LIVE_STATS_STATEMENT, order_id)
+        if len(rows) == 0:
+            # orders which were not booked at a till are not attributed to any node
+            return
+
+        changed_products: set[int] = set()
+        node_ids = rows[0]["node_ids"]
+        for node_id in node_ids:
+            self._counters.setdefault(node_id, _NodeCounters()).order_count += 1
+        for row in rows:
+            if row["product_id"] is None:
+                continue
+            changed_products.add(row["product_id"])
+            for node_id in node_ids:
+                node_counters = self._counters[node_id]
+                quantity, revenue = node_counters.products.get(row["product_id"], (0, Decimal(0)))
+                node_counters.products[row["product_id"]] = (quantity + int(row["quantity"]), revenue + row["revenue"])
+                if row["is_revenue"]:
+                    node_counters.revenue += row["revenue"]
+
+        self.orders_applied += 1
+        for node_id in node_ids:
+            for queue in self._subscribers.get(node_id, ()):
+                stats = self._counters[node_id].to_stats(node_id, product_ids=changed_products)
+                self._publish(queue, LiveStatsMessage(type="update", stats=stats))
+
+    async def handle_notification(self, payload: Optional[str]):
+        assert self._db_pool is not None
+        async with self._lock, self._db_pool.acquire() as conn:
+            if payload is None:
+                # we might have missed orders while not being connected
+                await self._reconcile(conn)
+                return
+
+            if not self._loaded:
+                return
+
+            order_id = json.loads(payload)["order_id"]
+            if not self._already_reconciled(order_id):
+                await self._apply_order(conn, order_id)
+
+    async def _reconcile_periodically(self):
+        assert self._db_pool is not None
+        while True:
+            await asyncio.sleep(self.RECONCILE_INTERVAL)
+            try:
+                async with self._lock, self._db_pool.acquire() as conn:
+                    await self._reconcile(conn)
+            except (asyncpg.PostgresError, OSError):
+                self.logger.exception("Error while reconciling the live order stats")
+
+    async def listen(self, db_pool: asyncpg.Pool):
+        """keep the live stats up to date until cancelled"""
+        self._db_pool = db_pool
+        hook = DBHook(pool=db_pool, channel="order", event_handler=self.handle_notification, initial_run=True)
+        reconciler = asyncio.create_task(self._reconcile_periodically())
+        self.logger.info("Keeping live order stats up to date, listening for notifications on channel order")
+        try:
+            await hook.run()
+        finally:
+            reconciler.cancel()
+            await asyncio.gather(reconciler, return_exceptions=True)
+            self._db_pool = None
+            self._loaded = False
+            self._counters = {}
+
+
+live_order_stats = LiveOrderStats()
@@ -1,6 +1,8 @@
+import base64
+import datetime
 import logging
 from collections import defaultdict
-from typing import Dict, Optional, Set
+from typing import AsyncIterator, Dict, Optional, Set
 from uuid import UUID
 
 import asyncpg
@@ -28,6 +30,8 @@ from stustapay.core.schema.order import (
     NewTicketScan,
     NewTopUp,
     Order,
+    OrderFilter,
+    OrderPage,
     OrderType,
     PaymentMethod,
     PendingLineItem,
@@ -47,7 +51,7 @@ from stustapay.core.schema.tree import Node, RestrictedEventSettings
 from stustapay.core.schema.user import CurrentUser, Privilege, User, format_user_tag_uid
 from stustapay.core.service.account import (
     get_account_by_id,
-    get_system_account_for_node,
+    get_system_account_id_for_node,
 )
 from stustapay.core.service.auth import AuthService
 from stustapay.core.service.common.dbservice import DBService
@@ -65,18 +69,48 @@ from stustapay.core.service.product import (
     fetch_product,
     fetch_top_up_product,
 )
-from stustapay.core.service.till.common import fetch_virtual_till
-from stustapay.core.service.transaction import book_transaction
+from stustapay.core.service.till.common import (
+    fetch_till_profile_config,
+    fetch_virtual_till,
+    till_profile_config_cache,
+)
+from stustapay.core.service.transaction import book_transactions
 from stustapay.core.service.tree.common import fetch_restricted_event_settings_for_node
-from stustapay.framework.database import Connection
+from stustapay.framework.database import Connection, register_statement
 
 from ...schema.terminal import CurrentTerminal
-from .booking import BookingIdentifier, NewLineItem, book_order
+from .booking import BookingIdentifier, NewLineItem, OrderAlreadyBooked, book_order
 from .stats import OrderStatsService
 from .voucher import VoucherService
 
 logger = logging.getLogger(__name__)
 
+_CUSTOMER_BY_USER_TAG_STATEMENT = register_statement(
+    "customer_by_user_tag",
+    "select a.*, t.restriction "
+    "from user_tag t join account_with_history a on t.uid = a.user_tag_uid "
+    "where t.uid = $1 and a.type = 'private'",
+)
+# only run when booking an order failed, e.g. because its uuid has already been booked
+_BOOKED_ORDER_STATEMENT = register_statement(
+    "booked_order_by_uuid",
+    "select o.id, o.order_type, o.till_id, a.user_tag_uid as customer_tag_uid "
+    "from ordr o left join account a on o.customer_account_id = a.id "
+    "where o.uuid = $1",
+)
+
+
+def _new_sale_customer_tag_uid(kwargs: dict) -> int:
+    return kwargs["new_sale"].customer_tag_uid
+
+
+def _new_topup_customer_tag_uid(kwargs: dict) -> int:
+    return kwargs["new_topup"].customer_tag_uid
+
+
+def _new_pay_out_customer_tag_uid(kwargs: dict) -> int:
+    return kwargs["new_pay_out"].customer_tag_uid
+
 
 class NotEnoughFundsException(ServiceException):
     """
@@ -202,6 +236,70 @@ async def fetch_order(*, conn: Connection, order_id: int) -> Optional[Order]:
     return await conn.fetch_maybe_one(Order, "select * from order_value where id = $1", order_id)
 
 
+ORDER_PAGE_MAX_SIZE = 1000
+# number of rows fetched at once from the server side cursor when streaming orders
+ORDER_STREAM_PREFETCH = 500
+
+
+def encode_order_cursor(order: Order) -> str:
+    return base64.urlsafe_b64encode(f"{order.booked_at.isoformat()}|{order.id}".encode()).decode()
+
+
+def decode_order_cursor(cursor: str) -> tuple[datetime.datetime, int]:
+    try:
+        booked_at, order_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.datetime.fromisoformat(booked_at), int(order_id)
+    except ValueError as e:
+        raise InvalidArgument("Invalid order cursor") from e
+
+
+def _order_list_query(
+    order_filter: OrderFilter, node: Optional[Node] = None, cursor: Optional[str] = None, limit: Optional[int] = None
+) -> tuple[str, list]:
+    """
+    Build the query listing orders matching the filter, sorted by descending booking time.
+    If a node is given only orders of tills visible at this node are listed, orders without a till by the node of
+    their customer account. Orders before the cursor position are selected via a keyset condition on (booked_at, id).
+    """
+    conditions = []
+    args: list = []
+
+    def arg(value) -> str:
+        args.append(value)
+        return f"${len(args)}"
+
+    if node is not None:
+        assert node.ids_to_event_node is not None
+        node_ids = arg(node.ids_to_event_node)
+        conditions.append(
+            f"(till_id in (select id from till where node_id = any({node_ids})) "
+            f"or till_id is null and customer_account_id in (select id from account where node_id = any({node_ids})))"
+        )
+    if order_filter.till_id is not None:
+        conditions.append(f"till_id = {arg(order_filter.till_id)}")
+    if order_filter.cashier_id is not None:
+        conditions.append(f"cashier_id = {arg(order_filter.cashier_id)}")
+    if order_filter.customer_account_id is not None:
+        conditions.append(f"customer_account_id = {arg(order_filter.customer_account_id)}")
+    if order_filter.order_type is not None:
+        conditions.append(f"order_type = {arg(order_filter.order_type.name)}")
+    if order_filter.booked_from is not None:
+        conditions.append(f"booked_at >= {arg(order_filter.booked_from)}")
+    if order_filter.booked_until is not None:
+        conditions.append(f"booked_at < {arg(order_filter.booked_until)}")
+    if cursor is not None:
+        booked_at, order_id = decode_order_cursor(cursor)
+        conditions.append(f"(booked_at, id) < ({arg(booked_at)}, {arg(order_id)})")
+
+    query = "select * from order_value"
+    if conditions:
+        query += " where " + " and ".join(conditions)
+    query += " order by booked_at desc, id desc"
+    if limit is not None:
+        query += f" limit {arg(limit)}"
+    return query, args
+
+
 class OrderService(DBService):
     def __init__(self, db_pool: asyncpg.Pool, config: Config, auth_service: AuthService):
         super().__init__(db_pool, config)
@@ -217,23 +315,21 @@ class OrderService(DBService):
         buttons: list[BookedButton],
     ) -> list[BookedProduct]:
         # TODO: check if the till making this sale has these buttons as part of its layout
+        if till_profile_config_cache.enabled and not any(button.is_product for button in buttons):
+            profile_config = await fetch_till_profile_config(conn=conn, till_profile_id=till_profile_id)
+            if profile_config is None:
+                raise InvalidArgument("this till profile is not allowed to use these buttons")
+            products_by_button: dict[tuple[bool, int], list[Product]] = {
+                (False, button_id): products for button_id, products in profile_config.button_products.items()
+            }
+        else:
+            products_by_button = await OrderService._fetch_products_by_button(
+                conn=conn, till_profile_id=till_profile_id, buttons=buttons
+            )
+
         booked_products = []
         for button in buttons:
-            if not button.is_product:
-                products = await conn.fetch_many(
-                    Product,
-                    "select p.* from till_button_product tbp "
-                    "join product_with_tax_and_restrictions p on tbp.product_id = p.id "
-                    "join till_layout_to_button tltp on tltp.button_id = tbp.button_id "
-                    "join till_profile tp on tp.layout_id = tltp.layout_id "
-                    "where tbp.button_id = $1 and tp.id = $2",
-                    button.id,
-                    till_profile_id,
-                )
-            else:
-                products = await conn.fetch_many(
-                    Product, "select p.* from product_with_tax_and_restrictions p where p.id = $1", button.id
-                )
+            products = products_by_button.get((button.is_product, button.id), [])
             if len(products) == 0:
                 raise InvalidArgument("this till profile is not allowed to use these buttons")
 
@@ -245,6 +341,34 @@ class OrderService(DBService):
                 booked_products.append(BookedProduct(product=product, quantity=button.quantity, price=button.price))
         return booked_products
 
+    @staticmethod
+    async def _fetch_products_by_button(
+        *,
+        conn: Connection,
+        till_profile_id: int,
+        buttons: list[BookedButton],
+    ) -> dict[tuple[bool, int], list[Product]]:
+        # resolve all buttons and products of this sale with one query, grouped by (is_product, id)
+        rows = await conn.fetch(
+            "select tbp.button_id as booked_id, false as booked_is_product, p.* "
+            "from till_button_product tbp "
+            "join product_with_tax_and_restrictions p on tbp.product_id = p.id "
+            "join till_layout_to_button tltp on tltp.button_id = tbp.button_id "
+            "join till_profile tp on tp.layout_id = tltp.layout_id "
+            "where tbp.button_id = any($1) and tp.id = $2 "
+            "union all "
+            "select p.id as booked_id, true as booked_is_product, p.* "
+            "from product_with_tax_and_restrictions p "
+            "where p.id = any($3)",
+            list({button.id for button in buttons if not button.is_product}),
+            till_profile_id,
+            list({button.id for button in buttons if button.is_product}),
+        )
+        products_by_button: dict[tuple[bool, int], list[Product]] = defaultdict(list)
+        for row in rows:
+            products_by_button[(row["booked_is_product"], row["booked_id"])].append(Product.model_validate(dict(row)))
+        return products_by_button
+
     @staticmethod
     async def _preprocess_order_positions(
         *,
@@ -309,17 +433,181 @@ class OrderService(DBService):
 
     @staticmethod
     async def _fetch_customer_by_user_tag(*, conn: Connection, customer_tag_uid: int) -> Account:
-        customer = await conn.fetch_maybe_one(
-            Account,
-            "select a.*, t.restriction "
-            "from user_tag t join account_with_history a on t.uid = a.user_tag_uid "
-            "where t.uid = $1 and a.type = 'private'",
-            customer_tag_uid,
-        )
+        customer = await conn.fetch_maybe_one(Account, _CUSTOMER_BY_USER_TAG_STATEMENT, customer_tag_uid)
         if customer is None:
             raise CustomerNotFound(uid=customer_tag_uid)
         return customer
 
+    @staticmethod
+    async def _fetch_booked_order(
+        *, conn: Connection, uuid: UUID, order_type: OrderType, till_id: int, customer_tag_uids: list[int]
+    ) -> Optional[Order]:
+        """
+        Find an order which has already been booked with the given uuid, i.e. the booking request is a retry.
+        Duplicates are not checked for before booking, new orders are inserted with "on conflict (uuid) do nothing".
+        The book_* methods only look for a booked order once booking failed, either because that insert returned no
+        row or because a check fails on the state after the first booking, e.g. the tags of a ticket sale already
+        have accounts. A retry has to come from the same till for the same customer, otherwise the uuid has been
+        reused and the request is rejected. Only the ordr row is read for these checks, the full order is loaded
+        to replay it.
+        """
+        booked = await conn.fetchrow(_BOOKED_ORDER_STATEMENT, uuid)
+        if booked is None:
+            return None
+        if (
+            booked["order_type"] != order_type.name
+            or booked["till_id"] != till_id
+            or booked["customer_tag_uid"] not in customer_tag_uids
+        ):
+            raise OrderAlreadyBooked(uuid=uuid)
+        return await fetch_order(conn=conn, order_id=booked["id"])
+
+    @staticmethod
+    async def _fetch_balances_at_order(*, conn: Connection, account_id: int, order_id: int) -> asyncpg.Record:
+        """
+        reconstruct the balance and vouchers of an account just before and after the given order was booked
+        by reverting the order's own transactions and all transactions booked on the account after it.
+        All bookings update the account row in serializable transactions, so a transaction touching the same account
+        can only commit after ours if it started after ours committed, its transaction ids are therefore larger.
+        """
+        return await conn.fetchrow(
+            "with first_transaction as (select min(id) as id from transaction where order_id = $2) "
+            "select "
+            "   a.balance - coalesce(sum(t.amount) filter (where t.order_id is distinct from $2), 0) as new_balance, "
+            "   a.balance - coalesce(sum(t.amount), 0) as old_balance, "
+            "   a.vouchers - coalesce(sum(t.vouchers) filter (where t.order_id is distinct from $2), 0) "
+            "       as new_vouchers, "
+            "   a.vouchers - coalesce(sum(t.vouchers), 0) as old_vouchers "
+            "from account a left join ( "
+            "   select order_id, amount, vouchers from transaction "
+            "   where target_account = $1 and id >= (select id from first_transaction) "
+            "   union all "
+            "   select order_id, -amount, -vouchers from transaction "
+            "   where source_account = $1 and id >= (select id from first_transaction) "
+            ") t on true "
+            "where a.id = $1 "
+            "group by a.id",
+            account_id,
+            order_id,
+        )
+
+    @staticmethod
+    def _pending_line_items(order: Order) -> list[PendingLineItem]:
+        return [
+            PendingLineItem(
+                quantity=line_item.quantity,
+                product=line_item.product,
+                product_price=line_item.product_price,
+                tax_rate_id=line_item.tax_rate_id,
+                tax_name=line_item.tax_name,
+                tax_rate=line_item.tax_rate,
+            )
+            for line_item in sorted(order.line_items, key=lambda line_item: line_item.item_id)
+        ]
+
+    async def _replay_topup(self, *, conn: Connection, order: Order) -> CompletedTopUp:
+        assert order.customer_account_id is not None
+        assert order.customer_tag_uid is not None
+        assert order.cashier_id is not None
+        assert order.till_id is not None
+        balances = await self._fetch_balances_at_order(
+            conn=conn, account_id=order.customer_account_id, order_id=order.id
+        )
+        return CompletedTopUp(
+            amount=order.total_price,
+            customer_tag_uid=order.customer_tag_uid,
+            customer_account_id=order.customer_account_id,
+            payment_method=order.payment_method,
+            old_balance=balances["old_balance"],
+            new_balance=balances["new_balance"],
+            uuid=order.uuid,
+            booked_at=order.booked_at,
+            cashier_id=order.cashier_id,
+            till_id=order.till_id,
+        )
+
+    async def _replay_sale(
+        self, *, conn: Connection, order: Order, buttons: list[BookedButton]
+    ) -> InternalCompletedSale:
+        assert order.customer_account_id is not None
+        assert order.cashier_id is not None
+        assert order.till_id is not None
+        balances = await self._fetch_balances_at_order(
+            conn=conn, account_id=order.customer_account_id, order_id=order.id
+        )
+        return InternalCompletedSale(
+            buttons=buttons,
+            id=order.id,
+            uuid=order.uuid,
+            old_balance=balances["old_balance"],
+            new_balance=balances["new_balance"],
+            old_voucher_balance=balances["old_vouchers"],
+            new_voucher_balance=balances["new_vouchers"],
+            customer_account_id=order.customer_account_id,
+            line_items=self._pending_line_items(order),
+            booked_at=order.booked_at,
+            till_id=order.till_id,
+            cashier_id=order.cashier_id,
+        )
+
+    async def _replay_pay_out(self, *, conn: Connection, order: Order) -> CompletedPayOut:
+        assert order.customer_account_id is not None
+        assert order.customer_tag_uid is not None
+        assert order.cashier_id is not None
+        assert order.till_id is not None
+        balances = await self._fetch_balances_at_order(
+            conn=conn, account_id=order.customer_account_id, order_id=order.id
+        )
+        return CompletedPayOut(
+            uuid=order.uuid,
+            amount=order.total_price,
+            customer_tag_uid=order.customer_tag_uid,
+            customer_account_id=order.customer_account_id,
+            old_balance=balances["old_balance"],
+            new_balance=balances["new_balance"],
+            booked_at=order.booked_at,
+            cashier_id=order.cashier_id,
+            till_id=order.till_id,
+        )
+
+    async def _replay_ticket_sale(
+        self, *, conn: Connection, order: Order, customer_tag_uids: list[int]
+    ) -> CompletedTicketSale:
+        assert order.customer_account_id is not None
+        assert order.cashier_id is not None
+        assert order.till_id is not None
+        ticket_ids = [
+            line_item.product.id for line_item in order.line_items if line_item.product.type == ProductType.ticket
+        ]
+        scanned_tickets = []
+        for customer_tag_uid in customer_tag_uids:
+            ticket = await conn.fetch_maybe_one(
+                Ticket,
+                "select t.* "
+                "from ticket t "
+                "join user_tag ut "
+                "   on (ut.restriction = any(t.restrictions) "
+                "       or t.restrictions = '{}'::text array and ut.restriction is null) "
+                "where t.id = any($1) and ut.uid = $2",
+                ticket_ids,
+                customer_tag_uid,
+            )
+            if ticket is None:
+                raise OrderAlreadyBooked(uuid=order.uuid)
+            scanned_tickets.append(TicketScanResultEntry(customer_tag_uid=customer_tag_uid, ticket=ticket))
+
+        return CompletedTicketSale(
+            id=order.id,
+            payment_method=order.payment_method,
+            customer_account_id=order.customer_account_id,
+            line_items=self._pending_line_items(order),
+            uuid=order.uuid,
+            booked_at=order.booked_at,
+            cashier_id=order.cashier_id,
+            scanned_tickets=scanned_tickets,
+            till_id=order.till_id,
+        )
+
     @with_retryable_db_transaction(read_only=True)
     @requires_terminal(user_privileges=[Privilege.can_book_orders])
     async def check_topup(
@@ -349,10 +637,6 @@ class OrderService(DBService):
         if new_topup.amount < 1.00:
             raise InvalidArgument("Minimum TopUp is 1.00€")
 
-        uuid_exists = await conn.fetchval("select exists(select from ordr where uuid = $1)", new_topup.uuid)
-        if uuid_exists:
-            raise InvalidArgument("This order has already been booked, duplicate order uuid")
-
         customer_account = await self._fetch_customer_by_user_tag(
             conn=conn, customer_tag_uid=new_topup.customer_tag_uid
         )
@@ -376,7 +660,7 @@ class OrderService(DBService):
             new_balance=new_balance,
         )
 
-    @with_retryable_db_transaction(read_only=False)
+    @with_retryable_db_transaction(read_only=False, lock_customer_tag_uid=_new_topup_customer_tag_uid)
     @requires_terminal(user_privileges=[Privilege.can_book_orders])
     async def book_topup(
         self,
@@ -386,6 +670,31 @@ class OrderService(DBService):
         node: Node,
         current_user: CurrentUser,
         new_topup: NewTopUp,
+    ) -> CompletedTopUp:
+        try:
+            return await self._book_new_topup(
+                conn=conn, current_terminal=current_terminal, node=node, current_user=current_user, new_topup=new_topup
+            )
+        except ServiceException:
+            order = await self._fetch_booked_order(
+                conn=conn,
+                uuid=new_topup.uuid,
+                order_type=OrderType.top_up,
+                till_id=current_terminal.till.id,
+                customer_tag_uids=[new_topup.customer_tag_uid],
+            )
+            if order is None:
+                raise
+        return await self._replay_topup(conn=conn, order=order)
+
+    async def _book_new_topup(
+        self,
+        *,
+        conn: Connection,
+        current_terminal: CurrentTerminal,
+        node: Node,
+        current_user: CurrentUser,
+        new_topup: NewTopUp,
     ) -> CompletedTopUp:
         assert current_user.cashier_account_id is not None
 
@@ -407,27 +716,31 @@ class OrderService(DBService):
             )
         ]
 
-        cash_entry_acc = await get_system_account_for_node(conn=conn, node=node, account_type=AccountType.cash_entry)
-        cash_topup_acc = await get_system_account_for_node(
+        cash_entry_acc_id = await get_system_account_id_for_node(
+            conn=conn, node=node, account_type=AccountType.cash_entry
+        )
+        cash_topup_acc_id = await get_system_account_id_for_node(
             conn=conn, node=node, account_type=AccountType.cash_topup_source
         )
-        sumup_entry_acc = await get_system_account_for_node(conn=conn, node=node, account_type=AccountType.sumup_entry)
+        sumup_entry_acc_id = await get_system_account_id_for_node(
+            conn=conn, node=node, account_type=AccountType.sumup_entry
+        )
 
         if pending_top_up.payment_method == PaymentMethod.cash:
             bookings = {
                 BookingIdentifier(
-                    source_account_id=cash_topup_acc.id,
+                    source_account_id=cash_topup_acc_id,
                     target_account_id=pending_top_up.customer_account_id,
                 ): pending_top_up.amount,
                 BookingIdentifier(
-                    source_account_id=cash_entry_acc.id,
+                    source_account_id=cash_entry_acc_id,
                     target_account_id=current_user.cashier_account_id,
                 ): pending_top_up.amount,
             }
         elif pending_top_up.payment_method == PaymentMethod.sumup:
             bookings = {
                 BookingIdentifier(
-                    source_account_id=sumup_entry_acc.id,
+                    source_account_id=sumup_entry_acc_id,
                     target_account_id=pending_top_up.customer_account_id,
                 ): pending_top_up.amount
             }
@@ -473,10 +786,6 @@ class OrderService(DBService):
         prepare the given order: checks all requirements.
         To finish the order, book_order is used.
         """
-        uuid_exists = await conn.fetchval("select exists(select from ordr where uuid = $1)", new_sale.uuid)
-        if uuid_exists:
-            raise InvalidArgument("This order has already been booked, duplicate order uuid")
-
         customer_account = await self._fetch_customer_by_user_tag(conn=conn, customer_tag_uid=new_sale.customer_tag_uid)
 
         booked_products = await self._get_products_from_buttons(
@@ -620,6 +929,37 @@ class OrderService(DBService):
         till: Till,
         current_user: CurrentUser,
         new_sale: InternalNewSale,
+    ) -> InternalCompletedSale:
+        try:
+            return await self._book_new_sale(
+                conn=conn,
+                node=node,
+                event_settings=event_settings,
+                till=till,
+                current_user=current_user,
+                new_sale=new_sale,
+            )
+        except ServiceException:
+            order = await self._fetch_booked_order(
+                conn=conn,
+                uuid=new_sale.uuid,
+                order_type=OrderType.sale,
+                till_id=till.id,
+                customer_tag_uids=[new_sale.customer_tag_uid],
+            )
+            if order is None:
+                raise
+        return await self._replay_sale(conn=conn, order=order, buttons=new_sale.buttons)
+
+    async def _book_new_sale(
+        self,
+        *,
+        conn: Connection,
+        node: Node,
+        event_settings: RestrictedEventSettings,
+        till: Till,
+        current_user: CurrentUser,
+        new_sale: InternalNewSale,
     ) -> InternalCompletedSale:
         """
         apply the order after all payment has been settled.
@@ -642,18 +982,28 @@ class OrderService(DBService):
             for line_item in pending_sale.line_items
         ]
 
-        sale_exit_acc = await get_system_account_for_node(conn=conn, node=node, account_type=AccountType.sale_exit)
+        sale_exit_acc_id = await get_system_account_id_for_node(
+            conn=conn, node=node, account_type=AccountType.sale_exit
+        )
 
         # combine booking based on (source, target) -> amount
         bookings: Dict[BookingIdentifier, float] = defaultdict(lambda: 0.0)
         for line_item in pending_sale.line_items:
             product = line_item.product
             source_acc_id = get_source_account(OrderType.sale, pending_sale.customer_account_id)
-            target_acc_id = get_target_account(OrderType.sale, product, sale_exit_acc.id)
+            target_acc_id = get_target_account(OrderType.sale, product, sale_exit_acc_id)
             bookings[BookingIdentifier(source_account_id=source_acc_id, target_account_id=target_acc_id)] += float(
                 line_item.total_price
             )
 
+        voucher_bookings: Dict[BookingIdentifier, int] = {}
+        if pending_sale.used_vouchers > 0:
+            voucher_bookings[
+                BookingIdentifier(
+                    source_account_id=pending_sale.customer_account_id, target_account_id=sale_exit_acc_id
+                )
+            ] = pending_sale.used_vouchers
+
         order_info = await book_order(
             conn=conn,
             order_type=OrderType.sale,
@@ -663,18 +1013,10 @@ class OrderService(DBService):
             cashier_id=current_user.id,
             line_items=line_items,
             bookings=bookings,
+            voucher_bookings=voucher_bookings,
             till_id=till.id,
         )
 
-        if pending_sale.used_vouchers > 0:
-            await book_transaction(
-                conn=conn,
-                order_id=order_info.id,
-                source_account_id=pending_sale.customer_account_id,
-                target_account_id=sale_exit_acc.id,
-                voucher_amount=pending_sale.used_vouchers,
-            )
-
         completed_order = InternalCompletedSale(
             buttons=pending_sale.buttons,
             id=order_info.id,
@@ -701,7 +1043,7 @@ class OrderService(DBService):
 
         return completed_order
 
-    @with_retryable_db_transaction(read_only=False)
+    @with_retryable_db_transaction(read_only=False, lock_customer_tag_uid=_new_sale_customer_tag_uid)
     @requires_terminal(user_privileges=[Privilege.can_book_orders])
     async def book_sale(
         self,
@@ -754,7 +1096,7 @@ class OrderService(DBService):
             buttons=new_sale.buttons,
         )
 
-    @with_retryable_db_transaction(read_only=False)
+    @with_retryable_db_transaction(read_only=False, lock_customer_tag_uid=_new_sale_customer_tag_uid)
     @requires_node()
     @requires_user([Privilege.can_book_orders])
     async def book_sale_products(
@@ -885,22 +1227,17 @@ class OrderService(DBService):
             bookings={},
         )
 
-        transactions = await conn.fetch("select * from transaction where order_id = $1", order.id)
-        for transaction in transactions:
-            await conn.fetchval(
-                "select * from book_transaction("
-                "   order_id => $1,"
-                "   description => $2,"
-                "   source_account_id => $3,"
-                "   target_account_id => $4,"
-                "   amount => $5,"
-                "   vouchers_amount => $6)",
-                order_info.id,
-                transaction["description"],
-                transaction["target_account"],
-                transaction["source_account"],
-                transaction["amount"],
-                transaction["vouchers"],
+        # revert all transactions of the original order by booking them in the reverse direction
+        transactions = await conn.fetch("select * from transaction where order_id = $1 order by id", order.id)
+        if len(transactions) > 0:
+            await book_transactions(
+                conn=conn,
+                order_id=order_info.id,
+                source_account_ids=[transaction["target_account"] for transaction in transactions],
+                target_account_ids=[transaction["source_account"] for transaction in transactions],
+                amounts=[transaction["amount"] for transaction in transactions],
+                voucher_amounts=[transaction["vouchers"] for transaction in transactions],
+                descriptions=[transaction["description"] for transaction in transactions],
             )
 
     @with_retryable_db_transaction(read_only=False)
@@ -927,10 +1264,6 @@ class OrderService(DBService):
         if new_pay_out.amount is not None and new_pay_out.amount > 0.0:
             raise InvalidArgument("Only payouts with a negative amount are allowed")
 
-        uuid_exists = await conn.fetchval("select exists(select from ordr where uuid = $1)", new_pay_out.uuid)
-        if uuid_exists:
-            raise InvalidArgument("This order has already been booked, duplicate order uuid")
-
         can_pay_out = await conn.fetchval(
             "select allow_cash_out from till_profile where id = $1", current_terminal.till.active_profile_id
         )
@@ -958,7 +1291,7 @@ class OrderService(DBService):
             new_balance=new_balance,
         )
 
-    @with_retryable_db_transaction(read_only=False)
+    @with_retryable_db_transaction(read_only=False, lock_customer_tag_uid=_new_pay_out_customer_tag_uid)
     @requires_terminal(user_privileges=[Privilege.can_book_orders])
     async def book_pay_out(
         self,
@@ -968,6 +1301,35 @@ class OrderService(DBService):
         node: Node,
         current_user: CurrentUser,
         new_pay_out: NewPayOut,
+    ) -> CompletedPayOut:
+        try:
+            return await self._book_new_pay_out(
+                conn=conn,
+                current_terminal=current_terminal,
+                node=node,
+                current_user=current_user,
+                new_pay_out=new_pay_out,
+            )
+        except ServiceException:
+            order = await self._fetch_booked_order(
+                conn=conn,
+                uuid=new_pay_out.uuid,
+                order_type=OrderType.pay_out,
+                till_id=current_terminal.till.id,
+                customer_tag_uids=[new_pay_out.customer_tag_uid],
+            )
+            if order is None:
+                raise
+        return await self._replay_pay_out(conn=conn, order=order)
+
+    async def _book_new_pay_out(
+        self,
+        *,
+        conn: Connection,
+        current_terminal: CurrentTerminal,
+        node: Node,
+        current_user: CurrentUser,
+        new_pay_out: NewPayOut,
     ) -> CompletedPayOut:
         assert current_user.cashier_account_id is not None
         pending_pay_out: PendingPayOut = await self.check_pay_out(  # pylint: disable=unexpected-keyword-arg
@@ -985,17 +1347,19 @@ class OrderService(DBService):
             )
         ]
 
-        cash_topup_acc = await get_system_account_for_node(
+        cash_topup_acc_id = await get_system_account_id_for_node(
             conn=conn, node=node, account_type=AccountType.cash_topup_source
         )
-        cash_exit_acc = await get_system_account_for_node(conn=conn, node=node, account_type=AccountType.cash_exit)
+        cash_exit_acc_id = await get_system_account_id_for_node(
+            conn=conn, node=node, account_type=AccountType.cash_exit
+        )
 
         prepared_bookings: Dict[BookingIdentifier, float] = {
             BookingIdentifier(
-                source_account_id=pending_pay_out.customer_account_id, target_account_id=cash_topup_acc.id
+                source_account_id=pending_pay_out.customer_account_id, target_account_id=cash_topup_acc_id
             ): -pending_pay_out.amount,
             BookingIdentifier(
-                source_account_id=current_user.cashier_account_id, target_account_id=cash_exit_acc.id
+                source_account_id=current_user.cashier_account_id, target_account_id=cash_exit_acc_id
             ): -pending_pay_out.amount,
         }
 
@@ -1088,10 +1452,6 @@ class OrderService(DBService):
         current_user: CurrentUser,
         new_ticket_sale: NewTicketSale,
     ) -> PendingTicketSale:
-        uuid_exists = await conn.fetchval("select exists(select from ordr where uuid = $1)", new_ticket_sale.uuid)
-        if uuid_exists:
-            raise InvalidArgument("This order has already been booked, duplicate order uuid")
-
         if new_ticket_sale.payment_method is not None:
             if new_ticket_sale.payment_method == PaymentMethod.tag:
                 raise InvalidArgument("Cannot pay with tag for a ticket")
@@ -1213,6 +1573,37 @@ class OrderService(DBService):
         node: Node,
         current_user: CurrentUser,
         new_ticket_sale: NewTicketSale,
+    ) -> CompletedTicketSale:
+        try:
+            return await self._book_new_ticket_sale(
+                conn=conn,
+                current_terminal=current_terminal,
+                node=node,
+                current_user=current_user,
+                new_ticket_sale=new_ticket_sale,
+            )
+        except ServiceException:
+            order = await self._fetch_booked_order(
+                conn=conn,
+                uuid=new_ticket_sale.uuid,
+                order_type=OrderType.ticket,
+                till_id=current_terminal.till.id,
+                customer_tag_uids=new_ticket_sale.customer_tag_uids,
+            )
+            if order is None:
+                raise
+        return await self._replay_ticket_sale(
+            conn=conn, order=order, customer_tag_uids=new_ticket_sale.customer_tag_uids
+        )
+
+    async def _book_new_ticket_sale(
+        self,
+        *,
+        conn: Connection,
+        current_terminal: CurrentTerminal,
+        node: Node,
+        current_user: CurrentUser,
+        new_ticket_sale: NewTicketSale,
     ) -> CompletedTicketSale:
         if new_ticket_sale.payment_method is None:
             raise InvalidArgument("No payment method provided")
@@ -1258,36 +1649,42 @@ class OrderService(DBService):
             if line_item.product.type != ProductType.topup:
                 total_ticket_price += line_item.total_price
 
-        cash_entry_acc = await get_system_account_for_node(conn=conn, node=node, account_type=AccountType.cash_entry)
-        cash_topup_acc = await get_system_account_for_node(
+        cash_entry_acc_id = await get_system_account_id_for_node(
+            conn=conn, node=node, account_type=AccountType.cash_entry
+        )
+        cash_topup_acc_id = await get_system_account_id_for_node(
             conn=conn, node=node, account_type=AccountType.cash_topup_source
         )
-        sumup_entry_acc = await get_system_account_for_node(conn=conn, node=node, account_type=AccountType.sumup_entry)
-        sale_exit_acc = await get_system_account_for_node(conn=conn, node=node, account_type=AccountType.sale_exit)
+        sumup_entry_acc_id = await get_system_account_id_for_node(
+            conn=conn, node=node, account_type=AccountType.sumup_entry
+        )
+        sale_exit_acc_id = await get_system_account_id_for_node(
+            conn=conn, node=node, account_type=AccountType.sale_exit
+        )
 
         prepared_bookings: dict[BookingIdentifier, float] = {}
         if pending_ticket_sale.payment_method == PaymentMethod.cash:
             prepared_bookings[
                 BookingIdentifier(
-                    source_account_id=cash_entry_acc.id, target_account_id=current_user.cashier_account_id
+                    source_account_id=cash_entry_acc_id, target_account_id=current_user.cashier_account_id
                 )
             ] = pending_ticket_sale.total_price
             prepared_bookings[
-                BookingIdentifier(source_account_id=cash_topup_acc.id, target_account_id=sale_exit_acc.id)
+                BookingIdentifier(source_account_id=cash_topup_acc_id, target_account_id=sale_exit_acc_id)
             ] = total_ticket_price
             for customer_account_id in customers.keys():
                 topup_amount = customers[customer_account_id][0]
                 prepared_bookings[
-                    BookingIdentifier(source_account_id=cash_topup_acc.id, target_account_id=customer_account_id)
+                    BookingIdentifier(source_account_id=cash_topup_acc_id, target_account_id=customer_account_id)
                 ] = topup_amount
         elif pending_ticket_sale.payment_method == PaymentMethod.sumup:
             prepared_bookings[
-                BookingIdentifier(source_account_id=sumup_entry_acc.id, target_account_id=sale_exit_acc.id)
+                BookingIdentifier(source_account_id=sumup_entry_acc_id, target_account_id=sale_exit_acc_id)
             ] = total_ticket_price
             for customer_account_id in customers.keys():
                 topup_amount = customers[customer_account_id][0]
                 prepared_bookings[
-                    BookingIdentifier(source_account_id=sumup_entry_acc.id, target_account_id=customer_account_id)
+                    BookingIdentifier(source_account_id=sumup_entry_acc_id, target_account_id=customer_account_id)
                 ] = topup_amount
         else:
             raise InvalidArgument("Invalid payment method")
@@ -1334,18 +1731,59 @@ class OrderService(DBService):
     @requires_node()
     @requires_user([Privilege.node_administration])
     async def list_orders(self, *, conn: Connection, customer_account_id: Optional[int] = None) -> list[Order]:
-        if customer_account_id is not None:
-            return await conn.fetch_many(
-                Order, "select * from order_value where customer_account_id = $1", customer_account_id
-            )
-        else:
-            return await conn.fetch_many(Order, "select * from order_value")
+        query, args = _order_list_query(OrderFilter(customer_account_id=customer_account_id))
+        return await conn.fetch_many(Order, query, *args)
 
     @with_db_transaction(read_only=True)
     @requires_node()
     @requires_user([Privilege.node_administration])
     async def list_orders_by_till(self, *, conn: Connection, till_id: int) -> list[Order]:
-        return await conn.fetch_many(Order, "select * from order_value where till_id = $1", till_id)
+        query, args = _order_list_query(OrderFilter(till_id=till_id))
+        return await conn.fetch_many(Order, query, *args)
+
+    @with_db_transaction(read_only=True)
+    @requires_node(event_only=True)
+    @requires_user([Privilege.node_administration])
+    async def list_orders_paginated(
+        self, *, conn: Connection, node: Node, order_filter: OrderFilter, cursor: Optional[str] = None, limit: int = 100
+    ) -> OrderPage:
+        if not 0 < limit <= ORDER_PAGE_MAX_SIZE:
+            raise InvalidArgument(f"The page size must be between 1 and {ORDER_PAGE_MAX_SIZE}")
+
+        # fetch one more order than requested to know whether there is a next page
+        query, args = _order_list_query(order_filter, node=node, cursor=cursor, limit=limit + 1)
+        orders = await conn.fetch_many(Order, query, *args)
+        if len(orders) <= limit:
+            return OrderPage(orders=orders, next_cursor=None)
+        orders = orders[:limit]
+        return OrderPage(orders=orders, next_cursor=encode_order_cursor(orders[-1]))
+
+    @with_db_transaction(read_only=True)
+    @requires_node(event_only=True)
+    @requires_user([Privilege.node_administration])
+    async def _get_order_list_node(self, *, node: Node) -> Node:
+        """the access checks are done by the decorators"""
+        return node
+
+    async def stream_orders(
+        self, *, token: str, node_id: Optional[int], order_filter: OrderFilter
+    ) -> AsyncIterator[Order]:
+        """
+        Check the access to the orders and return an iterator over all orders at the node matching the filter.
+        The orders are read via a server side cursor, i.e. only a few of them are kept in memory at once.
+        """
+        node = await self._get_order_list_node(  # pylint: disable=missing-kwoa,unexpected-keyword-arg
+            token=token, node_id=node_id
+        )
+        return self._stream_orders(node=node, order_filter=order_filter)
+
+    async def _stream_orders(self, *, node: Node, order_filter: OrderFilter) -> AsyncIterator[Order]:
+        query, args = _order_list_query(order_filter, node=node)
+        async with self.db_pool.acquire() as conn:
+            # cursors only exist within a transaction, repeatable read gives us a consistent snapshot of all orders
+            async with conn.transaction(isolation="repeatable_read", readonly=True):
+                async for row in conn.cursor(query, *args, prefetch=ORDER_STREAM_PREFETCH):
+                    yield Order.model_validate(dict(row))
 
     @with_db_transaction(read_only=True)
     @requires_node()
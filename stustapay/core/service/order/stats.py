@@ -1,3 +1,5 @@
+import asyncio
+from contextlib import AbstractAsyncContextManager
 from datetime import datetime
 from typing import Optional
 
@@ -16,6 +18,7 @@ from stustapay.core.service.common.decorators import (
     with_db_transaction,
 )
 from stustapay.core.service.common.error import InvalidArgument
+from stustapay.core.service.order.live_stats import LiveStatsMessage, live_order_stats
 from stustapay.core.service.product import fetch_top_up_product
 from stustapay.core.service.tree.common import fetch_event_for_node
 from stustapay.framework.database import Connection
@@ -82,23 +85,24 @@ def _get_time_bounds(query: TimeseriesStatsQuery, event: PublicEventSettings) ->
     return from_t, to_t
 
 
+# the hourly stats are read from order_stats_hourly_with_deltas, the stats of every order are recorded once it is
+# committed.
+# Orders are counted in the hour they were booked in, the given time bounds are therefore extended to full hours.
 async def get_hourly_entry_stats(*, conn: Connection, node: Node, from_time: datetime, to_time: datetime) -> Timeseries:
     stats = await conn.fetch_many(
         StatInterval,
         "select "
-        "   date_trunc('hour', o.booked_at) as from_time, "
-        "   date_trunc('hour', o.booked_at) + interval '1 hour' as to_time, "
-        "   sum(li.quantity) as count,"
-        "   round(sum(li.total_price), 2) as revenue "
-        "from order_value o "
-        "join till t on o.till_id = t.id "
-        "join line_item li on o.id = li.order_id "
-        "join product p on li.product_id = p.id "
-        "join node n on t.node_id = n.id "
-        "where p.ticket_metadata_id is not null and o.booked_at >= $1 and o.booked_at <= $2 "
-        "   and ($3 = any(n.parent_ids) or n.id = $3) "
-        "group by from_time, to_time "
-        "order by from_time",
+        "   s.hour as from_time, "
+        "   s.hour + interval '1 hour' as to_time, "
+        "   sum(s.quantity) as count,"
+        "   round(sum(s.revenue), 2) as revenue "
+        "from order_stats_hourly_with_deltas s "
+        "join product p on s.product_id = p.id "
+        "where s.hour >= date_trunc('hour', $1::timestamptz, 'UTC') and s.hour <= $2 "
+        "   and s.node_id in (select n.id from node n where $3 = any(n.parent_ids) or n.id = $3) "
+        "   and p.ticket_metadata_id is not null "
+        "group by s.hour "
+        "order by s.hour",
         from_time,
         to_time,
         node.id,
@@ -115,19 +119,17 @@ async def get_hourly_top_up_stats(
     stats = await conn.fetch_many(
         StatInterval,
         "select "
-        "   date_trunc('hour', o.booked_at) as from_time, "
-        "   date_trunc('hour', o.booked_at) + interval '1 hour' as to_time, "
-        "   sum(li.quantity) as count,"
-        "   round(sum(li.total_price), 2) as revenue "
-        "from order_value o "
-        "join till t on o.till_id = t.id "
-        "join line_item li on o.id = li.order_id "
-        "join product p on li.product_id = p.id "
-        "join node n on t.node_id = n.id "
-        "where p.id = $4 and o.booked_at >= $1 and o.booked_at <= $2 "
-        "   and ($3 = any(n.parent_ids) or n.id = $3) "
-        "group by from_time, to_time "
-        "order by from_time",
+        "   s.hour as from_time, "
+        "   s.hour + interval '1 hour' as to_time, "
+        "   sum(s.quantity) as count,"
+        "   round(sum(s.revenue), 2) as revenue "
+        "from order_stats_hourly_with_deltas s "
+        "join product p on s.product_id = p.id "
+        "where s.hour >= date_trunc('hour', $1::timestamptz, 'UTC') and s.hour <= $2 "
+        "   and s.node_id in (select n.id from node n where $3 = any(n.parent_ids) or n.id = $3) "
+        "   and s.product_id = $4 "
+        "group by s.hour "
+        "order by s.hour",
         from_time,
         to_time,
         node.id,
@@ -144,20 +146,17 @@ async def get_hourly_revenue_stats(
     stats = await conn.fetch_many(
         StatInterval,
         "select "
-        "   date_trunc('hour', o.booked_at) as from_time, "
-        "   date_trunc('hour', o.booked_at) + interval '1 hour' as to_time, "
-        "   sum(li.quantity) as count,"
-        "   round(sum(li.total_price), 2) as revenue "
-        "from order_value o "
-        "join till t on o.till_id = t.id "
-        "join line_item li on o.id = li.order_id "
-        "join product p on li.product_id = p.id "
-        "join node n on t.node_id = n.id "
-        "where o.booked_at >= $1 and o.booked_at <= $2 "
+        "   s.hour as from_time, "
+        "   s.hour + interval '1 hour' as to_time, "
+        "   sum(s.quantity) as count,"
+        "   round(sum(s.revenue), 2) as revenue "
+        "from order_stats_hourly_with_deltas s "
+        "join product p on s.product_id = p.id "
+        "where s.hour >= date_trunc('hour', $1::timestamptz, 'UTC') and s.hour <= $2 "
+        "   and s.node_id in (select n.id from node n where $3 = any(n.parent_ids) or n.id = $3) "
         "   and p.type = 'user_defined' "
-        "   and ($3 = any(n.parent_ids) or n.id = $3) "
-        "group by from_time, to_time "
-        "order by from_time",
+        "group by s.hour "
+        "order by s.hour",
         from_time,
         to_time,
         node.id,
@@ -171,22 +170,19 @@ async def get_hourly_product_stats(
 ) -> list[ProductTimeseries]:
     result = await conn.fetch(
         "select "
-        "   p.id as product_id, "
-        "   date_trunc('hour', o.booked_at) as from_time, "
-        "   date_trunc('hour', o.booked_at) + interval '1 hour' as to_time, "
-        "   sum(li.quantity) as count,"
-        "   round(sum(li.total_price), 2) as revenue "
-        "from order_value o "
-        "join till t on o.till_id = t.id "
-        "join line_item li on o.id = li.order_id "
-        "join product p on li.product_id = p.id "
-        "join node n on t.node_id = n.id "
-        "where o.booked_at >= $1 and o.booked_at <= $2 "
+        "   s.product_id, "
+        "   s.hour as from_time, "
+        "   s.hour + interval '1 hour' as to_time, "
+        "   sum(s.quantity) as count,"
+        "   round(sum(s.revenue), 2) as revenue "
+        "from order_stats_hourly_with_deltas s "
+        "join product p on s.product_id = p.id "
+        "where s.hour >= date_trunc('hour', $1::timestamptz, 'UTC') and s.hour <= $2 "
+        "   and s.node_id in (select n.id from node n where $3 = any(n.parent_ids) or n.id = $3) "
         "   and p.type = 'user_defined' "
-        "   and ($3 = any(n.parent_ids) or n.id = $3) "
         "   and not p.is_returnable "
-        "group by p.id, from_time, to_time "
-        "order by from_time",
+        "group by s.product_id, s.hour "
+        "order by s.hour",
         from_time,
         to_time,
         node.id,
@@ -339,3 +335,11 @@ class OrderStatsService(DBService):
                 for p_id, intervals in daily_product_stats.items()
             ],
         )
+
+    @with_db_transaction(read_only=True)
+    @requires_node(event_only=True)
+    @requires_user([Privilege.node_administration])
+    async def subscribe_live_stats(self, *, node: Node) -> AbstractAsyncContextManager[asyncio.Queue[LiveStatsMessage]]:
+        if not live_order_stats.enabled:
+            raise InvalidArgument("Live stats are currently not available")
+        return live_order_stats.subscribe(node.id)
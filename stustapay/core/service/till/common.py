@@ -1,7 +1,12 @@
+from collections import defaultdict
 from typing import Optional
 
-from stustapay.core.schema.till import NewTill, Till
+from pydantic import BaseModel
+
+from stustapay.core.schema.product import Product
+from stustapay.core.schema.till import NewTill, Till, TillProfile
 from stustapay.core.schema.tree import Node
+from stustapay.core.service.common.cache import NotificationCache
 from stustapay.framework.database import Connection
 
 
@@ -34,3 +39,44 @@ async def fetch_virtual_till(*, conn: Connection, node: Node) -> Till:
     return await conn.fetch_one(
         Till, "select * from till where is_virtual and node_id = any($1)", node.ids_to_event_node
     )
+
+
+class TillProfileConfig(BaseModel):
+    profile: TillProfile
+    # products of all buttons in the layout of this profile, by button id
+    button_products: dict[int, list[Product]]
+
+
+# invalidated by the till_profile_config_changed trigger on any change to profiles, layouts, buttons or products
+till_profile_config_cache: NotificationCache[int, TillProfileConfig] = NotificationCache(
+    name="till_profile_config", channel="till_profile_config"
+)
+
+
+async def _load_till_profile_config(*, conn: Connection, till_profile_id: int) -> Optional[TillProfileConfig]:
+    profile = await conn.fetch_maybe_one(TillProfile, "select * from till_profile where id = $1", till_profile_id)
+    if profile is None:
+        return None
+
+    rows = await conn.fetch(
+        "select tbp.button_id as booked_id, p.* "
+        "from till_button_product tbp "
+        "join product_with_tax_and_restrictions p on tbp.product_id = p.id "
+        "join till_layout_to_button tltb on tltb.button_id = tbp.button_id "
+        "where tltb.layout_id = $1",
+        profile.layout_id,
+    )
+    button_products: dict[int, list[Product]] = defaultdict(list)
+    for row in rows:
+        button_products[row["booked_id"]].append(Product.model_validate(dict(row)))
+    return TillProfileConfig(profile=profile, button_products=button_products)
+
+
+async def fetch_till_profile_config(*, conn: Connection, till_profile_id: int) -> Optional[TillProfileConfig]:
+    """
+    get a till profile together with the products of all buttons in its layout.
+    Served from an in-process cache while its notification listener is running.
+    """
+    return await till_profile_config_cache.get_or_load(
+        till_profile_id, lambda: _load_till_profile_config(conn=conn, till_profile_id=till_profile_id), conn=conn
+    )
@@ -1,6 +1,18 @@
 from typing import Optional
 
-from stustapay.framework.database import Connection
+from stustapay.framework.database import Connection, register_statement
+
+_BOOK_TRANSACTIONS_STATEMENT = register_statement(
+    "book_transactions",
+    "select * from book_transactions("
+    "   order_id => $1,"
+    "   source_account_ids => $2,"
+    "   target_account_ids => $3,"
+    "   amounts => $4,"
+    "   vouchers_amounts => $5,"
+    "   descriptions => $6,"
+    "   conducting_user_id => $7)",
+)
 
 
 async def book_transaction(
@@ -31,3 +43,31 @@ async def book_transaction(
         voucher_amount,
         conducting_user_id,
     )
+
+
+async def book_transactions(
+    *,
+    conn: Connection,
+    order_id: int,
+    source_account_ids: list[int],
+    target_account_ids: list[int],
+    amounts: list[float],
+    voucher_amounts: list[int],
+    descriptions: Optional[list[str]] = None,
+    conducting_user_id: Optional[int] = None,
+) -> list[int]:
+    """
+    Book multiple transactions of one order with a single database round trip.
+    All lists are matched up by index, i.e. the i-th transaction consists of the i-th element of each list.
+    """
+    rows = await conn.fetch(
+        _BOOK_TRANSACTIONS_STATEMENT,
+        order_id,
+        source_account_ids,
+        target_account_ids,
+        amounts,
+        voucher_amounts,
+        descriptions,
+        conducting_user_id,
+    )
+    return [row[0] for row in rows]
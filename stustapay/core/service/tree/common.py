@@ -1,3 +1,7 @@
+import asyncio
+import time
+from typing import Optional
+
 from pydantic import BaseModel
 
 from stustapay.core.schema.tree import (
@@ -8,6 +12,7 @@ from stustapay.core.schema.tree import (
     RestrictedEventSettings,
 )
 from stustapay.core.schema.user import CurrentUser
+from stustapay.core.service.common.cache import NotificationCache
 from stustapay.core.service.common.error import NotFound
 from stustapay.framework.database import Connection
 
@@ -30,26 +35,198 @@ async def _fetch_translation_textx(conn: Connection, event_id: int) -> dict[Lang
     return result
 
 
-async def fetch_node(conn: Connection, node_id: int) -> Node | None:
-    node = await conn.fetch_maybe_one(
-        Node, "select n.*, '{}'::json array as children from node_with_allowed_objects n where n.id = $1", node_id
+async def _fetch_translation_texts_by_event(
+    conn: Connection, event_ids: list[int]
+) -> dict[int, dict[Language, dict[str, str]]]:
+    rows = await conn.fetch(
+        "select event_id, lang_code, type, content from translation_text where event_id = any($1)", event_ids
     )
-    if node is None:
-        return None
-    if node.event is not None:
-        node.event.translation_texts = await _fetch_translation_textx(conn=conn, event_id=node.event.id)
-    node_map: dict[int, Node] = {node.id: node}
+    result: dict[int, dict[Language, dict[str, str]]] = {}
+    for row in rows:
+        text = TranslationText.model_validate(dict(row))
+        result.setdefault(row["event_id"], {}).setdefault(text.lang_code, {})[text.type] = text.content
+    return result
 
-    children = await conn.fetch_many(
+
+async def _fetch_nodes(conn: Connection, condition: str, *args) -> list[Node]:
+    """
+    fetch all nodes matching the given condition ordered by path, i.e. parents before their children.
+    Translation texts of all events are fetched with one additional query.
+    """
+    nodes = await conn.fetch_many(
         Node,
-        "select n.*, '{}'::json array as children "
-        "from node_with_allowed_objects n "
-        "where n.path like $1 order by path asc",
-        f"{node.path}/%",
+        f"select n.*, '{{}}'::json array as children from node_with_allowed_objects n where {condition} "
+        "order by n.path asc",
+        *args,
     )
-    for child in children:
-        if child.event is not None:
-            child.event.translation_texts = await _fetch_translation_textx(conn=conn, event_id=child.event.id)
+    event_ids = [node.event.id for node in nodes if node.event is not None]
+    if len(event_ids) > 0:
+        translation_texts = await _fetch_translation_texts_by_event(conn=conn, event_ids=event_ids)
+        for node in nodes:
+            if node.event is not None:
+                node.event.translation_texts = translation_texts.get(node.event.id, {})
+    return nodes
+
+
+class NodeTreeSnapshot(NotificationCache[int, Node]):
+    """
+    In-process copy of the whole node tree, loaded with two queries and indexed by node id and parent.
+
+    The node_tree_changed trigger sends the id of every changed node, only the subtree below that node is reloaded
+    while handling the notification. Any other invalidation drops the whole snapshot, it is reloaded in the background
+    after the next (re)connect of the listener.
+
+    Nodes written by this process are marked as pending until their notification arrived. In the meantime lookups
+    of subtrees containing a pending node or one of its ancestors go to the database, so a write is immediately
+    visible to subsequent reads of the same process.
+    """
+
+    # how long to wait for the notification of a pending node, e.g. it never arrives if the transaction was rolled back
+    PENDING_TIMEOUT = 5.0
+
+    def __init__(self):
+        super().__init__(name="node_tree", channel="node_tree")
+        self._loaded = False
+        self._children: dict[int, list[int]] = {}
+        # pending node id -> (deadline, ids of the node and all its ancestors)
+        self._pending: dict[int, tuple[float, set[int]]] = {}
+        self._reload_task: Optional[asyncio.Task] = None
+        # set when a node changed while the whole tree was being reloaded
+        self._reload_outdated = False
+
+    def invalidate(self, key: Optional[int] = None):
+        del key
+        super().invalidate()
+        self._loaded = False
+        self._children.clear()
+
+    def _store(self, nodes: list[Node]):
+        for node in nodes:
+            self._entries[node.id] = (time.monotonic(), node)
+
+        # nodes are stored without their children, parents come before children when ordered by path
+        children: dict[int, list[int]] = {}
+        for _, node in sorted(self._entries.values(), key=lambda entry: entry[1].path):
+            if node.parent != node.id:
+                children.setdefault(node.parent, []).append(node.id)
+        self._children = children
+
+    def _remove_subtree(self, node_id: int):
+        for child_id in self._children.pop(node_id, []):
+            self._remove_subtree(child_id)
+        self._entries.pop(node_id, None)
+
+    def mark_pending(self, node_id: int, ids_to_root: Optional[list[int]] = None):
+        """bypass the snapshot for all subtrees affected by the given node until its notification has been processed"""
+        self._pending[node_id] = (time.monotonic() + self.PENDING_TIMEOUT, set(ids_to_root or [node_id]))
+
+    def _is_pending(self, node: Node) -> bool:
+        """
+        check if a pending change affects the subtree of the given node,
+        i.e. the pending node is the node itself, one of its descendants or one of its ancestors
+        """
+        now = time.monotonic()
+        for node_id in [node_id for node_id, (deadline, _) in self._pending.items() if deadline < now]:
+            del self._pending[node_id]
+        ids_to_root = set(node.ids_to_root)
+        return any(
+            node.id in pending_ids_to_root or pending_id in ids_to_root
+            for pending_id, (_, pending_ids_to_root) in self._pending.items()
+        )
+
+    async def _reload(self, generation: int):
+        assert self._db_pool is not None
+        try:
+            while True:
+                self._reload_outdated = False
+                async with self._db_pool.acquire() as conn:
+                    nodes = await _fetch_nodes(conn, "true")
+                if generation != self.generation:
+                    return
+                if not self._reload_outdated:
+                    break
+        except Exception:  # pylint: disable=broad-except
+            # the snapshot stays unloaded, lookups go to the database until the next (re)connect of the listener
+            self.logger.exception("Error while loading the node tree snapshot")
+            return
+
+        self._store(nodes)
+        self._loaded = True
+        self._pending.clear()
+
+    def _stop_listening(self):
+        super()._stop_listening()
+        if self._reload_task is not None:
+            self._reload_task.cancel()
+            self._reload_task = None
+
+    async def handle_notification(self, payload: Optional[str]):
+        if payload is None:
+            self.invalidate()
+            # loading the whole tree can take longer than the notification handler may run
+            if self._reload_task is not None:
+                self._reload_task.cancel()
+            self._reload_task = asyncio.create_task(self._reload(self.generation))
+            return
+
+        if not self._loaded:
+            self._reload_outdated = True
+            return
+
+        assert self._db_pool is not None
+        node_id = int(payload)
+        async with self._db_pool.acquire() as conn:
+            entry = self._entries.get(node_id)
+            if entry is None:
+                nodes = await _fetch_nodes(conn, "n.id = $1", node_id)
+            else:
+                nodes = await _fetch_nodes(conn, "n.id = $1 or n.path like $2", node_id, f"{entry[1].path}/%")
+        self._remove_subtree(node_id)
+        self._store(nodes)
+        self._pending.pop(node_id, None)
+
+    def _copy_subtree(self, node_id: int) -> Node:
+        _, node = self._entries[node_id]
+        return node.model_copy(
+            update={"children": [self._copy_subtree(child_id) for child_id in self._children.get(node_id, [])]},
+            deep=True,
+        )
+
+    def get_node(self, node_id: int) -> Optional[Node]:
+        """get a copy of a node including all its descendants, None if the node is not part of the snapshot"""
+        if not self.enabled or not self._loaded:
+            return None
+        entry = self._entries.get(node_id)
+        if entry is None or self._is_pending(entry[1]):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self._copy_subtree(node_id)
+
+
+node_tree_snapshot = NodeTreeSnapshot()
+
+
+async def fetch_node(conn: Connection, node_id: int, cached: bool = True) -> Node | None:
+    """
+    get a node including all its descendants.
+    Served from the in-process node tree snapshot while its notification listener is running, pass cached=False
+    to read nodes modified in the current transaction, the snapshot is then bypassed until the change has arrived.
+    """
+    if cached:
+        cached_node = node_tree_snapshot.get_node(node_id)
+        if cached_node is not None:
+            return cached_node
+
+    nodes = await _fetch_nodes(conn, "n.id = $1 or n.path like (select path || '/%' from node where id = $1)", node_id)
+    if not cached:
+        node_tree_snapshot.mark_pending(node_id, nodes[0].ids_to_root if len(nodes) > 0 else None)
+    if len(nodes) == 0:
+        return None
+
+    node = nodes[0]
+    node_map: dict[int, Node] = {node.id: node}
+    for child in nodes[1:]:
         node_map[child.parent].children.append(child)
         node_map[child.id] = child
 
@@ -114,10 +291,14 @@ async def fetch_event_node_for_node(conn: Connection, node_id: int) -> Node | No
     return await fetch_node(conn=conn, node_id=event_node_id)
 
 
-async def fetch_restricted_event_settings_for_node(conn: Connection, node_id: int) -> RestrictedEventSettings:
-    event_node_id = await conn.fetchval("select event_node_id from node where id = $1", node_id)
-    if event_node_id is None:
-        raise NotFound(element_typ="node", element_id=node_id)
+# invalidated by the event_settings_changed trigger on changes to events and their translation texts,
+# the ttl guards against notifications missed while the listener reconnects
+event_settings_cache: NotificationCache[int, RestrictedEventSettings] = NotificationCache(
+    name="event_settings", channel="event_settings", ttl=300
+)
+
+
+async def _fetch_restricted_event_settings(conn: Connection, event_node_id: int) -> RestrictedEventSettings:
     settings = await conn.fetch_one(
         RestrictedEventSettings,
         "select e.* from event_with_translations e join node n on n.event_id = e.id where n.id = $1",
@@ -125,3 +306,19 @@ async def fetch_restricted_event_settings_for_node(conn: Connection, node_id: in
     )
     settings.translation_texts = await _fetch_translation_textx(conn=conn, event_id=settings.id)
     return settings
+
+
+async def fetch_restricted_event_settings_for_node(conn: Connection, node_id: int) -> RestrictedEventSettings:
+    """
+    get the settings of the event the given node belongs to.
+    Served from an in-process cache by event node while its notification listener is running,
+    every caller gets its own copy of the cached settings.
+    """
+    event_node_id = await conn.fetchval("select event_node_id from node where id = $1", node_id)
+    if event_node_id is None:
+        raise NotFound(element_typ="node", element_id=node_id)
+    settings = await event_settings_cache.get_or_load(
+        event_node_id, lambda: _fetch_restricted_event_settings(conn=conn, event_node_id=event_node_id), conn=conn
+    )
+    assert settings is not None
+    return settings.model_copy(deep=True)
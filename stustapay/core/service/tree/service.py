@@ -53,7 +53,7 @@ async def create_node(conn: Connection, parent_id: int, new_node: NewNode, event
     await _update_forbidden_objects_in_subtree(
         conn=conn, node_id=new_node_id, allowed=new_node.forbidden_objects_in_subtree
     )
-    result = await fetch_node(conn=conn, node_id=new_node_id)
+    result = await fetch_node(conn=conn, node_id=new_node_id, cached=False)
     assert result is not None
     return result
 
@@ -199,7 +199,7 @@ class TreeService(DBService):
         await _update_forbidden_objects_in_subtree(
             conn=conn, node_id=node.id, allowed=updated_node.forbidden_objects_in_subtree
         )
-        result = await fetch_node(conn=conn, node_id=node.id)
+        result = await fetch_node(conn=conn, node_id=node.id, cached=False)
         assert result is not None
         return result
 
@@ -262,7 +262,7 @@ class TreeService(DBService):
                     text_type,
                     content,
                 )
-        updated_node = await fetch_node(conn=conn, node_id=node.id)
+        updated_node = await fetch_node(conn=conn, node_id=node.id, cached=False)
         assert updated_node is not None
         return updated_node
 
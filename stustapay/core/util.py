@@ -34,8 +34,14 @@ def log_setup(setting: int, default=1):
     )
 
     factor = clamp(default + setting, 0, len(levels) - 1)
-    level = levels[factor]
+    log_setup_level(levels[factor])
 
+
+def log_setup_level(level: int):
+    """
+    Perform setup for the logger with an explicit log level,
+    e.g. in worker processes which should log like their parent.
+    """
     logging.basicConfig(level=level, format="[%(asctime)s] %(message)s")
     logging.captureWarnings(True)
 
@@ -2,11 +2,13 @@
 some basic api endpoints.
 """
 
+from typing import Optional
+
 from fastapi import APIRouter, Response, status
 
 from stustapay.core.http.auth_customer import CurrentAuthToken
 from stustapay.core.http.context import ContextCustomerService
-from stustapay.core.schema.customer import Customer, OrderWithBon
+from stustapay.core.schema.customer import Customer, OrderWithBon, OrderWithBonPage
 from stustapay.core.service.customer.customer import (
     CustomerBank,
     CustomerPortalApiConfig,
@@ -39,6 +41,16 @@ async def get_orders(
     return await customer_service.get_orders_with_bon(token=token)
 
 
+@router.get("/orders_with_bon/paginated", summary="Obtain a page of customer orders", response_model=OrderWithBonPage)
+async def get_orders_paginated(
+    token: CurrentAuthToken,
+    customer_service: ContextCustomerService,
+    cursor: Optional[str] = None,
+    limit: int = 20,
+):
+    return await customer_service.get_orders_with_bon_paginated(token=token, cursor=cursor, limit=limit)
+
+
 @router.post("/customer_info", summary="set iban, account name and email", status_code=status.HTTP_204_NO_CONTENT)
 async def update_customer_info(
     token: CurrentAuthToken,
@@ -8,7 +8,10 @@ from stustapay.core.healthcheck import run_healthcheck
 from stustapay.core.http.context import Context
 from stustapay.core.http.server import Server
 from stustapay.core.service.config import ConfigService
-from stustapay.core.service.customer.customer import CustomerService
+from stustapay.core.service.customer.customer import (
+    CustomerService,
+    customer_order_history_cache,
+)
 from stustapay.core.service.user import AuthService
 
 from .routers import auth, base, sumup
@@ -41,7 +44,7 @@ class Api:
         self.server = get_server(config)
 
     async def run(self):
-        db_pool = await self.server.db_connect(self.cfg.database)
+        db_pool = await self.server.db_connect(self.cfg.database, pool_config=self.cfg.customerportal.db_pool)
         await database.check_revision_version(db_pool)
 
         auth_service = AuthService(db_pool=db_pool, config=self.cfg)
@@ -60,6 +63,7 @@ class Api:
         try:
             self.server.add_task(asyncio.create_task(run_healthcheck(db_pool=db_pool, service_name="customer_portal")))
             self.server.add_task(asyncio.create_task(customer_service.sumup.run_sumup_checkout_processing()))
+            self.server.add_task(asyncio.create_task(customer_order_history_cache.listen(db_pool)))
             await self.server.run(self.cfg, context)
         finally:
             await db_pool.close()
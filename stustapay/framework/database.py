@@ -1,5 +1,7 @@
 import asyncio
 import contextlib
+import functools
+import inspect
 import json
 import logging
 import os
@@ -7,13 +9,15 @@ import re
 import shutil
 import ssl
 import tempfile
+import time
 from pathlib import Path
-from typing import Literal, Optional, Type, TypeVar, Union
+from typing import Any, Awaitable, Literal, Optional, Type, TypeVar, Union
 
 import asyncpg
-from pydantic import BaseModel
+from pydantic import BaseModel, TypeAdapter
 
 from stustapay.core import util
+from stustapay.framework.metrics import LatencyHistogram
 
 logger = logging.getLogger(__name__)
 
@@ -32,6 +36,16 @@ class DatabaseConfig(BaseModel):
     sslrootcert: Optional[str] = None
 
 
+class DBPoolConfig(BaseModel):
+    min_size: int = 10
+    max_size: int = 10
+    # seconds after which idle connections are closed, asyncpg also closes those kept open by min_size.
+    # They are opened again when they are acquired the next time.
+    max_idle_time: float = 300
+    # seconds to wait for a free connection before failing with a timeout, None waits forever
+    acquire_timeout: Optional[float] = None
+
+
 async def psql_attach(config: DatabaseConfig):
     with contextlib.ExitStack() as exitstack:
         env = dict(os.environ)
@@ -319,37 +333,276 @@ async def apply_revisions(
 
 T = TypeVar("T", bound=BaseModel)
 
+# upper bounds in seconds of the latency histogram buckets of prepared statements, the last bucket is unbounded
+STATEMENT_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+class StatementStats(BaseModel):
+    name: str
+    executions: int
+    errors: int
+    total_time: float
+    # number of executions per latency bucket, see STATEMENT_LATENCY_BUCKETS
+    latency_histogram: list[int]
+
+
+class Statement:
+    """
+    A named query which is prepared once on every database connection, see register_statement.
+    Execution counts and latencies are collected over all connections of this process.
+    """
+
+    def __init__(self, name: str, query: str):
+        self.name = name
+        self.query = query
+
+        self.executions = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.latency_histogram = LatencyHistogram(STATEMENT_LATENCY_BUCKETS)
+
+    def record_execution(self, duration: float, failed: bool):
+        self.executions += 1
+        if failed:
+            self.errors += 1
+        self.total_time += duration
+        self.latency_histogram.record(duration)
+
+    def stats(self) -> StatementStats:
+        return StatementStats(
+            name=self.name,
+            executions=self.executions,
+            errors=self.errors,
+            total_time=self.total_time,
+            latency_histogram=self.latency_histogram.snapshot(),
+        )
+
+
+_registered_statements: dict[str, Statement] = {}
+
+# size of the statement cache of every connection, asyncpg defaults to 100 which is shared by the registered statements
+# and all other queries
+STATEMENT_CACHE_SIZE = 500
+
+
+def register_statement(name: str, query: str) -> Statement:
+    """
+    Declare a hot query which is prepared eagerly on every new database connection.
+    The returned statement can be passed instead of the query string to the fetch* methods of Connection.
+
+    Prepared statements live in the statement cache of asyncpg, an LRU shared with all other queries of the
+    connection. A registered statement can therefore still be evicted by many other distinct queries, it is then
+    transparently prepared again on its next use. STATEMENT_CACHE_SIZE leaves room for the registered statements
+    next to the other queries.
+    """
+    statement = _registered_statements.get(name)
+    if statement is not None:
+        if statement.query != query:
+            raise ValueError(f"A different statement with name {name} has already been registered")
+        return statement
+
+    statement = Statement(name=name, query=query)
+    _registered_statements[name] = statement
+    return statement
+
+
+def statement_stats() -> list[StatementStats]:
+    return [statement.stats() for statement in _registered_statements.values()]
+
+
+@functools.cache
+def model_list_adapter(model: Type[T]) -> TypeAdapter[list[T]]:
+    """
+    Validator for a list of models.
+    Validating all rows of a query result in one call is considerably cheaper than calling model_validate per row.
+    """
+    return TypeAdapter(list[model])  # type: ignore[valid-type]
+
 
 class Connection(asyncpg.Connection):
-    async def fetch_one(self, model: Type[T], query: str, *args) -> T:
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # time.monotonic() before the outermost transaction of this connection was started, the snapshot of the
+        # transaction can not be older than that
+        self.transaction_started_at: Optional[float] = None
+
+    def transaction(self, *, isolation=None, readonly=False, deferrable=False):
+        if not self.is_in_transaction():
+            self.transaction_started_at = time.monotonic()
+        return super().transaction(isolation=isolation, readonly=readonly, deferrable=deferrable)
+
+    async def prepare_statements(self):
+        """
+        Prepare all registered statements on this connection by placing them in the asyncpg statement cache.
+        Statements which cannot be prepared yet, e.g. because the database schema has not been created, are prepared
+        on their first use.
+        """
+        # a bare prepare leaves the implicit transaction of the extended query protocol open, so a following
+        # "begin isolation level ..." would fail. Preparing inside an explicit transaction closes it again.
+        try:
+            async with self.transaction():
+                for statement in _registered_statements.values():
+                    await self._get_statement(statement.query, None)
+        except asyncpg.PostgresError as e:
+            logger.debug(f"Could not prepare all statements, remaining ones are prepared on first use: {e}")
+
+    @staticmethod
+    async def _run_statement(statement: Statement, execution: Awaitable[Any]) -> Any:
+        # statements which became invalid due to a schema change are prepared again by asyncpg outside of transactions
+        start = time.monotonic()
+        failed = True
+        try:
+            result = await execution
+            failed = False
+            return result
+        finally:
+            statement.record_execution(time.monotonic() - start, failed=failed)
+
+    async def execute(self, query: Union[str, Statement], *args, timeout: Optional[float] = None) -> str:
+        if isinstance(query, Statement):
+            return await self._run_statement(query, super().execute(query.query, *args, timeout=timeout))
+        return await super().execute(query, *args, timeout=timeout)
+
+    async def fetch(self, query: Union[str, Statement], *args, timeout=None, record_class=None) -> list:
+        if isinstance(query, Statement):
+            return await self._run_statement(
+                query, super().fetch(query.query, *args, timeout=timeout, record_class=record_class)
+            )
+        return await super().fetch(query, *args, timeout=timeout, record_class=record_class)
+
+    async def fetchrow(self, query: Union[str, Statement], *args, timeout=None, record_class=None):
+        if isinstance(query, Statement):
+            return await self._run_statement(
+                query, super().fetchrow(query.query, *args, timeout=timeout, record_class=record_class)
+            )
+        return await super().fetchrow(query, *args, timeout=timeout, record_class=record_class)
+
+    async def fetchval(self, query: Union[str, Statement], *args, column=0, timeout=None):
+        if isinstance(query, Statement):
+            return await self._run_statement(
+                query, super().fetchval(query.query, *args, column=column, timeout=timeout)
+            )
+        return await super().fetchval(query, *args, column=column, timeout=timeout)
+
+    async def fetch_one(self, model: Type[T], query: Union[str, Statement], *args) -> T:
         result: Optional[asyncpg.Record] = await self.fetchrow(query, *args)
         if result is None:
             raise asyncpg.DataError("not found")
 
         return model.model_validate(dict(result))
 
-    async def fetch_maybe_one(self, model: Type[T], query: str, *args) -> Optional[T]:
+    async def fetch_maybe_one(self, model: Type[T], query: Union[str, Statement], *args) -> Optional[T]:
         result: Optional[asyncpg.Record] = await self.fetchrow(query, *args)
         if result is None:
             return None
 
         return model.model_validate(dict(result))
 
-    async def fetch_many(self, model: Type[T], query: str, *args) -> list[T]:
+    async def fetch_many(self, model: Type[T], query: Union[str, Statement], *args) -> list[T]:
         # TODO: also allow async cursor
         results: list[asyncpg.Record] = await self.fetch(query, *args)
-        return [model.model_validate(dict(r)) for r in results]
+        return model_list_adapter(model).validate_python([dict(r) for r in results])
 
 
 async def init_connection(conn: Connection):
     await conn.set_type_codec("json", encoder=json.dumps, decoder=json.loads, schema="pg_catalog")
     await conn.set_type_codec("jsonb", encoder=json.dumps, decoder=json.loads, schema="pg_catalog")
+    await conn.prepare_statements()
+
+
+CONNECTION_WAIT_BUCKETS = STATEMENT_LATENCY_BUCKETS
+
+
+class PoolStats(BaseModel):
+    min_size: int
+    max_size: int
+    size: int
+    in_use: int
+    acquisitions: int
+    acquire_timeouts: int
+    # seconds spent waiting for a connection
+    total_acquire_wait: float
+    max_acquire_wait: float
+    # number of acquisitions per waiting time bucket, see CONNECTION_WAIT_BUCKETS
+    acquire_wait_histogram: list[int]
 
 
-async def create_db_pool(cfg: DatabaseConfig, n_connections=10) -> asyncpg.Pool:
+# the pool options asyncpg.create_pool defaults to, asyncpg.Pool itself requires all of them
+_POOL_DEFAULTS = {
+    name: param.default
+    for name, param in inspect.signature(asyncpg.create_pool).parameters.items()
+    if param.kind == inspect.Parameter.KEYWORD_ONLY
+}
+
+
+class _TimedAcquireContext:
+    """wraps the result of asyncpg.Pool.acquire to record how long the acquisition took"""
+
+    def __init__(self, pool: "Pool", context):
+        self.pool = pool
+        self.context = context
+
+    async def __aenter__(self):
+        return await self.pool._timed_acquire(self.context.__aenter__())  # pylint: disable=protected-access
+
+    async def __aexit__(self, *exc):
+        await self.context.__aexit__(*exc)
+
+    def __await__(self):
+        return self.pool._timed_acquire(self.context).__await__()  # pylint: disable=protected-access
+
+
+class Pool(asyncpg.Pool):
+    """connection pool which keeps track of how long its users wait for a connection"""
+
+    def __init__(self, *args, acquire_timeout: Optional[float] = None, **kwargs):
+        super().__init__(*args, **{**_POOL_DEFAULTS, **kwargs})
+        self.acquire_timeout = acquire_timeout
+        self.acquisitions = 0
+        self.acquire_timeouts = 0
+        self.total_acquire_wait = 0.0
+        self.max_acquire_wait = 0.0
+        self.acquire_wait_histogram = LatencyHistogram(CONNECTION_WAIT_BUCKETS)
+
+    def acquire(self, *, timeout=None):
+        return _TimedAcquireContext(self, super().acquire(timeout=self.acquire_timeout if timeout is None else timeout))
+
+    async def _timed_acquire(self, acquisition: Awaitable):
+        start = time.monotonic()
+        try:
+            connection = await acquisition
+        except asyncio.TimeoutError:
+            self.acquire_timeouts += 1
+            raise
+        wait = time.monotonic() - start
+        self.acquisitions += 1
+        self.total_acquire_wait += wait
+        self.max_acquire_wait = max(self.max_acquire_wait, wait)
+        self.acquire_wait_histogram.record(wait)
+        return connection
+
+    def stats(self) -> PoolStats:
+        return PoolStats(
+            min_size=self.get_min_size(),
+            max_size=self.get_max_size(),
+            size=self.get_size(),
+            in_use=self.get_size() - self.get_idle_size(),
+            acquisitions=self.acquisitions,
+            acquire_timeouts=self.acquire_timeouts,
+            total_acquire_wait=self.total_acquire_wait,
+            max_acquire_wait=self.max_acquire_wait,
+            acquire_wait_histogram=self.acquire_wait_histogram.snapshot(),
+        )
+
+
+async def create_db_pool(cfg: DatabaseConfig, n_connections=10, pool_config: Optional[DBPoolConfig] = None) -> Pool:
     """
-    get a connection pool to the database
+    get a connection pool to the database, sized according to the pool config if given,
+    otherwise keeping exactly n_connections open
     """
+    if pool_config is None:
+        pool_config = DBPoolConfig(min_size=n_connections, max_size=n_connections)
+
     pool = None
 
     retry_counter = 0
@@ -366,15 +619,19 @@ async def create_db_pool(cfg: DatabaseConfig, n_connections=10) -> asyncpg.Pool:
             else:
                 sslctx = "verify-full" if cfg.require_ssl else "prefer"
 
-            pool = await asyncpg.create_pool(
+            pool = await Pool(
                 user=cfg.user,
                 password=cfg.password,
                 database=cfg.dbname,
                 host=cfg.host,
                 port=cfg.port,
-                max_size=n_connections,
+                max_size=pool_config.max_size,
                 connection_class=Connection,
-                min_size=n_connections,
+                record_class=asyncpg.Record,
+                min_size=pool_config.min_size,
+                max_inactive_connection_lifetime=pool_config.max_idle_time,
+                statement_cache_size=STATEMENT_CACHE_SIZE,
+                acquire_timeout=pool_config.acquire_timeout,
                 ssl=sslctx,
                 # the introspection query of asyncpg (defined as introspection.INTRO_LOOKUP_TYPES)
                 # can take 1s with the jit.
@@ -0,0 +1,20 @@
+from bisect import bisect_left
+from typing import Sequence
+
+
+class LatencyHistogram:
+    """
+    Counts durations in buckets given by their upper bounds in seconds, the last bucket is unbounded.
+    Used for the stats of database statements, connection acquisitions and http requests.
+    """
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+
+    def record(self, duration: float):
+        self.counts[bisect_left(self.buckets, duration)] += 1
+
+    def snapshot(self) -> list[int]:
+        """number of recorded durations per bucket"""
+        return list(self.counts)
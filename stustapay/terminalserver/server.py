@@ -3,22 +3,44 @@ handles connections with ordering terminals.
 """
 
 import asyncio
+import functools
 import json
 import logging
+import multiprocessing
+import signal
+import socket
+import time
+from multiprocessing.process import BaseProcess
+from typing import Any, Callable, Coroutine, Optional, Sequence
+
+import asyncpg
 
 from stustapay.core import database
 from stustapay.core.config import Config
+from stustapay.core.deferred_deltas import apply_deferred_deltas
 from stustapay.core.healthcheck import run_healthcheck
 from stustapay.core.http.context import Context
 from stustapay.core.http.server import Server
 from stustapay.core.service.account import AccountService
-from stustapay.core.service.auth import AuthService
+from stustapay.core.service.auth import AuthService, terminal_session_cache
+from stustapay.core.service.common.cache import listen_for_invalidations
 from stustapay.core.service.order import OrderService
 from stustapay.core.service.terminal import TerminalService
 from stustapay.core.service.till import TillService
+from stustapay.core.service.till.common import till_profile_config_cache
+from stustapay.core.service.tree.common import event_settings_cache, node_tree_snapshot
 from stustapay.core.service.user import UserService
+from stustapay.core.util import log_setup_level
 from stustapay.terminalserver.router import auth, base, cashier, customer, order, user
 
+# in-process caches of each terminal server worker, kept up to date over a single listening database connection
+TERMINALSERVER_CACHES = [node_tree_snapshot, terminal_session_cache, till_profile_config_cache, event_settings_cache]
+
+# notification listeners of each terminal server worker, each of them keeps one database connection
+TERMINALSERVER_LISTENERS: list[Callable[[asyncpg.Pool], Coroutine[Any, Any, None]]] = [
+    functools.partial(listen_for_invalidations, caches=TERMINALSERVER_CACHES),
+]
+
 
 def get_server(config: Config):
     server = Server(
@@ -42,35 +64,116 @@ def print_openapi(config: Config):
     print(json.dumps(server.get_openapi_spec()))
 
 
+def _run_worker(config: Config, worker_id: int, sock: socket.socket, log_level: int):
+    """entry point of a terminal server worker process"""
+    log_setup_level(log_level)
+    api = Api(config=config, worker_id=worker_id)
+    asyncio.run(api.serve(sockets=[sock]))
+
+
 class Api:
     """
     Talk with Terminals in the field.
     """
 
-    def __init__(self, config: Config):
+    def __init__(self, config: Config, worker_id: Optional[int] = None):
         self.cfg = config
+        self.worker_id = worker_id
         self.db_pool = None
+        config.terminalserver.check_db_connections_per_worker(n_listener_connections=len(TERMINALSERVER_LISTENERS))
 
         self.logger = logging.getLogger(__name__)
         self.server = get_server(config)
 
     async def run(self):
-        db_pool = await self.server.db_connect(self.cfg.database)
+        if self.cfg.terminalserver.n_workers > 1:
+            await self._run_workers()
+        else:
+            await self.serve()
+
+    async def _run_workers(self):
+        """
+        start the configured number of worker processes accepting connections on a shared socket.
+        The workers are stopped as soon as we are asked to shut down or one of them exits unexpectedly.
+        """
+        n_workers = self.cfg.terminalserver.n_workers
+        sock = self.server.bind_socket()
+        context = multiprocessing.get_context("spawn")
+        workers = [
+            context.Process(
+                target=_run_worker,
+                args=(self.cfg, worker_id, sock, logging.root.level),
+                name=f"terminalserver{worker_id}",
+            )
+            for worker_id in range(n_workers)
+        ]
+        for worker in workers:
+            worker.start()
+        self.logger.info(
+            f"Started {n_workers} terminal server workers with "
+            f"{self.cfg.terminalserver.db_connections_per_worker} db connections each"
+        )
+
+        loop = asyncio.get_running_loop()
+        shutdown = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, shutdown.set)
+        try:
+            while not shutdown.is_set() and all(worker.is_alive() for worker in workers):
+                try:
+                    await asyncio.wait_for(shutdown.wait(), timeout=1)
+                except asyncio.TimeoutError:
+                    pass
+            if not shutdown.is_set():
+                self.logger.error("A terminal server worker exited unexpectedly, stopping all workers")
+        finally:
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                loop.remove_signal_handler(sig)
+            await self._stop_workers(workers)
+            sock.close()
+
+        if any(worker.exitcode != 0 for worker in workers):
+            raise RuntimeError("Not all terminal server workers shut down cleanly")
+
+    async def _stop_workers(self, workers: Sequence[BaseProcess]):
+        # on SIGTERM uvicorn stops accepting connections and waits for running requests to finish
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+
+        deadline = time.monotonic() + self.cfg.terminalserver.shutdown_timeout
+        loop = asyncio.get_running_loop()
+        for worker in workers:
+            await loop.run_in_executor(None, worker.join, max(deadline - time.monotonic(), 0))
+            if worker.is_alive():
+                self.logger.warning(f"Terminal server worker {worker.name} did not shut down in time, killing it")
+                worker.kill()
+                await loop.run_in_executor(None, worker.join)
+
+    async def serve(self, sockets: Optional[list[socket.socket]] = None):
+        db_pool = await self.server.db_connect(self.cfg.database, pool_config=self.cfg.terminalserver.worker_db_pool)
         await database.check_revision_version(db_pool)
 
         auth_service = AuthService(db_pool=db_pool, config=self.cfg)
+        order_service = OrderService(db_pool=db_pool, config=self.cfg, auth_service=auth_service)
 
         context = Context(
             config=self.cfg,
             db_pool=db_pool,
-            order_service=OrderService(db_pool=db_pool, config=self.cfg, auth_service=auth_service),
+            order_service=order_service,
             user_service=UserService(db_pool=db_pool, config=self.cfg, auth_service=auth_service),
             till_service=TillService(db_pool=db_pool, config=self.cfg, auth_service=auth_service),
             account_service=AccountService(db_pool=db_pool, config=self.cfg, auth_service=auth_service),
             terminal_service=TerminalService(db_pool=db_pool, config=self.cfg, auth_service=auth_service),
         )
+        # every worker reports its own health
+        service_name = "terminalserver" if self.worker_id is None else f"terminalserver{self.worker_id}"
         try:
-            self.server.add_task(asyncio.create_task(run_healthcheck(db_pool=db_pool, service_name="terminalserver")))
-            await self.server.run(self.cfg, context)
+            self.server.add_task(asyncio.create_task(run_healthcheck(db_pool=db_pool, service_name=service_name)))
+            for listener in TERMINALSERVER_LISTENERS:
+                self.server.add_task(asyncio.create_task(listener(db_pool)))
+            # the bookings recording the deltas happen here, the job is kept running even without an admin server
+            self.server.add_task(asyncio.create_task(apply_deferred_deltas(db_pool, self.cfg.deferred_deltas)))
+            await self.server.run(self.cfg, context, sockets=sockets)
         finally:
             await db_pool.close()
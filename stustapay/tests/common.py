@@ -1,7 +1,17 @@
-from typing import TypeVar
+import asyncio
+from typing import Callable, TypeVar
 
 T = TypeVar("T")
 
 
 def list_equals(l1: list[T], l2: list[T]) -> bool:
     return all(e1 in l2 for e1 in l1) and all(e2 in l1 for e2 in l2)
+
+
+async def wait_until(condition: Callable[[], bool], timeout: float = 10):
+    """poll the condition until it holds, e.g. until a database notification has been processed"""
+    for _ in range(int(timeout / 0.1)):
+        if condition():
+            return
+        await asyncio.sleep(0.1)
+    assert condition(), f"condition did not hold within {timeout}s"
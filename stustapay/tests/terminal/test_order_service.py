@@ -4,16 +4,25 @@ import uuid
 import pytest
 
 from stustapay.core.schema.account import AccountType
-from stustapay.core.schema.order import NewPayOut, NewTopUp, PaymentMethod
+from stustapay.core.schema.order import (
+    NewPayOut,
+    NewTopUp,
+    OrderFilter,
+    OrderType,
+    PaymentMethod,
+)
 from stustapay.core.schema.till import NewTillProfile, Till, TillLayout
-from stustapay.core.schema.tree import Node, RestrictedEventSettings
-from stustapay.core.service.common.error import InvalidArgument
+from stustapay.core.schema.tree import NewNode, Node, RestrictedEventSettings
+from stustapay.core.service.common.error import InvalidArgument, Unauthorized
+from stustapay.core.service.common.retry import lock_customer_account
 from stustapay.core.service.order import OrderService
 from stustapay.core.service.order.order import (
     NotEnoughFundsException,
     TillPermissionException,
 )
 from stustapay.core.service.till import TillService
+from stustapay.core.service.tree.service import TreeService
+from stustapay.framework.database import Connection
 
 from ..conftest import Cashier
 from .conftest import (
@@ -80,6 +89,158 @@ async def test_topup_sumup_order_flow(
     await assert_system_account_balance(account_type=AccountType.sumup_entry, expected_balance=-20)
 
 
+async def test_booking_authenticates_before_locking_the_customer(
+    order_service: OrderService,
+    customer: Customer,
+):
+    new_topup = NewTopUp(
+        uuid=uuid.uuid4(),
+        amount=20,
+        payment_method=PaymentMethod.cash,
+        customer_tag_uid=customer.tag.uid,
+    )
+    async with order_service.db_pool.acquire() as conn:
+        async with lock_customer_account(conn, customer.tag.uid):
+            # an invalid token is rejected right away instead of waiting for the locked customer account
+            with pytest.raises(Unauthorized):
+                await order_service.book_topup(token="invalid", new_topup=new_topup)
+
+
+async def test_retried_bookings_are_replayed(
+    order_service: OrderService,
+    terminal_token: str,
+    assert_account_balance: AssertAccountBalance,
+    customer: Customer,
+    login_supervised_user: LoginSupervisedUser,
+    assign_cash_register: AssignCashRegister,
+    cashier: Cashier,
+):
+    await assign_cash_register(cashier=cashier)
+    await login_supervised_user(user_tag_uid=cashier.user_tag_uid, user_role_id=cashier.cashier_role.id)
+    new_topup = NewTopUp(
+        uuid=uuid.uuid4(),
+        amount=20,
+        payment_method=PaymentMethod.cash,
+        customer_tag_uid=customer.tag.uid,
+    )
+    completed_topup = await order_service.book_topup(token=terminal_token, new_topup=new_topup)
+    replayed_topup = await order_service.book_topup(token=terminal_token, new_topup=new_topup)
+    assert replayed_topup == completed_topup
+    await assert_account_balance(account_id=customer.account_id, expected_balance=START_BALANCE + 20)
+
+    # the balance reported for a replayed pay out is the one right after the original booking
+    new_pay_out = NewPayOut(uuid=uuid.uuid4(), customer_tag_uid=customer.tag.uid)
+    completed_pay_out = await order_service.book_pay_out(token=terminal_token, new_pay_out=new_pay_out)
+    assert completed_pay_out.new_balance == 0
+    # the balance check of a retry fails right away, the booked pay out is still found and replayed
+    assert await order_service.book_pay_out(token=terminal_token, new_pay_out=new_pay_out) == completed_pay_out
+    await order_service.book_topup(
+        token=terminal_token,
+        new_topup=NewTopUp(
+            uuid=uuid.uuid4(), amount=5, payment_method=PaymentMethod.cash, customer_tag_uid=customer.tag.uid
+        ),
+    )
+    replayed_pay_out = await order_service.book_pay_out(token=terminal_token, new_pay_out=new_pay_out)
+    assert replayed_pay_out == completed_pay_out
+    await assert_account_balance(account_id=customer.account_id, expected_balance=5)
+
+    # the same uuid cannot be used for a different kind of order
+    with pytest.raises(InvalidArgument):
+        await order_service.book_pay_out(
+            token=terminal_token, new_pay_out=NewPayOut(uuid=new_topup.uuid, customer_tag_uid=customer.tag.uid)
+        )
+
+    # a retry has to be for the same customer
+    with pytest.raises(InvalidArgument):
+        await order_service.book_topup(
+            token=terminal_token, new_topup=new_topup.model_copy(update={"customer_tag_uid": customer.tag.uid + 1})
+        )
+    await assert_account_balance(account_id=customer.account_id, expected_balance=5)
+
+
+async def test_list_orders_paginated(
+    order_service: OrderService,
+    terminal_token: str,
+    admin_token: str,
+    event_node: Node,
+    customer: Customer,
+    login_supervised_user: LoginSupervisedUser,
+    assign_cash_register: AssignCashRegister,
+    cashier: Cashier,
+    db_connection: Connection,
+    tree_service: TreeService,
+    till: Till,
+):
+    await assign_cash_register(cashier=cashier)
+    await login_supervised_user(user_tag_uid=cashier.user_tag_uid, user_role_id=cashier.cashier_role.id)
+    booked_ids = []
+    for _ in range(5):
+        completed_topup = await order_service.book_topup(
+            token=terminal_token,
+            new_topup=NewTopUp(
+                uuid=uuid.uuid4(), amount=1, payment_method=PaymentMethod.sumup, customer_tag_uid=customer.tag.uid
+            ),
+        )
+        booked_ids.append(completed_topup.uuid)
+    await order_service.book_pay_out(
+        token=terminal_token, new_pay_out=NewPayOut(uuid=uuid.uuid4(), customer_tag_uid=customer.tag.uid)
+    )
+
+    order_filter = OrderFilter(customer_account_id=customer.account_id, order_type=OrderType.top_up)
+    listed_ids: list[uuid.UUID] = []
+    cursor = None
+    while True:
+        page = await order_service.list_orders_paginated(
+            token=admin_token, node_id=event_node.id, order_filter=order_filter, cursor=cursor, limit=2
+        )
+        assert len(page.orders) <= 2
+        listed_ids.extend(order.uuid for order in page.orders)
+        if page.next_cursor is None:
+            break
+        cursor = page.next_cursor
+    assert listed_ids == list(reversed(booked_ids))
+
+    orders = await order_service.stream_orders(token=admin_token, node_id=event_node.id, order_filter=order_filter)
+    assert [order.uuid async for order in orders] == listed_ids
+
+    first_page = await order_service.list_orders_paginated(
+        token=admin_token,
+        node_id=event_node.id,
+        order_filter=OrderFilter(customer_account_id=customer.account_id),
+        limit=1,
+    )
+    assert first_page.orders[0].order_type == OrderType.pay_out
+    page = await order_service.list_orders_paginated(
+        token=admin_token,
+        node_id=event_node.id,
+        order_filter=OrderFilter(customer_account_id=customer.account_id, booked_until=first_page.orders[0].booked_at),
+    )
+    assert [order.uuid for order in page.orders] == list(reversed(booked_ids))
+
+    with pytest.raises(InvalidArgument):
+        await order_service.list_orders_paginated(
+            token=admin_token, node_id=event_node.id, order_filter=order_filter, cursor="invalid"
+        )
+    with pytest.raises(InvalidArgument):
+        await order_service.list_orders_paginated(
+            token=admin_token, node_id=event_node.id, order_filter=order_filter, limit=0
+        )
+
+    # only orders of tills visible at the node are listed
+    sub_node = await tree_service.create_node(
+        token=admin_token, node_id=event_node.id, new_node=NewNode(name="Order sub node", description="")
+    )
+    page = await order_service.list_orders_paginated(token=admin_token, node_id=sub_node.id, order_filter=order_filter)
+    assert [order.uuid for order in page.orders] == listed_ids
+    await db_connection.execute("update till set node_id = $1 where id = $2", sub_node.id, till.id)
+    page = await order_service.list_orders_paginated(
+        token=admin_token, node_id=event_node.id, order_filter=order_filter
+    )
+    assert page.orders == []
+    orders = await order_service.stream_orders(token=admin_token, node_id=event_node.id, order_filter=order_filter)
+    assert [order async for order in orders] == []
+
+
 async def test_cash_pay_out_flow_with_amount(
     order_service: OrderService,
     till_service: TillService,
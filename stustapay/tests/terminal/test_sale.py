@@ -192,6 +192,30 @@ async def test_basic_sale_flow(
         expected_balance=2 * sale_products.beer_product.price + 2 * sale_products.deposit_product.price,
     )
 
+    # a retried booking returns the already completed sale without booking it again
+    replayed_sale = await order_service.book_sale(token=terminal_token, new_sale=new_sale)
+    assert replayed_sale.id == completed_sale.id
+    assert replayed_sale.old_balance == completed_sale.old_balance
+    assert replayed_sale.new_balance == completed_sale.new_balance
+    assert replayed_sale.total_price == completed_sale.total_price
+    await assert_system_account_balance(
+        account_type=AccountType.sale_exit,
+        expected_balance=2 * sale_products.beer_product.price + 2 * sale_products.deposit_product.price,
+    )
+
+    # booked orders keep their line items' products as they were at booking time
+    await db_connection.execute("update product set name = 'Renamed beer' where id = $1", sale_products.beer_product.id)
+    order = await order_service.get_order(token=admin_token, node_id=event_node.id, order_id=completed_sale.id)
+    assert order is not None
+    assert {
+        line_item.product.name
+        for line_item in order.line_items
+        if line_item.product.id == sale_products.beer_product.id
+    } == {sale_products.beer_product.name}
+    await db_connection.execute(
+        "update product set name = $2 where id = $1", sale_products.beer_product.id, sale_products.beer_product.name
+    )
+
     # test that we can cancel this order
     await order_service.cancel_sale(token=terminal_token, order_id=order.id)
     customer_info = await till_service.get_customer(token=terminal_token, customer_tag_uid=customer.tag.uid)
@@ -516,6 +540,19 @@ async def test_cashier_close_out(
         ),
     )
 
+    shift_stats = await cashier_service.get_cashier_shift_stats(
+        token=admin_token, node_id=event_node.id, cashier_id=cashier.id
+    )
+    assert shift_stats is not None
+    assert {(s.product.id, s.quantity) for s in shift_stats.booked_products} == {
+        (sale_products.beer_product.id, 1),
+        (sale_products.deposit_product.id, 1),
+    }
+    all_shift_stats = await cashier_service.get_current_shift_stats_for_cashiers(
+        token=admin_token, node_id=event_node.id
+    )
+    assert all_shift_stats[cashier.id] == shift_stats
+
     cashier_info = await cashier_service.get_cashier(token=admin_token, node_id=event_node.id, cashier_id=cashier.id)
     assert cashier_info is not None
     actual_balance = 458.2
@@ -550,6 +587,14 @@ async def test_cashier_close_out(
     await assert_account_balance(account_id=cashier.cashier_account_id, expected_balance=0)
     shifts = await cashier_service.get_cashier_shifts(token=admin_token, node_id=event_node.id, cashier_id=cashier.id)
     assert len(shifts) == 1
+    closed_shift_stats = await cashier_service.get_cashier_shift_stats(
+        token=admin_token, node_id=event_node.id, cashier_id=cashier.id, shift_id=shifts[0].id
+    )
+    assert closed_shift_stats == shift_stats
+    all_shift_stats = await cashier_service.get_current_shift_stats_for_cashiers(
+        token=admin_token, node_id=event_node.id
+    )
+    assert all_shift_stats[cashier.id].booked_products == []
     n_orders = await get_num_orders(OrderType.money_transfer)
     assert n_orders_start + 4 == n_orders
     n_orders = await get_num_orders(OrderType.money_transfer_imbalance)
@@ -1,9 +1,14 @@
+import asyncio
+
+import asyncpg
 import pytest
 
-from stustapay.core.schema.till import CashRegister, CashRegisterStocking
+from stustapay.core.schema.till import CashRegister, CashRegisterStocking, Till
 from stustapay.core.schema.tree import Node
 from stustapay.core.schema.user import NewUser, NewUserToRole
+from stustapay.core.service.auth import AuthService, terminal_session_cache
 from stustapay.core.service.common.error import InvalidArgument
+from stustapay.core.service.terminal import TerminalService
 from stustapay.core.service.till import TillService
 from stustapay.core.service.user import UserService
 from stustapay.framework.database import Connection
@@ -104,3 +109,42 @@ async def test_transfer_cash_register(
     )
     assert cash_register_stocking.total == row["balance"]
     assert cash_register.id == row["cash_register_id"]
+
+
+async def test_terminal_session_cache(
+    setup_test_db_pool: asyncpg.Pool,
+    db_connection: Connection,
+    auth_service: AuthService,
+    terminal_service: TerminalService,
+    till: Till,
+    terminal_token: str,
+):
+    listener = asyncio.create_task(terminal_session_cache.listen(setup_test_db_pool))
+    try:
+        await asyncio.sleep(0.5)  # wait for connection listener to be set up
+        hits = terminal_session_cache.hits
+
+        terminal = await auth_service.get_terminal_from_token(conn=db_connection, token=terminal_token)
+        assert terminal is not None
+        assert terminal.till.id == till.id
+        assert terminal.till.active_user_id is not None
+        terminal = await auth_service.get_terminal_from_token(conn=db_connection, token=terminal_token)
+        assert terminal is not None
+        assert terminal_session_cache.hits == hits + 1
+
+        # logging out the user of the till invalidates the terminal session
+        await db_connection.execute(
+            "update till set active_user_id = null, active_user_role_id = null where id = $1", till.id
+        )
+        await asyncio.sleep(0.2)  # wait for the notification to arrive
+        terminal = await auth_service.get_terminal_from_token(conn=db_connection, token=terminal_token)
+        assert terminal is not None
+        assert terminal.till.active_user_id is None
+        assert terminal_session_cache.hits == hits + 1
+
+        await terminal_service.logout_terminal(token=terminal_token)
+        await asyncio.sleep(0.2)  # wait for the notification to arrive
+        assert await auth_service.get_terminal_from_token(conn=db_connection, token=terminal_token) is None
+    finally:
+        listener.cancel()
+        await asyncio.gather(listener, return_exceptions=True)
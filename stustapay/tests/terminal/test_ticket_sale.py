@@ -237,6 +237,13 @@ async def test_ticket_flow_with_initial_topup_sumup(
         account_type=AccountType.sale_exit, expected_balance=sale_exit_start_balance + sale_tickets.ticket.price
     )
 
+    # a retried booking returns the already completed ticket sale without booking it again
+    replayed_ticket = await order_service.book_ticket_sale(token=terminal_token, new_ticket_sale=new_ticket)
+    assert replayed_ticket == completed_ticket
+    await assert_system_account_balance(
+        account_type=AccountType.sumup_entry, expected_balance=sumup_start_balance - completed_ticket.total_price
+    )
+
 
 async def test_ticket_flow_with_multiple_tags_invalid_booking(
     order_service: OrderService,
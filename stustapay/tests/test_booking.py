@@ -0,0 +1,291 @@
+# pylint: disable=unexpected-keyword-arg,missing-kwoa
+from datetime import datetime, timedelta, timezone
+
+import asyncpg
+import pytest
+
+from stustapay.core.deferred_deltas import (
+    DEFERRED_DELTAS_LOCK_NAME,
+    apply_pending_deltas,
+)
+from stustapay.core.schema.account import AccountType
+from stustapay.core.schema.order import OrderType, PaymentMethod
+from stustapay.core.schema.product import NewProduct
+from stustapay.core.schema.tax_rate import TaxRate
+from stustapay.core.schema.till import Till
+from stustapay.core.schema.tree import Node
+from stustapay.core.service.account import (
+    get_system_account_for_node,
+    get_system_account_id_for_node,
+)
+from stustapay.core.service.order.booking import (
+    BookingIdentifier,
+    NewLineItem,
+    book_order,
+)
+from stustapay.core.service.order.order import fetch_order
+from stustapay.core.service.order.stats import get_hourly_product_stats
+from stustapay.core.service.product import ProductService
+from stustapay.core.service.transaction import book_transactions
+from stustapay.framework.database import Connection
+
+from .conftest import Cashier
+
+
+async def _create_transport_account(conn: Connection, node: Node, name: str) -> int:
+    return await conn.fetchval(
+        "insert into account (node_id, type, name) values ($1, 'transport', $2) returning id", node.id, name
+    )
+
+
+async def test_book_order_bulk_bookings(db_connection: Connection, event_node: Node, till: Till, cashier: Cashier):
+    acc_a = await _create_transport_account(db_connection, event_node, "a")
+    acc_b = await _create_transport_account(db_connection, event_node, "b")
+    acc_c = await _create_transport_account(db_connection, event_node, "c")
+
+    order_info = await book_order(
+        conn=db_connection,
+        order_type=OrderType.sale,
+        payment_method=PaymentMethod.tag,
+        cashier_id=cashier.id,
+        till_id=till.id,
+        line_items=[],
+        bookings={
+            BookingIdentifier(source_account_id=acc_a, target_account_id=acc_b): 10,
+            BookingIdentifier(source_account_id=acc_b, target_account_id=acc_c): -3,
+            BookingIdentifier(source_account_id=acc_a, target_account_id=acc_c): 2,
+        },
+        voucher_bookings={BookingIdentifier(source_account_id=acc_a, target_account_id=acc_b): 2},
+    )
+
+    balances = {
+        row["id"]: (row["balance"], row["vouchers"])
+        for row in await db_connection.fetch(
+            "select id, balance, vouchers from account where id = any($1)", [acc_a, acc_b, acc_c]
+        )
+    }
+    assert balances[acc_a] == (-12, -2)
+    assert balances[acc_b] == (13, 2)
+    assert balances[acc_c] == (-1, 0)
+
+    transactions = await db_connection.fetch(
+        "select source_account, target_account, amount, vouchers from transaction where order_id = $1 order by id",
+        order_info.id,
+    )
+    assert len(transactions) == 4
+    # negative bookings are stored with swapped accounts
+    assert (transactions[1]["source_account"], transactions[1]["target_account"]) == (acc_c, acc_b)
+    assert all(t["amount"] >= 0 and t["vouchers"] >= 0 for t in transactions)
+
+    with pytest.raises(asyncpg.exceptions.RaiseError):
+        await book_transactions(
+            conn=db_connection,
+            order_id=order_info.id,
+            source_account_ids=[acc_a, acc_b],
+            target_account_ids=[acc_b],
+            amounts=[1.0, 1.0],
+            voucher_amounts=[0, 0],
+        )
+
+    with pytest.raises(asyncpg.exceptions.RaiseError):
+        await book_transactions(
+            conn=db_connection,
+            order_id=order_info.id,
+            source_account_ids=[acc_a],
+            target_account_ids=[acc_b],
+            amounts=[-1.0],
+            voucher_amounts=[1],
+        )
+
+    # bookings on missing accounts must not be dropped silently
+    with pytest.raises(asyncpg.exceptions.RaiseError):
+        await book_transactions(
+            conn=db_connection,
+            order_id=order_info.id,
+            source_account_ids=[acc_a, None],  # type: ignore
+            target_account_ids=[acc_b, acc_c],
+            amounts=[1.0, 1.0],
+            voucher_amounts=[0, 0],
+        )
+
+
+async def test_deferred_account_balance(
+    setup_test_db_pool: asyncpg.Pool, db_connection: Connection, event_node: Node, till: Till, cashier: Cashier
+):
+    acc_a = await _create_transport_account(db_connection, event_node, "a")
+    sale_exit_id = await get_system_account_id_for_node(
+        conn=db_connection, node=event_node, account_type=AccountType.sale_exit
+    )
+    sale_exit = await get_system_account_for_node(
+        conn=db_connection, node=event_node, account_type=AccountType.sale_exit
+    )
+    assert sale_exit.id == sale_exit_id
+
+    await book_order(
+        conn=db_connection,
+        order_type=OrderType.sale,
+        payment_method=PaymentMethod.tag,
+        cashier_id=cashier.id,
+        till_id=till.id,
+        line_items=[],
+        bookings={BookingIdentifier(source_account_id=acc_a, target_account_id=sale_exit_id): 10},
+        voucher_bookings={BookingIdentifier(source_account_id=acc_a, target_account_id=sale_exit_id): 2},
+    )
+
+    # the sale exit row itself is not updated, its balance change is only recorded
+    row = await db_connection.fetchrow("select balance, vouchers from account where id = $1", sale_exit_id)
+    assert (row["balance"], row["vouchers"]) == (sale_exit.balance, sale_exit.vouchers)
+    assert await db_connection.fetchval("select balance from account where id = $1", acc_a) == -10
+    booked_sale_exit = await get_system_account_for_node(
+        conn=db_connection, node=event_node, account_type=AccountType.sale_exit
+    )
+    assert booked_sale_exit.balance == sale_exit.balance + 10
+    assert booked_sale_exit.vouchers == sale_exit.vouchers + 2
+
+    # only one server applies the deltas at a time
+    async with setup_test_db_pool.acquire() as other_conn:
+        await other_conn.execute("select pg_advisory_lock(hashtextextended($1, 0))", DEFERRED_DELTAS_LOCK_NAME)
+        assert await apply_pending_deltas(db_connection) is None
+        await other_conn.execute("select pg_advisory_unlock(hashtextextended($1, 0))", DEFERRED_DELTAS_LOCK_NAME)
+
+    applied = await apply_pending_deltas(db_connection)
+    assert applied is not None
+    assert applied.account_balances >= 1
+    row = await db_connection.fetchrow("select balance, vouchers from account where id = $1", sale_exit_id)
+    assert (row["balance"], row["vouchers"]) == (sale_exit.balance + 10, sale_exit.vouchers + 2)
+    assert (
+        await db_connection.fetchval("select count(*) from account_balance_delta where account_id = $1", sale_exit_id)
+        == 0
+    )
+    assert (
+        await get_system_account_for_node(conn=db_connection, node=event_node, account_type=AccountType.sale_exit)
+        == booked_sale_exit
+    )
+
+
+async def test_order_summary(
+    db_connection: Connection,
+    event_node: Node,
+    till: Till,
+    cashier: Cashier,
+    tax_rate_ust: TaxRate,
+    product_service: ProductService,
+    admin_token: str,
+):
+    product = await product_service.create_product(
+        token=admin_token,
+        node_id=event_node.id,
+        product=NewProduct(name="Summary product", price=3.0, tax_rate_id=tax_rate_ust.id, is_locked=True),
+    )
+    line_items = [
+        NewLineItem(quantity=2, product_id=product.id, product_price=3.0, tax_rate_id=tax_rate_ust.id),
+        NewLineItem(quantity=-1, product_id=product.id, product_price=3.0, tax_rate_id=tax_rate_ust.id),
+    ]
+    async with db_connection.transaction():
+        order_info = await book_order(
+            conn=db_connection,
+            order_type=OrderType.sale,
+            payment_method=PaymentMethod.tag,
+            cashier_id=cashier.id,
+            till_id=till.id,
+            line_items=line_items,
+            bookings={},
+        )
+        # the totals are written as part of the booking and can be read within the same transaction
+        order = await fetch_order(conn=db_connection, order_id=order_info.id)
+        assert order is not None
+        assert order.total_price == 3.0
+        assert order.total_tax == round(3.0 * 0.19 / 1.19, 2)
+        assert [line_item.item_id for line_item in order.line_items] == [0, 1]
+        assert order.line_items[0].product.id == product.id
+
+    # orders which were inserted without booking them via book_order are summarized at the end of the transaction
+    async with db_connection.transaction():
+        order_id = await db_connection.fetchval(
+            "insert into ordr (item_count, payment_method, order_type, cashier_id, till_id, z_nr) "
+            "values (1, 'tag', 'sale', $1, $2, 0) returning id",
+            cashier.id,
+            till.id,
+        )
+        await db_connection.execute(
+            "insert into line_item (order_id, item_id, product_id, product_price, quantity, tax_rate_id, tax_name, "
+            "tax_rate) values ($1, 0, $2, 4, 1, $3, 'ust', 0.19)",
+            order_id,
+            product.id,
+            tax_rate_ust.id,
+        )
+    order = await fetch_order(conn=db_connection, order_id=order_id)
+    assert order is not None
+    assert order.total_price == 4.0
+    assert len(order.line_items) == 1
+
+
+async def test_hourly_order_stats(
+    db_connection: Connection,
+    event_node: Node,
+    till: Till,
+    cashier: Cashier,
+    tax_rate_ust: TaxRate,
+    product_service: ProductService,
+    admin_token: str,
+):
+    product = await product_service.create_product(
+        token=admin_token,
+        node_id=event_node.id,
+        product=NewProduct(name="Stats product", price=2.5, tax_rate_id=tax_rate_ust.id, is_locked=True),
+    )
+    now = datetime.now(tz=timezone.utc)
+    from_time, to_time = now - timedelta(hours=1), now + timedelta(hours=1)
+
+    async def product_stats():
+        stats = await get_hourly_product_stats(
+            conn=db_connection, node=event_node, from_time=from_time, to_time=to_time
+        )
+        return next((s.intervals for s in stats if s.product_id == product.id), [])
+
+    for quantity in (2, 3):
+        async with db_connection.transaction():
+            await book_order(
+                conn=db_connection,
+                order_type=OrderType.sale,
+                payment_method=PaymentMethod.tag,
+                cashier_id=cashier.id,
+                till_id=till.id,
+                line_items=[
+                    NewLineItem(
+                        quantity=quantity, product_id=product.id, product_price=2.5, tax_rate_id=tax_rate_ust.id
+                    )
+                ],
+                bookings={},
+            )
+            # the hourly stats are only updated once the order is committed
+            assert len(await product_stats()) == (0 if quantity == 2 else 1)
+
+    intervals = await product_stats()
+    assert len(intervals) == 1
+    assert intervals[0].count == 5
+    assert intervals[0].revenue == 12.5
+    assert intervals[0].from_time <= now < intervals[0].to_time
+
+    # the stats of each order are appended and added to the hourly stats later on, which does not change them
+    assert (
+        await db_connection.fetchval("select count(*) from order_stats_hourly_delta where product_id = $1", product.id)
+        == 2
+    )
+    assert await db_connection.fetchval("select apply_order_stats_hourly_deltas()") >= 2
+    assert (
+        await db_connection.fetchval("select quantity from order_stats_hourly where product_id = $1", product.id) == 5
+    )
+    assert await product_stats() == intervals
+
+    # orders outside of the requested node are not counted
+    other_node = await db_connection.fetchval(
+        "insert into node (parent, name, description) values (0, $1, '') returning id", f"stats test {product.id}"
+    )
+    other_stats = await get_hourly_product_stats(
+        conn=db_connection,
+        node=event_node.model_copy(update={"id": other_node}),
+        from_time=from_time,
+        to_time=to_time,
+    )
+    assert other_stats == []
@@ -0,0 +1,255 @@
+# pylint: disable=unexpected-keyword-arg,missing-kwoa
+import asyncio
+import json
+
+import asyncpg
+
+from stustapay.core.healthcheck import Healtcheck
+from stustapay.core.schema.till import TillProfile
+from stustapay.core.schema.tree import Language, Node
+from stustapay.core.service.auth import AuthService, user_privilege_cache
+from stustapay.core.service.common.cache import (
+    NotificationCache,
+    cache_stats,
+    listen_for_invalidations,
+)
+from stustapay.core.service.till.common import (
+    fetch_till_profile_config,
+    till_profile_config_cache,
+)
+from stustapay.core.service.tree.common import (
+    event_settings_cache,
+    fetch_restricted_event_settings_for_node,
+)
+from stustapay.core.service.tree.service import TreeService
+from stustapay.core.service.user import UserService
+from stustapay.framework.database import Connection
+from stustapay.tests.common import wait_until
+
+
+async def test_notification_cache(setup_test_db_pool: asyncpg.Pool):
+    cache: NotificationCache[int, str] = NotificationCache(name="test", channel="test_cache")
+    n_loads = 0
+
+    async def loader():
+        nonlocal n_loads
+        n_loads += 1
+        return "value"
+
+    # without a listener nothing is cached
+    assert await cache.get_or_load(1, loader) == "value"
+    assert await cache.get_or_load(1, loader) == "value"
+    assert n_loads == 2
+    assert not cache.enabled
+
+    invalidations = cache.invalidations
+    listener = asyncio.create_task(cache.listen(setup_test_db_pool))
+    try:
+        # the listener invalidates the cache once it is set up
+        await wait_until(lambda: cache.invalidations > invalidations)
+        assert cache.enabled
+
+        assert await cache.get_or_load(1, loader) == "value"
+        assert await cache.get_or_load(1, loader) == "value"
+        assert n_loads == 3
+        stats = cache.stats()
+        assert stats.hits == 1
+        assert stats.size == 1
+
+        # values loaded before an invalidation are not stored
+        generation = cache.generation
+        cache.invalidate()
+        cache.put(2, "outdated", generation)
+        assert cache.get(2) is None
+
+        await cache.get_or_load(1, loader)
+        invalidations = cache.invalidations
+        await setup_test_db_pool.execute("select pg_notify('test_cache', '')")
+        await wait_until(lambda: cache.invalidations > invalidations)
+        assert cache.stats().size == 0
+        await cache.get_or_load(1, loader)
+        assert n_loads == 5
+    finally:
+        listener.cancel()
+        await asyncio.gather(listener, return_exceptions=True)
+
+    assert not cache.enabled
+    assert cache.stats().size == 0
+
+
+async def test_notification_cache_max_entries(setup_test_db_pool: asyncpg.Pool):
+    cache: NotificationCache[int, str] = NotificationCache(name="test_bounded", channel="test_cache", max_entries=2)
+    listener = asyncio.create_task(cache.listen(setup_test_db_pool))
+    try:
+        await wait_until(lambda: cache.invalidations > 0)  # wait for connection listener to be set up
+        cache.put(1, "one", cache.generation)
+        cache.put(2, "two", cache.generation)
+        assert cache.get(1) == "one"
+        # the least recently used entry is dropped
+        cache.put(3, "three", cache.generation)
+        assert cache.stats().size == 2
+        assert cache.get(2) is None
+        assert cache.get(1) == "one"
+        assert cache.get(3) == "three"
+    finally:
+        listener.cancel()
+        await asyncio.gather(listener, return_exceptions=True)
+
+
+async def test_shared_listener_and_snapshot_age(setup_test_db_pool: asyncpg.Pool):
+    first: NotificationCache[int, str] = NotificationCache(name="test_first", channel="test_cache_first")
+    second: NotificationCache[int, str] = NotificationCache(name="test_second", channel="test_cache_second")
+
+    async def loader():
+        return "value"
+
+    listener = asyncio.create_task(listen_for_invalidations(setup_test_db_pool, [first, second]))
+    try:
+        # wait for connection listener to be set up
+        await wait_until(lambda: first.invalidations > 0 and second.invalidations > 0)
+        assert first.enabled and second.enabled
+
+        await first.get_or_load(1, loader)
+        await second.get_or_load(1, loader)
+        invalidations = second.invalidations
+        await setup_test_db_pool.execute("select pg_notify('test_cache_second', '')")
+        await wait_until(lambda: second.invalidations > invalidations)
+        assert first.stats().size == 1
+        assert second.stats().size == 0
+
+        # a value read in a transaction which started before the last invalidation might be outdated
+        async with setup_test_db_pool.acquire() as conn:
+            async with conn.transaction(isolation="serializable"):
+                await conn.execute("select 1")
+                invalidations = second.invalidations
+                await setup_test_db_pool.execute("select pg_notify('test_cache_second', '')")
+                await wait_until(lambda: second.invalidations > invalidations)
+                assert await second.get_or_load(1, loader, conn=conn) == "value"
+                assert second.stats().size == 0
+
+            async with conn.transaction(isolation="serializable"):
+                await second.get_or_load(1, loader, conn=conn)
+                assert second.stats().size == 1
+
+        assert {"test_first", "test_second"} <= {stats.name for stats in cache_stats()}
+    finally:
+        listener.cancel()
+        await asyncio.gather(listener, return_exceptions=True)
+
+    assert not first.enabled and not second.enabled
+
+
+async def test_till_profile_config_cache(
+    setup_test_db_pool: asyncpg.Pool, db_connection: Connection, till_profile: TillProfile
+):
+    invalidations = till_profile_config_cache.invalidations
+    listener = asyncio.create_task(till_profile_config_cache.listen(setup_test_db_pool))
+    try:
+        # wait for connection listener to be set up
+        await wait_until(lambda: till_profile_config_cache.invalidations > invalidations)
+        hits = till_profile_config_cache.hits
+
+        profile_config = await fetch_till_profile_config(conn=db_connection, till_profile_id=till_profile.id)
+        assert profile_config is not None
+        assert profile_config.profile.allow_top_up
+        assert profile_config.button_products == {}
+
+        profile_config = await fetch_till_profile_config(conn=db_connection, till_profile_id=till_profile.id)
+        assert profile_config is not None
+        assert till_profile_config_cache.hits == hits + 1
+
+        invalidations = till_profile_config_cache.invalidations
+        await db_connection.execute("update till_profile set allow_top_up = false where id = $1", till_profile.id)
+        await wait_until(lambda: till_profile_config_cache.invalidations > invalidations)
+
+        profile_config = await fetch_till_profile_config(conn=db_connection, till_profile_id=till_profile.id)
+        assert profile_config is not None
+        assert not profile_config.profile.allow_top_up
+        assert till_profile_config_cache.hits == hits + 1
+    finally:
+        listener.cancel()
+        await asyncio.gather(listener, return_exceptions=True)
+
+
+async def test_event_settings_cache(setup_test_db_pool: asyncpg.Pool, db_connection: Connection, event_node: Node):
+    invalidations = event_settings_cache.invalidations
+    listener = asyncio.create_task(event_settings_cache.listen(setup_test_db_pool))
+    try:
+        # wait for connection listener to be set up
+        await wait_until(lambda: event_settings_cache.invalidations > invalidations)
+        hits = event_settings_cache.hits
+
+        settings = await fetch_restricted_event_settings_for_node(conn=db_connection, node_id=event_node.id)
+        cached_settings = await fetch_restricted_event_settings_for_node(conn=db_connection, node_id=event_node.id)
+        assert cached_settings == settings
+        assert event_settings_cache.hits == hits + 1
+
+        # callers get their own copy and can not modify the cached settings
+        cached_settings.bon_title = "modified"
+        cached_settings = await fetch_restricted_event_settings_for_node(conn=db_connection, node_id=event_node.id)
+        assert cached_settings == settings
+        assert event_settings_cache.hits == hits + 2
+
+        invalidations = event_settings_cache.invalidations
+        await db_connection.execute("update event set bon_title = 'changed title' where id = $1", settings.id)
+        await wait_until(lambda: event_settings_cache.invalidations > invalidations)
+        settings = await fetch_restricted_event_settings_for_node(conn=db_connection, node_id=event_node.id)
+        assert settings.bon_title == "changed title"
+
+        invalidations = event_settings_cache.invalidations
+        await db_connection.execute(
+            "insert into translation_text (event_id, lang_code, type, content) values ($1, 'en-US', 'test', 'text')",
+            settings.id,
+        )
+        await wait_until(lambda: event_settings_cache.invalidations > invalidations)
+        settings = await fetch_restricted_event_settings_for_node(conn=db_connection, node_id=event_node.id)
+        assert settings.translation_texts[Language.en_US]["test"] == "text"
+        assert event_settings_cache.hits == hits + 2
+    finally:
+        listener.cancel()
+        await asyncio.gather(listener, return_exceptions=True)
+
+
+async def test_user_privilege_cache(
+    setup_test_db_pool: asyncpg.Pool,
+    db_connection: Connection,
+    auth_service: AuthService,
+    user_service: UserService,
+    tree_service: TreeService,
+    event_node: Node,
+    admin_token: str,
+):
+    invalidations = user_privilege_cache.invalidations
+    listener = asyncio.create_task(user_privilege_cache.listen(setup_test_db_pool))
+    try:
+        # wait for connection listener to be set up
+        await wait_until(lambda: user_privilege_cache.invalidations > invalidations)
+        stats = user_privilege_cache.stats()
+
+        await tree_service.get_restricted_event_settings(token=admin_token, node_id=event_node.id)
+        await tree_service.get_restricted_event_settings(token=admin_token, node_id=event_node.id)
+        assert user_privilege_cache.stats().hits == stats.hits + 1
+        assert user_privilege_cache.stats().misses == stats.misses + 1
+
+        user = await auth_service.get_user_from_token(conn=db_connection, token=admin_token, node=event_node)
+        assert user is not None
+        invalidations = user_privilege_cache.invalidations
+        await db_connection.execute("delete from user_to_role where user_id = $1", user.id)
+        await wait_until(lambda: user_privilege_cache.invalidations > invalidations)
+        user = await auth_service.get_user_from_token(conn=db_connection, token=admin_token, node=event_node)
+        assert user is not None
+        assert len(user.privileges) == 0
+
+        invalidations = user_privilege_cache.invalidations
+        await user_service.logout_user(token=admin_token)
+        await wait_until(lambda: user_privilege_cache.invalidations > invalidations)
+        assert await auth_service.get_user_from_token(conn=db_connection, token=admin_token, node=event_node) is None
+        assert user_privilege_cache.stats().hit_rate > 0
+
+        # the hit rate is reported in the healthcheck status
+        status = Healtcheck(timestamp="", service_name="test", healthy=True, caches=cache_stats())
+        reported = {stats["name"]: stats for stats in json.loads(status.model_dump_json())["caches"]}
+        assert reported["user_privileges"]["hit_rate"] == user_privilege_cache.stats().hit_rate
+    finally:
+        listener.cancel()
+        await asyncio.gather(listener, return_exceptions=True)
@@ -1,4 +1,5 @@
 # pylint: disable=attribute-defined-outside-init,unexpected-keyword-arg,missing-kwoa,disable=protected-access,redefined-outer-name
+import asyncio
 import copy
 import csv
 import datetime
@@ -35,7 +36,11 @@ from stustapay.core.service.common.error import (
     Unauthorized,
 )
 from stustapay.core.service.config import ConfigService
-from stustapay.core.service.customer.customer import CustomerBank, CustomerService
+from stustapay.core.service.customer.customer import (
+    CustomerBank,
+    CustomerService,
+    customer_order_history_cache,
+)
 from stustapay.core.service.customer.payout import (
     Payout,
     create_payout_run,
@@ -48,6 +53,7 @@ from stustapay.core.service.order.booking import NewLineItem, book_order
 from stustapay.core.service.order.order import fetch_order
 from stustapay.core.service.product import ProductService
 from stustapay.framework.database import Connection
+from stustapay.tests.common import wait_until
 from stustapay.tests.conftest import Cashier, CreateRandomUserTag
 
 
@@ -743,6 +749,71 @@ async def test_get_orders_with_bon(customer_service: CustomerService, order_with
     assert resulting_order_with_bon.bon_generated
 
 
+async def test_get_orders_with_bon_paginated(
+    setup_test_db_pool: asyncpg.Pool,
+    db_connection: Connection,
+    customer_service: CustomerService,
+    order_with_bon: tuple[Order, CustomerTest],
+    cashier: Cashier,
+    till: Till,
+):
+    order, test_customer = order_with_bon
+    login_result = await customer_service.login_customer(uid=test_customer.uid, pin=test_customer.pin)
+    assert login_result is not None
+
+    async def book_customer_order() -> int:
+        async with db_connection.transaction():
+            booking = await book_order(
+                conn=db_connection,
+                order_type=OrderType.sale,
+                payment_method=PaymentMethod.tag,
+                cashier_id=cashier.id,
+                till_id=till.id,
+                line_items=[],
+                bookings={},
+                customer_account_id=test_customer.account_id,
+            )
+        return booking.id
+
+    invalidations = customer_order_history_cache.invalidations
+    listener = asyncio.create_task(customer_order_history_cache.listen(setup_test_db_pool))
+    try:
+        # wait for connection listener to be set up
+        await wait_until(lambda: customer_order_history_cache.invalidations > invalidations)
+        invalidations = customer_order_history_cache.invalidations
+        second_order_id = await book_customer_order()
+        await wait_until(lambda: customer_order_history_cache.invalidations > invalidations)
+
+        page = await customer_service.get_orders_with_bon_paginated(token=login_result.token, limit=1)
+        assert [o.id for o in page.orders] == [second_order_id]
+        assert page.next_cursor is not None
+        page = await customer_service.get_orders_with_bon_paginated(
+            token=login_result.token, cursor=page.next_cursor, limit=1
+        )
+        assert [o.id for o in page.orders] == [order.id]
+        assert page.orders[0].bon_generated
+        assert page.next_cursor is None
+
+        hits = customer_order_history_cache.hits
+        page = await customer_service.get_orders_with_bon_paginated(token=login_result.token, limit=1)
+        assert [o.id for o in page.orders] == [second_order_id]
+        assert customer_order_history_cache.hits == hits + 1
+
+        # a new order of the customer invalidates its cached history
+        invalidations = customer_order_history_cache.invalidations
+        third_order_id = await book_customer_order()
+        await wait_until(lambda: customer_order_history_cache.invalidations > invalidations)
+        page = await customer_service.get_orders_with_bon_paginated(token=login_result.token, limit=10)
+        assert [o.id for o in page.orders] == [third_order_id, second_order_id, order.id]
+        assert customer_order_history_cache.hits == hits + 1
+
+        with pytest.raises(InvalidArgument):
+            await customer_service.get_orders_with_bon_paginated(token=login_result.token, limit=0)
+    finally:
+        listener.cancel()
+        await asyncio.gather(listener, return_exceptions=True)
+
+
 async def test_update_customer_info(test_customer: CustomerTest, customer_service: CustomerService):
     auth = await customer_service.login_customer(uid=test_customer.uid, pin=test_customer.pin)
     assert auth is not None
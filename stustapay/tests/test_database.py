@@ -0,0 +1,106 @@
+# pylint: disable=attribute-defined-outside-init
+import asyncio
+
+import asyncpg
+import pytest
+
+from stustapay.core.config import Config
+from stustapay.framework.database import (
+    CONNECTION_WAIT_BUCKETS,
+    STATEMENT_LATENCY_BUCKETS,
+    DBPoolConfig,
+    create_db_pool,
+    register_statement,
+    statement_stats,
+)
+from stustapay.framework.metrics import LatencyHistogram
+
+_till_name_statement = register_statement("test_till_name", "select name from till where id = $1")
+
+
+@pytest.mark.usefixtures("setup_test_db_pool")
+async def test_prepared_statements(config: Config):
+    # statements are prepared when a connection is opened
+    db_pool = await create_db_pool(cfg=config.database, n_connections=1)
+    try:
+        async with db_pool.acquire() as conn:
+            prepared_queries = await conn.fetch("select statement from pg_prepared_statements")
+            assert _till_name_statement.query in [row["statement"] for row in prepared_queries]
+
+            executions = _till_name_statement.executions
+            assert await conn.fetchval(_till_name_statement, 1) == "Virtual Till"
+            assert await conn.fetchval(_till_name_statement, -1) is None
+            assert _till_name_statement.executions == executions + 2
+
+            stats = next(s for s in statement_stats() if s.name == "test_till_name")
+            assert stats.executions == executions + 2
+            assert sum(stats.latency_histogram) == stats.executions
+            assert len(stats.latency_histogram) == len(STATEMENT_LATENCY_BUCKETS) + 1
+    finally:
+        await db_pool.close()
+
+    # the same statement can only be registered with a single query
+    assert register_statement("test_till_name", "select name from till where id = $1") is _till_name_statement
+
+
+def test_latency_histogram():
+    histogram = LatencyHistogram((0.01, 0.1))
+    for duration in (0.001, 0.01, 0.05, 0.1, 2.0, 10.0):
+        histogram.record(duration)
+    # a duration on a bucket's upper bound is counted in that bucket
+    assert histogram.snapshot() == [2, 2, 2]
+
+
+async def test_prepared_statement_schema_change(setup_test_db_pool: asyncpg.Pool):
+    statement = register_statement("test_schema_change", "select * from prepared_statement_test")
+    async with setup_test_db_pool.acquire() as conn:
+        await conn.execute("create temporary table prepared_statement_test (a int)")
+        await conn.execute("insert into prepared_statement_test (a) values (1)")
+        assert [dict(r) for r in await conn.fetch(statement)] == [{"a": 1}]
+
+        # the result type of the prepared statement changes, outside of a transaction it is simply prepared again
+        await conn.execute("alter table prepared_statement_test add column b int default 2")
+        assert [dict(r) for r in await conn.fetch(statement)] == [{"a": 1, "b": 2}]
+        assert statement.errors == 0
+
+        await conn.execute("alter table prepared_statement_test add column c int default 3")
+        with pytest.raises(asyncpg.InvalidCachedStatementError):
+            async with conn.transaction():
+                await conn.fetch(statement)
+        assert statement.errors == 1
+        assert [dict(r) for r in await conn.fetch(statement)] == [{"a": 1, "b": 2, "c": 3}]
+
+
+@pytest.mark.usefixtures("setup_test_db_pool")
+async def test_pool_stats(config: Config):
+    db_pool = await create_db_pool(
+        cfg=config.database, pool_config=DBPoolConfig(min_size=1, max_size=2, acquire_timeout=0.1)
+    )
+    try:
+        stats = db_pool.stats()
+        assert stats.size == 1
+        assert stats.in_use == 0
+
+        async with db_pool.acquire(), db_pool.acquire():
+            stats = db_pool.stats()
+            assert stats.size == 2
+            assert stats.in_use == 2
+
+            # the pool is exhausted, waiting for a third connection runs into the configured timeout
+            with pytest.raises(asyncio.TimeoutError):
+                async with db_pool.acquire():
+                    pass
+
+        # awaiting the acquisition and the queries of the pool itself are counted as well
+        conn = await db_pool.acquire()
+        await db_pool.release(conn)
+        assert await db_pool.fetchval("select 1") == 1
+
+        stats = db_pool.stats()
+        assert stats.in_use == 0
+        assert stats.acquisitions == 4
+        assert stats.acquire_timeouts == 1
+        assert sum(stats.acquire_wait_histogram) == stats.acquisitions
+        assert len(stats.acquire_wait_histogram) == len(CONNECTION_WAIT_BUCKETS) + 1
+    finally:
+        await db_pool.close()
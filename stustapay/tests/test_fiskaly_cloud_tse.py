@@ -0,0 +1,186 @@
+import asyncio
+import base64
+import contextlib
+
+import aiohttp
+import uvicorn
+from aiohttp import web
+
+from stustapay.tse.fiskaly_cloud_tse.config import FiskalyCloudTSEConfig
+from stustapay.tse.fiskaly_cloud_tse.handler import FiskalyCloudTSE
+from stustapay.tse.fiskaly_cloud_tse.simulator import FiskalySimulator
+from stustapay.tse.handler import TSESignatureRequest
+
+
+class FiskalyStub:
+    """answers the fiskaly api requests of FiskalyCloudTSE, counting authentications and connections"""
+
+    def __init__(self, token_validity: float = 3600):
+        self.token_validity = token_validity
+        self.n_auth = 0
+        self.peers: set = set()
+        self.reject_next_token = False
+        self.app = web.Application()
+        self.app.router.add_post("/auth", self.auth)
+        self.app.router.add_get("/tss/{tss_id}/client", self.clients)
+
+    async def auth(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        assert body == {"api_key": "key", "api_secret": "secret"}
+        self.n_auth += 1
+        return web.json_response(
+            {"access_token": f"token-{self.n_auth}", "access_token_expires_in": self.token_validity}
+        )
+
+    async def clients(self, request: web.Request) -> web.Response:
+        assert request.transport is not None
+        self.peers.add(request.transport.get_extra_info("peername"))
+        if self.reject_next_token:
+            self.reject_next_token = False
+            return web.json_response({"error": "Unauthorized"}, status=401)
+        assert request.headers["Authorization"] == f"Bearer token-{self.n_auth}"
+        return web.json_response({"data": [{"_id": "client-1"}, {"_id": "client-2"}]})
+
+
+@contextlib.asynccontextmanager
+async def fiskaly_cloud_tse(stub: FiskalyStub):
+    runner = web.AppRunner(stub.app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    config = FiskalyCloudTSEConfig(
+        base_url=f"http://127.0.0.1:{port}",
+        api_key="key",
+        api_secret="secret",
+        serial_number="serial",
+        tss_id="tss",
+        password="password",
+    )
+    tse = FiskalyCloudTSE("fiskaly-stub", config)
+    try:
+        yield tse
+    finally:
+        await tse.stop()
+        await runner.cleanup()
+
+
+async def test_session_and_token_reuse():
+    stub = FiskalyStub()
+    async with fiskaly_cloud_tse(stub) as tse:
+        for _ in range(3):
+            assert await tse.get_client_ids() == ["client-1", "client-2"]
+        # the sequential requests all went over the same kept alive connection
+        assert len(stub.peers) == 1
+
+        await asyncio.gather(*[tse.get_client_ids() for _ in range(5)])
+        assert stub.n_auth == 1
+
+        stats = {s.name: s for s in tse.endpoint_stats()}
+        assert stats["POST /auth"].requests == 1
+        assert stats["GET /tss/{id}/client"].requests == 8
+        assert stats["GET /tss/{id}/client"].errors == 0
+        assert sum(stats["GET /tss/{id}/client"].latency_histogram) == 8
+
+
+async def test_token_refresh():
+    stub = FiskalyStub(token_validity=30)
+    async with fiskaly_cloud_tse(stub) as tse:
+        await tse.get_client_ids()
+        assert stub.n_auth == 1
+
+        # the token expires soon, so it is refreshed in the background without affecting requests
+        await tse._refresh_access_token_if_expiring()  # pylint: disable=protected-access
+        assert stub.n_auth == 2
+        await tse.get_client_ids()
+        assert stub.n_auth == 2
+
+        # a rejected token is replaced and the request is sent again
+        stub.reject_next_token = True
+        assert await tse.get_client_ids() == ["client-1", "client-2"]
+        assert stub.n_auth == 3
+        stats = {s.name: s for s in tse.endpoint_stats()}
+        assert stats["GET /tss/{id}/client"].requests == 4
+        assert stats["GET /tss/{id}/client"].errors == 1
+
+
+@contextlib.asynccontextmanager
+async def fiskaly_simulator(simulator: FiskalySimulator):
+    server = uvicorn.Server(uvicorn.Config(simulator.app, host="127.0.0.1", port=0, log_level="warning"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        server.should_exit = True
+        await task
+
+
+async def test_sign_with_simulator():
+    simulator = FiskalySimulator(latency=0.01, latency_jitter=0)
+    async with fiskaly_simulator(simulator) as base_url:
+        config = FiskalyCloudTSEConfig(
+            base_url=base_url,
+            api_key="key",
+            api_secret="secret",
+            serial_number="tss-1",
+            tss_id="tss-1",
+            password="password",
+        )
+        tse = FiskalyCloudTSE("fiskaly-simulator", config)
+        assert await tse.start()
+        try:
+            await tse.register_client_id("client-1")
+            assert await tse.get_client_ids() == ["client-1"]
+
+            requests = [
+                TSESignatureRequest(
+                    order_id=i,
+                    till_id="1",
+                    process_type="Kassenbeleg-V1",
+                    process_data=f"Beleg^{i}.00_0.00_0.00_0.00_0.00^{i}.00:Bar",
+                )
+                for i in range(1, 6)
+            ]
+            signatures = await asyncio.gather(*[tse.sign(request, "client-1") for request in requests])
+        finally:
+            await tse.stop()
+
+    master_data = tse.get_master_data()
+    assert master_data.tse_serial == "tss-1"
+    tss = simulator.tss["tss-1"]
+    assert base64.b64decode(master_data.tse_public_key) == tss.public_key
+    # each transaction got a signature when it was started and when it was updated with the process data
+    assert tss.signature_counter == 10
+    assert len({s.tse_signaturenr for s in signatures}) == 5
+
+    # the signatures can be verified with the public key of the TSS
+    for request, signature in zip(requests, signatures):
+        tx = tss.transactions[signature.tse_transaction]
+        message = tss.log_message(
+            operation="UpdateTransaction",
+            client_id="client-1",
+            process_data=request.process_data.encode("utf-8"),
+            process_type=request.process_type,
+            tx_number=tx["number"],
+            log_time=tx["log"]["timestamp"],
+            signature_counter=int(signature.tse_signaturenr),
+        )
+        assert tss.sk.get_verifying_key().verify(base64.b64decode(signature.tse_signature), message)
+
+
+async def test_simulator_error_injection():
+    simulator = FiskalySimulator(latency=0, latency_jitter=0, error_rate=1.0)
+    async with fiskaly_simulator(simulator) as base_url:
+        async with aiohttp.ClientSession() as session:
+            async with session.post(f"{base_url}/auth", json={"api_key": "key", "api_secret": "secret"}) as response:
+                assert response.status == 500
+                assert (await response.json())["code"] == "E_INTERNAL"
+
+            simulator.error_rate = 0
+            async with session.get(f"{base_url}/tss/tss-1") as response:
+                assert response.status == 401
+    assert simulator.n_injected_errors == 1
+    assert simulator.n_requests == 2
@@ -0,0 +1,92 @@
+# pylint: disable=unexpected-keyword-arg,missing-kwoa
+import asyncio
+
+import asyncpg
+
+from stustapay.core.schema.order import OrderType, PaymentMethod
+from stustapay.core.schema.product import NewProduct
+from stustapay.core.schema.tax_rate import TaxRate
+from stustapay.core.schema.till import Till
+from stustapay.core.schema.tree import Node
+from stustapay.core.service.order.booking import NewLineItem, book_order
+from stustapay.core.service.order.live_stats import live_order_stats
+from stustapay.core.service.product import ProductService
+from stustapay.framework.database import Connection
+
+from .conftest import Cashier
+
+
+async def test_live_order_stats(
+    setup_test_db_pool: asyncpg.Pool,
+    db_connection: Connection,
+    event_node: Node,
+    till: Till,
+    cashier: Cashier,
+    tax_rate_ust: TaxRate,
+    product_service: ProductService,
+    admin_token: str,
+):
+    product = await product_service.create_product(
+        token=admin_token,
+        node_id=event_node.id,
+        product=NewProduct(name="Live stats product", price=2.0, tax_rate_id=tax_rate_ust.id, is_locked=True),
+    )
+
+    async def book(quantity: int):
+        async with db_connection.transaction():
+            await book_order(
+                conn=db_connection,
+                order_type=OrderType.sale,
+                payment_method=PaymentMethod.tag,
+                cashier_id=cashier.id,
+                till_id=till.id,
+                line_items=[
+                    NewLineItem(
+                        quantity=quantity, product_id=product.id, product_price=2.0, tax_rate_id=tax_rate_ust.id
+                    )
+                ],
+                bookings={},
+            )
+
+    # orders booked before the listener was started are picked up by the initial reconciliation
+    await book(1)
+    listener = asyncio.create_task(live_order_stats.listen(setup_test_db_pool))
+    try:
+        await asyncio.sleep(0.5)  # wait for connection listener to be set up and the stats to be loaded
+        assert live_order_stats.enabled
+        stats = live_order_stats.get_stats(event_node.id)
+        assert stats.order_count == 1
+        assert [(p.product_id, p.quantity, p.revenue) for p in stats.products] == [(product.id, 1, 2.0)]
+
+        async with live_order_stats.subscribe(event_node.id) as queue:
+            snapshot = queue.get_nowait()
+            assert snapshot.type == "snapshot"
+            assert snapshot.stats == stats
+
+            orders_applied = live_order_stats.orders_applied
+            await book(2)
+            update = await asyncio.wait_for(queue.get(), timeout=1)
+            assert update.type == "update"
+            assert update.stats.order_count == 2
+            assert update.stats.revenue == 6.0
+            assert [(p.product_id, p.quantity, p.revenue) for p in update.stats.products] == [(product.id, 3, 6.0)]
+            assert live_order_stats.orders_applied == orders_applied + 1
+
+            # the root node sees all orders of its subtree
+            assert live_order_stats.get_stats(0).order_count >= 2
+
+            # a reconciliation yields the same stats as the incremental updates
+            await live_order_stats.handle_notification(None)
+            snapshot = queue.get_nowait()
+            assert snapshot.type == "snapshot"
+            assert snapshot.stats == update.stats
+
+            # orders which were part of the reconciliation are not counted twice
+            order_id = await db_connection.fetchval("select max(id) from ordr")
+            await live_order_stats.handle_notification(f'{{"order_id": {order_id}}}')
+            assert live_order_stats.get_stats(event_node.id).order_count == 2
+    finally:
+        listener.cancel()
+        await asyncio.gather(listener, return_exceptions=True)
+
+    assert not live_order_stats.enabled
@@ -0,0 +1,137 @@
+# pylint: disable=unexpected-keyword-arg,missing-kwoa
+import asyncio
+
+import asyncpg
+import pytest
+
+from stustapay.core.schema.tree import Node
+from stustapay.core.service.common import retry
+from stustapay.core.service.common.decorators import with_retryable_db_transaction
+from stustapay.core.service.common.error import ResourceBusy
+from stustapay.core.service.common.retry import (
+    RetryPolicy,
+    lock_customer_account,
+    retry_stats,
+)
+from stustapay.framework.database import Connection
+from stustapay.tests.conftest import CreateRandomUserTag
+
+
+def _customer_tag_uid(kwargs: dict) -> int:
+    return kwargs["customer_tag_uid"]
+
+
+class _ConflictingService:
+    def __init__(self, db_pool: asyncpg.Pool, n_conflicts: int):
+        self.db_pool = db_pool
+        self.n_conflicts = n_conflicts
+        self.n_calls = 0
+        self.running = 0
+        self.max_running = 0
+
+    @with_retryable_db_transaction(retry_policy=RetryPolicy(max_retries=3, base_delay=0.001, budget_max=5))
+    async def conflict(self, *, conn: Connection) -> int:
+        assert conn.is_in_transaction()
+        self.n_calls += 1
+        if self.n_calls <= self.n_conflicts:
+            raise asyncpg.exceptions.SerializationError("conflict")
+        return self.n_calls
+
+    @with_retryable_db_transaction(lock_customer_tag_uid=_customer_tag_uid)
+    async def book(self, *, conn: Connection, customer_tag_uid: int):  # pylint: disable=unused-argument
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(0.05)
+        self.running -= 1
+
+
+def _stats(name: str):
+    return next(s for s in retry_stats() if s.name == name)
+
+
+async def test_retry_budget(setup_test_db_pool: asyncpg.Pool):
+    service = _ConflictingService(setup_test_db_pool, n_conflicts=2)
+    assert await service.conflict() == 3
+    stats = _stats("_ConflictingService.conflict")
+    assert stats.calls == 1
+    assert stats.serialization_failures == 2
+    assert stats.retries == 2
+    assert stats.failures == 0
+    assert stats.total_backoff > 0
+
+    # the retries of a single call are limited
+    service.n_calls, service.n_conflicts = 0, 10
+    with pytest.raises(asyncpg.exceptions.SerializationError):
+        await service.conflict()
+    stats = _stats("_ConflictingService.conflict")
+    assert stats.retries == 5
+    assert stats.failures == 1
+
+    # the budget has been used up by the retries above, the next conflict is not retried anymore
+    service.n_calls = 0
+    with pytest.raises(asyncpg.exceptions.SerializationError):
+        await service.conflict()
+    stats = _stats("_ConflictingService.conflict")
+    assert service.n_calls == 1
+    assert stats.budget_exhausted == 1
+    assert stats.failures == 2
+
+
+async def test_customer_account_lock(
+    setup_test_db_pool: asyncpg.Pool,
+    db_connection: Connection,
+    event_node: Node,
+    create_random_user_tag: CreateRandomUserTag,
+):
+    service = _ConflictingService(setup_test_db_pool, n_conflicts=0)
+    customer_tag = await create_random_user_tag()
+    await db_connection.execute(
+        "insert into account (node_id, user_tag_uid, type) values ($1, $2, 'private')", event_node.id, customer_tag.uid
+    )
+    other_tag = await create_random_user_tag()
+    await db_connection.execute(
+        "insert into account (node_id, user_tag_uid, type) values ($1, $2, 'private')", event_node.id, other_tag.uid
+    )
+
+    # calls for the same customer are run one after another
+    await asyncio.gather(*[service.book(customer_tag_uid=customer_tag.uid) for _ in range(3)])
+    assert service.max_running == 1
+
+    await asyncio.gather(service.book(customer_tag_uid=customer_tag.uid), service.book(customer_tag_uid=other_tag.uid))
+    assert service.max_running == 2
+
+    # all locks have been released again
+    assert await db_connection.fetchval("select count(*) from pg_locks where locktype = 'advisory'") == 0
+
+
+async def test_customer_account_lock_timeout(
+    monkeypatch: pytest.MonkeyPatch,
+    setup_test_db_pool: asyncpg.Pool,
+    db_connection: Connection,
+    event_node: Node,
+    create_random_user_tag: CreateRandomUserTag,
+):
+    customer_tag = await create_random_user_tag()
+    # account ids beyond the int4 range are locked as well
+    account_id = await db_connection.fetchval(
+        "insert into account (id, node_id, user_tag_uid, type) overriding system value "
+        "values ($1, $2, $3, 'private') returning id",
+        2**31 + 7,
+        event_node.id,
+        customer_tag.uid,
+    )
+    monkeypatch.setattr(retry, "CUSTOMER_ACCOUNT_LOCK_TIMEOUT", 0.1)
+
+    async with setup_test_db_pool.acquire() as conn, setup_test_db_pool.acquire() as other_conn:
+        async with lock_customer_account(conn, customer_tag.uid) as locked_account_id:
+            assert locked_account_id == account_id
+            with pytest.raises(ResourceBusy):
+                async with lock_customer_account(other_conn, customer_tag.uid):
+                    pass
+            # the timeout only applies while waiting for the lock
+            assert await other_conn.fetchval("show lock_timeout") == "0"
+
+        async with lock_customer_account(other_conn, customer_tag.uid) as locked_account_id:
+            assert locked_account_id == account_id
+
+    assert await db_connection.fetchval("select count(*) from pg_locks where locktype = 'advisory'") == 0
@@ -1,12 +1,15 @@
 # pylint: disable=attribute-defined-outside-init,unexpected-keyword-arg,missing-kwoa,no-value-for-parameter
+import asyncio
+
+import asyncpg
 import pytest
 from asyncpg import RaiseError
 
 from stustapay.core.schema.tree import ROOT_NODE_ID, NewEvent, NewNode, Node, ObjectType
-from stustapay.core.service.tree.common import fetch_node
+from stustapay.core.service.tree.common import fetch_node, node_tree_snapshot
 from stustapay.core.service.tree.service import TreeService
 from stustapay.framework.database import Connection
-from stustapay.tests.common import list_equals
+from stustapay.tests.common import list_equals, wait_until
 
 
 async def test_node_creation(db_connection: Connection, tree_service: TreeService, admin_token: str):
@@ -186,3 +189,71 @@ async def test_object_rules(tree_service: TreeService, admin_token: str):
         sub_node.computed_forbidden_objects_at_node,
     )
     assert list_equals([ObjectType.ticket, ObjectType.user_role], sub_node.computed_forbidden_objects_in_subtree)
+
+
+async def test_node_tree_snapshot(
+    setup_test_db_pool: asyncpg.Pool, db_connection: Connection, tree_service: TreeService, admin_token: str
+):
+    listener = asyncio.create_task(node_tree_snapshot.listen(setup_test_db_pool))
+    try:
+        # wait for connection listener to be set up and the tree to be loaded
+        await wait_until(lambda: node_tree_snapshot.get_node(ROOT_NODE_ID) is not None)
+        parent: Node = await tree_service.create_node(
+            token=admin_token,
+            node_id=ROOT_NODE_ID,
+            new_node=NewNode(
+                name="Snapshot parent", description="", forbidden_objects_in_subtree=[ObjectType.user_role]
+            ),
+        )
+        child: Node = await tree_service.create_node(
+            token=admin_token, node_id=parent.id, new_node=NewNode(name="Snapshot child", description="")
+        )
+        # our own writes are visible before their notifications have arrived
+        uncached_parent = await fetch_node(conn=db_connection, node_id=parent.id)
+        assert uncached_parent is not None
+        assert [c.id for c in uncached_parent.children] == [child.id]
+        # the parent is bypassed until the notifications of both nodes have been processed
+        await wait_until(lambda: node_tree_snapshot.get_node(parent.id) is not None)
+
+        hits = node_tree_snapshot.hits
+        cached_parent = await fetch_node(conn=db_connection, node_id=parent.id)
+        assert cached_parent is not None
+        assert node_tree_snapshot.hits == hits + 1
+        assert cached_parent == await fetch_node(conn=db_connection, node_id=parent.id, cached=False)
+        assert [c.id for c in cached_parent.children] == [child.id]
+        assert ObjectType.user_role in cached_parent.children[0].computed_forbidden_objects_at_node
+
+        # returned nodes are copies and can be modified by the caller
+        cached_parent.children.clear()
+        cached_parent = await fetch_node(conn=db_connection, node_id=parent.id)
+        assert cached_parent is not None
+        assert len(cached_parent.children) == 1
+
+        await db_connection.execute("delete from forbidden_objects_in_subtree_at_node where node_id = $1", parent.id)
+
+        def restriction_removed() -> bool:
+            node = node_tree_snapshot.get_node(parent.id)
+            return node is not None and ObjectType.user_role not in node.children[0].computed_forbidden_objects_at_node
+
+        await wait_until(restriction_removed)
+        cached_parent = await fetch_node(conn=db_connection, node_id=parent.id)
+        assert cached_parent is not None
+        assert cached_parent == await fetch_node(conn=db_connection, node_id=parent.id, cached=False)
+        assert ObjectType.user_role not in cached_parent.children[0].computed_forbidden_objects_at_node
+
+        # a pending write only bypasses the snapshot for the subtrees it affects
+        sibling: Node = await tree_service.create_node(
+            token=admin_token, node_id=ROOT_NODE_ID, new_node=NewNode(name="Snapshot sibling", description="")
+        )
+        await wait_until(lambda: node_tree_snapshot.get_node(sibling.id) is not None)
+        pending: Node = await tree_service.create_node(
+            token=admin_token, node_id=ROOT_NODE_ID, new_node=NewNode(name="Snapshot pending", description="")
+        )
+        assert node_tree_snapshot.get_node(sibling.id) is not None
+        assert node_tree_snapshot.get_node(ROOT_NODE_ID) is None
+        assert node_tree_snapshot.get_node(pending.id) is None
+    finally:
+        listener.cancel()
+        await asyncio.gather(listener, return_exceptions=True)
+
+    assert node_tree_snapshot.get_node(parent.id) is None
@@ -0,0 +1,165 @@
+# pylint: disable=attribute-defined-outside-init,unexpected-keyword-arg,missing-kwoa,unused-argument
+import asyncio
+import secrets
+from decimal import Decimal
+
+import asyncpg
+import pytest
+
+from stustapay.core.schema.order import OrderType, PaymentMethod
+from stustapay.core.schema.till import NewTill, TillProfile
+from stustapay.core.schema.tree import Node
+from stustapay.core.service.order.booking import book_order
+from stustapay.core.service.till import TillService
+from stustapay.framework.database import Connection
+from stustapay.tse.handler import (
+    TSEHandler,
+    TSEMasterData,
+    TSESignature,
+    TSESignatureRequest,
+)
+from stustapay.tse.wrapper import TSEWrapper, assemble_signature_requests
+
+from .conftest import Cashier
+
+
+class FakeTSE(TSEHandler):
+    """signs everything after a short delay, recording which signatures were created at the same time"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.client_ids: set[str] = set()
+        self.signed: list[TSESignatureRequest] = []
+        self.running = 0
+        self.max_running = 0
+        self._stop = False
+
+    async def start(self) -> bool:
+        return True
+
+    async def stop(self):
+        self._stop = True
+
+    async def register_client_id(self, client_id: str):
+        self.client_ids.add(client_id)
+
+    async def deregister_client_id(self, client_id: str):
+        self.client_ids.discard(client_id)
+
+    async def sign(self, request: TSESignatureRequest, *args) -> TSESignature:
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(0.05)
+        self.running -= 1
+        self.signed.append(request)
+        return TSESignature(
+            tse_transaction=str(len(self.signed)),
+            tse_signaturenr=str(len(self.signed)),
+            tse_start="2023-01-01T00:00:00.000Z",
+            tse_end="2023-01-01T00:00:01.000Z",
+            tse_signature="signature",
+        )
+
+    async def get_client_ids(self) -> list[str]:
+        return list(self.client_ids)
+
+    def get_master_data(self) -> TSEMasterData:
+        return TSEMasterData(
+            tse_serial=self.name,
+            tse_hashalgo="ecdsa-plain-SHA384",
+            tse_time_format="unixTime",
+            tse_public_key="public key",
+            tse_certificate="certificate",
+            tse_process_data_encoding="UTF-8",
+        )
+
+    def is_stop_set(self) -> bool:
+        return self._stop
+
+    def __str__(self):
+        return self.name
+
+
+async def test_pipelined_signing(
+    setup_test_db_pool: asyncpg.Pool,
+    db_connection: Connection,
+    event_node: Node,
+    till_service: TillService,
+    till_profile: TillProfile,
+    admin_token: str,
+    cashier: Cashier,
+):
+    tse_name = secrets.token_hex(8)
+    tse_id = await db_connection.fetchval(
+        "insert into tse (node_id, name, serial, ws_url, ws_timeout, password, type, status) "
+        "values ($1, $2, $2, '', 5, '', 'diebold_nixdorf', 'new') returning id",
+        event_node.id,
+        tse_name,
+    )
+    till_ids = []
+    for i in range(3):
+        till = await till_service.create_till(
+            token=admin_token,
+            node_id=event_node.id,
+            till=NewTill(name=f"tse-till-{i}", active_profile_id=till_profile.id),
+        )
+        await db_connection.execute("update till set tse_id = $1 where id = $2", tse_id, till.id)
+        till_ids.append(till.id)
+
+    order_ids = []
+    for _ in range(4):
+        for till_id in till_ids:
+            order = await book_order(
+                conn=db_connection,
+                order_type=OrderType.sale,
+                payment_method=PaymentMethod.tag,
+                cashier_id=cashier.id,
+                till_id=till_id,
+                line_items=[],
+                bookings={},
+            )
+            order_ids.append(order.id)
+
+    tse = FakeTSE(tse_name)
+    wrapper = TSEWrapper(name=tse_name, factory_function=lambda: tse, signature_concurrency=2)
+    wrapper.start(setup_test_db_pool)
+    try:
+        for _ in range(100):
+            await asyncio.sleep(0.1)
+            if len(tse.signed) == len(order_ids):
+                break
+    finally:
+        await wrapper.stop()
+
+    assert sorted(r.order_id for r in tse.signed) == order_ids
+    assert tse.max_running == 2
+    assert all(r.process_data == "Beleg^0.00_0.00_0.00_0.00_0.00^0.00:Unbar" for r in tse.signed)
+    # the signatures of a till were created in the order the orders were booked
+    for till_id in till_ids:
+        signed_order_ids = [r.order_id for r in tse.signed if r.till_id == str(till_id)]
+        assert len(signed_order_ids) == 4
+        assert signed_order_ids == sorted(signed_order_ids)
+
+    statuses = await db_connection.fetch("select signature_status from tse_signature where id = any($1)", order_ids)
+    assert all(row["signature_status"] == "done" for row in statuses)
+
+
+def test_assemble_signature_requests():
+    rows = [
+        {"order_id": 2, "payment_method": "tag", "tax_name": None, "total_price": None},
+        {"order_id": 1, "payment_method": "cash", "tax_name": "ust", "total_price": Decimal("7.00")},
+        {"order_id": 1, "payment_method": "cash", "tax_name": "none", "total_price": Decimal("-2.00")},
+        {"order_id": 1, "payment_method": "cash", "tax_name": "transparent", "total_price": Decimal("10.50")},
+        {"order_id": 3, "payment_method": "sumup", "tax_name": "eust", "total_price": Decimal("3.20")},
+    ]
+    requests = assemble_signature_requests({1: "10", 2: "11", 3: "10"}, rows)
+    assert [(r.order_id, r.till_id) for r in requests] == [(1, "10"), (2, "11"), (3, "10")]
+    assert all(r.process_type == "Kassenbeleg-V1" for r in requests)
+    assert [r.process_data for r in requests] == [
+        "Beleg^7.00_0.00_0.00_0.00_8.50^15.50:Bar",
+        "Beleg^0.00_0.00_0.00_0.00_0.00^0.00:Unbar",
+        "Beleg^0.00_3.20_0.00_0.00_0.00^3.20:Unbar",
+    ]
+
+    with pytest.raises(RuntimeError):
+        assemble_signature_requests({1: "10", 4: "10"}, rows[1:2])
@@ -4,14 +4,18 @@ import binascii
 import contextlib
 import uuid
 import logging
+import re
+import time
 import typing
 from datetime import datetime, timezone
 
 import aiohttp
 import pytz
 from dateutil import parser
+from pydantic import BaseModel
 
 from stustapay.core.util import create_task_protected
+from stustapay.framework.metrics import LatencyHistogram
 from stustapay.tse.fiskaly_cloud_tse.config import FiskalyCloudTSEConfig
 from stustapay.tse.handler import (
     TSEHandler,
@@ -24,6 +28,70 @@ from stustapay.tse.handler import (
 
 LOGGER = logging.getLogger(__name__)
 
+# upper bounds in seconds of the latency histogram buckets of fiskaly api requests, the last bucket is unbounded
+ENDPOINT_LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# the access token is refreshed in the background once it expires within this many seconds,
+# requests only wait for a new token if the cached one expires within TOKEN_MIN_VALIDITY seconds
+TOKEN_REFRESH_BEFORE_EXPIRY = 60.0
+TOKEN_MIN_VALIDITY = 10.0
+# used if /auth does not tell us when the token expires
+DEFAULT_TOKEN_VALIDITY = 300.0
+
+# connections kept open to the fiskaly api, shared by all concurrently running requests
+MAX_CONNECTIONS = 10
+KEEPALIVE_TIMEOUT = 60.0
+REQUEST_TIMEOUT = 30.0
+
+# seconds between two log messages with the request latencies
+ENDPOINT_STATS_LOG_INTERVAL = 300.0
+
+_ENDPOINT_ID_PATTERN = re.compile(r"/(tss|client|tx)/[^/]+")
+
+
+def endpoint_name(method: str, endpoint: str) -> str:
+    """method and path of a request with the ids and query parameters removed, e.g. 'PUT /tss/{id}/tx/{id}'"""
+    path = _ENDPOINT_ID_PATTERN.sub(r"/\1/{id}", endpoint.split("?", 1)[0])
+    return f"{method.upper()} {path}"
+
+
+class EndpointStats(BaseModel):
+    name: str
+    requests: int
+    errors: int
+    total_time: float
+    max_time: float
+    # number of requests per latency bucket, see ENDPOINT_LATENCY_BUCKETS
+    latency_histogram: list[int]
+
+
+class _EndpointMetrics:
+    def __init__(self, name: str):
+        self.name = name
+        self.requests = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.latency_histogram = LatencyHistogram(ENDPOINT_LATENCY_BUCKETS)
+
+    def record_request(self, duration: float, failed: bool):
+        self.requests += 1
+        if failed:
+            self.errors += 1
+        self.total_time += duration
+        self.max_time = max(self.max_time, duration)
+        self.latency_histogram.record(duration)
+
+    def stats(self) -> EndpointStats:
+        return EndpointStats(
+            name=self.name,
+            requests=self.requests,
+            errors=self.errors,
+            total_time=self.total_time,
+            max_time=self.max_time,
+            latency_histogram=self.latency_histogram.snapshot(),
+        )
+
 
 class RequestError(RuntimeError):
     def __init__(self, name: str, request: dict, response: dict):
@@ -54,19 +122,86 @@ class FiskalyCloudTSE(TSEHandler):
         self._log_time_format: typing.Optional[str] = None
         self._public_key: typing.Optional[str] = None  # base64
         self._certificate: typing.Optional[str] = None  # long string
+        # all requests share one session, keeping the connections to fiskaly alive between them
+        self._session: typing.Optional[aiohttp.ClientSession] = None
+        self._access_token: typing.Optional[str] = None
+        self._access_token_expires_at = 0.0  # time.monotonic()
+        self._token_lock = asyncio.Lock()
+        self._endpoint_metrics: dict[str, _EndpointMetrics] = {}
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=MAX_CONNECTIONS, keepalive_timeout=KEEPALIVE_TIMEOUT),
+                timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT),
+            )
+        return self._session
+
+    async def _close_session(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _record_request(self, name: str, duration: float, failed: bool):
+        metrics = self._endpoint_metrics.get(name)
+        if metrics is None:
+            metrics = self._endpoint_metrics[name] = _EndpointMetrics(name)
+        metrics.record_request(duration, failed)
+
+    def endpoint_stats(self) -> list[EndpointStats]:
+        return [metrics.stats() for metrics in self._endpoint_metrics.values()]
+
+    def _log_endpoint_stats(self):
+        for stats in self.endpoint_stats():
+            LOGGER.info(
+                f"{self._name}: {stats.name}: {stats.requests} requests, {stats.errors} errors, "
+                f"avg {stats.total_time / stats.requests * 1000:.1f} ms, max {stats.max_time * 1000:.1f} ms"
+            )
+
+    def _token_valid_for(self) -> float:
+        if self._access_token is None:
+            return 0.0
+        return self._access_token_expires_at - time.monotonic()
+
+    async def _refresh_access_token(self, min_validity: float) -> str:
+        async with self._token_lock:
+            # somebody else might have refreshed the token while we were waiting for the lock
+            if self._access_token is not None and self._token_valid_for() > min_validity:
+                return self._access_token
+
+            start = time.monotonic()
+            failed = True
+            try:
+                async with self._get_session().post(
+                    f"{self.base_url}/auth",
+                    json={"api_key": self.api_key, "api_secret": self.api_secret},
+                ) as response:
+                    data = await response.json()
+                    if response.status != 200:
+                        raise Exception(f"Error {data['error']}: {data['message']}")
+                    failed = False
+            finally:
+                self._record_request("POST /auth", time.monotonic() - start, failed)
+
+            access_token: str = data["access_token"]
+            self._access_token = access_token
+            self._access_token_expires_at = start + float(data.get("access_token_expires_in", DEFAULT_TOKEN_VALIDITY))
+            return access_token
+
+    async def get_access_token(self) -> str:
+        """the cached access token, a new one is only requested if the cached one is about to expire"""
+        if self._access_token is not None and self._token_valid_for() > TOKEN_MIN_VALIDITY:
+            return self._access_token
+        return await self._refresh_access_token(min_validity=TOKEN_MIN_VALIDITY)
+
+    async def _refresh_access_token_if_expiring(self):
+        """renew the access token before it expires, so requests never have to wait for /auth"""
+        if self._access_token is not None and self._token_valid_for() < TOKEN_REFRESH_BEFORE_EXPIRY:
+            try:
+                await self._refresh_access_token(min_validity=TOKEN_REFRESH_BEFORE_EXPIRY)
+            except Exception:  # pylint: disable=broad-exception-caught
+                LOGGER.exception(f"{self._name}: refreshing the access token failed")
 
-    async def get_access_token(self):
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                f"{self.base_url}/auth",
-                json={"api_key": self.api_key, "api_secret": self.api_secret},
-            ) as response:
-                data = await response.json()
-                if response.status != 200:
-                    raise Exception(f"Error {data['error']}: {data['message']}")
-                return data["access_token"]
-
-    
 
     async def start(self) -> bool:
         start_result: asyncio.Future[bool] = asyncio.Future()
@@ -78,6 +213,8 @@ class FiskalyCloudTSE(TSEHandler):
         self._stop.set()
         if self.background_task is not None:
             await self.background_task
+        await self._close_session()
+        self._log_endpoint_stats()
 
     async def get_device_data(self) -> str:
         result = await self.request(method="GET",endpoint=f"/tss/{self.tss_id}")
@@ -100,42 +237,47 @@ class FiskalyCloudTSE(TSEHandler):
 
             start_result.set_result(True)
 
+            last_stats_log = time.monotonic()
             while not self._stop.is_set():
                 #await self.request("PingPong")
+                await self._refresh_access_token_if_expiring()
+                if time.monotonic() - last_stats_log > ENDPOINT_STATS_LOG_INTERVAL:
+                    self._log_endpoint_stats()
+                    last_stats_log = time.monotonic()
                 try:
                     await asyncio.wait_for(self._stop.wait(), timeout=2)
                 except asyncio.TimeoutError:
                     pass
 
     async def request(self, method: str, endpoint: str, payload=None, headers=None):
-            url = f"{self.base_url}{endpoint}"
+        url = f"{self.base_url}{endpoint}"
+        # If headers are provided, merge them with the default headers
+        request_headers = {**self.headers, **(headers or {})}
+        name = endpoint_name(method, endpoint)
+        result = None
+        for attempt in range(2):
             token = await self.get_access_token()
-            
-            auth_header = {
-                'Authorization': f'Bearer {token}'
-                }
-            self.headers.update(auth_header)    
-            # If headers are provided, merge them with the default headers
-            if headers:
-                self.headers.update(headers)
-
-            async with aiohttp.ClientSession() as session:
-                try:
-                    async with session.request(method, url, headers=self.headers, json=payload) as response:
-                        response.raise_for_status()
-                        response = await response.json()
-
-                except aiohttp.ClientError as e:
-                    print("aiohttp client error", e)
-                except aiohttp.http.HttpProcessingError as e:
-                    print("aiohttp processing error", e)
-                except asyncio.TimeoutError as e:
-                    print("asyncio timeout error", e)
-                except Exception as e:
-                    print("generic error", e)
-                finally:
-                    return response
-    
+            request_headers["Authorization"] = f"Bearer {token}"
+            start = time.monotonic()
+            failed = True
+            try:
+                async with self._get_session().request(method, url, headers=request_headers, json=payload) as response:
+                    if response.status == 401 and attempt == 0:
+                        # the token was revoked or expired early, get a new one and try again
+                        LOGGER.info(f"{self._name}: access token was rejected, authenticating again")
+                        self._access_token = None
+                        continue
+                    response.raise_for_status()
+                    result = await response.json()
+                    failed = False
+            except aiohttp.ClientError as e:
+                LOGGER.error(f"{self._name}: {name}: aiohttp client error {e}")
+            except asyncio.TimeoutError as e:
+                LOGGER.error(f"{self._name}: {name}: asyncio timeout error {e}")
+            finally:
+                self._record_request(name, time.monotonic() - start, failed)
+            break
+        return result
 
     async def authenticate_admin(self):
         headers = {
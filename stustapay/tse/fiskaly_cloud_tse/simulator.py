@@ -0,0 +1,331 @@
+"""
+this code will simulate the fiskaly SIGN DE cloud api (the parts used by FiskalyCloudTSE)
+"""
+
+import asyncio
+import base64
+import logging
+import random
+import secrets
+import time
+from hashlib import sha256, sha384
+from typing import Optional
+
+import ecdsa
+import uvicorn
+from asn1crypto.core import Sequence
+from fastapi import Body, FastAPI, Header, HTTPException, Query
+from fastapi.responses import JSONResponse
+
+from stustapay.tse.diebold_nixdorf_usb.simulator import (
+    CertifiedData,
+    SignatureAlgorithm_seq,
+    TransactionData,
+)
+
+LOGGER = logging.getLogger(__name__)
+
+SIGNATURE_ALGORITHM = "ecdsa-plain-SHA384"
+
+
+class FiskalyError(HTTPException):
+    def __init__(self, status_code: int, code: str, message: str):
+        super().__init__(status_code=status_code, detail=message)
+        self.code = code
+
+
+class VirtualTSS:
+    """a single technical security system with its clients and transactions"""
+
+    def __init__(self, tss_id: str, signing_key: ecdsa.SigningKey):
+        self.tss_id = tss_id
+        self.sk = signing_key
+        vk = self.sk.get_verifying_key()
+        self.public_key = Sequence.load(vk.to_der())[1].dump()[3:]
+        self.serial_number = sha256(self.public_key).hexdigest()
+        self.certificate = "THIS IS A VERY LONG CERTIFICATE!!!!"
+
+        self.signature_counter = 0
+        self.transaction_counter = 0
+        # client id -> client
+        self.clients: dict[str, dict] = {}
+        # transaction id -> transaction
+        self.transactions: dict[str, dict] = {}
+
+    def get_tss(self) -> dict:
+        return {
+            "_id": self.tss_id,
+            "_type": "TSS",
+            "state": "INITIALIZED",
+            "serial_number": self.serial_number,
+            "signature_algorithm": SIGNATURE_ALGORITHM,
+            "signature_timestamp_format": "unixTime",
+            "public_key": base64.b64encode(self.public_key).decode("ascii"),
+            "certificate": self.certificate,
+            "signature_counter": str(self.signature_counter),
+            "transaction_counter": str(self.transaction_counter),
+        }
+
+    def get_client(self, client_id: str) -> dict:
+        try:
+            return self.clients[client_id]
+        except KeyError:
+            raise FiskalyError(404, "E_CLIENT_NOT_FOUND", f"client {client_id} not found") from None
+
+    def upsert_client(self, client_id: str, serial_number: Optional[str], state: Optional[str]) -> dict:
+        client = self.clients.get(client_id)
+        if client is None:
+            if serial_number is None:
+                raise FiskalyError(400, "E_VALIDATION", "serial_number is required")
+            client = {"_id": client_id, "_type": "CLIENT", "tss_id": self.tss_id, "serial_number": serial_number}
+            self.clients[client_id] = client
+        client["state"] = state or "REGISTERED"
+        return client
+
+    def put_transaction(self, tx_id: str, tx_revision: int, body: dict) -> dict:
+        client_id = body.get("client_id")
+        if not isinstance(client_id, str):
+            raise FiskalyError(400, "E_VALIDATION", "client_id is required")
+        client = self.clients.get(client_id)
+        if client is None or client["state"] != "REGISTERED":
+            raise FiskalyError(400, "E_CLIENT_NOT_REGISTERED", f"client {client_id} is not registered")
+
+        tx = self.transactions.get(tx_id)
+        if tx is None:
+            if tx_revision != 1:
+                raise FiskalyError(404, "E_TX_NOT_FOUND", f"transaction {tx_id} not found")
+            self.transaction_counter += 1
+            tx = {"_id": tx_id, "_type": "TRANSACTION", "tss_id": self.tss_id, "number": self.transaction_counter}
+            self.transactions[tx_id] = tx
+            operation = "StartTransaction"
+        else:
+            if tx["state"] != "ACTIVE":
+                raise FiskalyError(409, "E_TX_ALREADY_FINISHED", f"transaction {tx_id} is not active anymore")
+            if tx_revision != tx["latest_revision"] + 1:
+                raise FiskalyError(409, "E_TX_REVISION_CONFLICT", f"expected revision {tx['latest_revision'] + 1}")
+            operation = "FinishTransaction" if body.get("state") in ("FINISHED", "CANCELLED") else "UpdateTransaction"
+
+        raw = body.get("schema", {}).get("raw", {})
+        process_type = raw.get("process_type", "")
+        process_data = base64.b64decode(raw.get("process_data", ""))
+        log_time = int(time.time())
+        self.signature_counter += 1
+        message = self.log_message(
+            operation, client_id, process_data, process_type, tx["number"], log_time, self.signature_counter
+        )
+
+        tx.update(
+            client_id=client_id,
+            state=body.get("state", "ACTIVE"),
+            latest_revision=tx_revision,
+            schema={"raw": raw},
+            log={"operation": operation, "timestamp": log_time},
+            signature={
+                "value": base64.b64encode(self.sk.sign(message)).decode("ascii"),
+                "algorithm": SIGNATURE_ALGORITHM,
+                "counter": str(self.signature_counter),
+                "public_key": base64.b64encode(self.public_key).decode("ascii"),
+            },
+        )
+        return tx
+
+    def log_message(
+        self,
+        operation: str,
+        client_id: str,
+        process_data: bytes,
+        process_type: str,
+        tx_number: int,
+        log_time: int,
+        signature_counter: int,
+    ) -> bytes:
+        """the transaction log message which is signed, as specified by BSI TR-03151"""
+        signaturealgorithm = SignatureAlgorithm_seq()
+        signaturealgorithm["signatureAlgorithm"] = "0.4.0.127.0.7.1.1.4.1.4"
+
+        certidata = CertifiedData()
+        certidata["operationType"] = operation
+        certidata["clientId"] = client_id
+        certidata["ProcessData"] = process_data
+        certidata["ProcessType"] = process_type
+        certidata["transactionNumber"] = tx_number
+
+        data = TransactionData()
+        data["Version"] = 2
+        data["CertifiedDataType"] = "0.4.0.127.0.7.3.7.1.1"
+        data["SerialNumber"] = bytes.fromhex(self.serial_number)
+        data["signatureAlgorithm"] = signaturealgorithm
+        data["signatureCounter"] = signature_counter
+        data["LogTime"] = log_time
+
+        return (
+            data["Version"].dump()
+            + data["CertifiedDataType"].dump()
+            + certidata["operationType"].dump()
+            + certidata["clientId"].dump()
+            + certidata["ProcessData"].dump()
+            + certidata["ProcessType"].dump()
+            + certidata["transactionNumber"].dump()
+            + data["SerialNumber"].dump()
+            + data["signatureAlgorithm"].dump()
+            + data["signatureCounter"].dump()
+            + data["LogTime"].dump()
+        )
+
+
+class FiskalySimulator:
+    """
+    Simulates the fiskaly cloud api for any number of TSS, each of them is created when it is first requested.
+    Every response is delayed by latency plus a random jitter, a fraction error_rate of the requests fails with
+    an internal server error to exercise the error handling and retries of the clients.
+    """
+
+    def __init__(
+        self,
+        host: str = "localhost",
+        port: int = 10002,
+        latency: float = 0.05,
+        latency_jitter: float = 0.02,
+        error_rate: float = 0.0,
+        token_validity: int = 300,
+        private_key_hex: Optional[str] = None,
+    ):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.token_validity = token_validity
+        self._private_key_hex = private_key_hex
+
+        self.tss: dict[str, VirtualTSS] = {}
+        # access token -> expiry as unix timestamp
+        self.access_tokens: dict[str, float] = {}
+        self.n_requests = 0
+        self.n_injected_errors = 0
+
+        self.app = FastAPI(title="Fiskaly TSE Simulator", license_info={"name": "AGPL-3.0"})
+        self._add_routes()
+
+    def get_tss(self, tss_id: str) -> VirtualTSS:
+        tss = self.tss.get(tss_id)
+        if tss is None:
+            if self._private_key_hex is not None:
+                sk = ecdsa.SigningKey.from_string(
+                    bytes.fromhex(self._private_key_hex), curve=ecdsa.BRAINPOOLP384r1, hashfunc=sha384
+                )
+            else:
+                sk = ecdsa.SigningKey.generate(curve=ecdsa.BRAINPOOLP384r1, hashfunc=sha384)
+            tss = VirtualTSS(tss_id, sk)
+            self.tss[tss_id] = tss
+            LOGGER.info(f"created TSS {tss_id} with serial number {tss.serial_number}")
+        return tss
+
+    async def _simulate_network(self):
+        self.n_requests += 1
+        delay = self.latency + random.uniform(0, self.latency_jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if random.random() < self.error_rate:
+            self.n_injected_errors += 1
+            raise FiskalyError(500, "E_INTERNAL", "injected error")
+
+    def _check_token(self, authorization: Optional[str]):
+        token = authorization.removeprefix("Bearer ") if authorization is not None else None
+        if token is None or self.access_tokens.get(token, 0) < time.time():
+            raise FiskalyError(401, "E_UNAUTHORIZED", "missing or expired access token")
+
+    async def _handle(self, authorization: Optional[str]):
+        await self._simulate_network()
+        self._check_token(authorization)
+
+    def _add_routes(self):
+        app = self.app
+
+        @app.exception_handler(FiskalyError)
+        async def fiskaly_error_handler(_, exc: FiskalyError):
+            return JSONResponse(
+                status_code=exc.status_code,
+                content={"status_code": exc.status_code, "error": exc.code, "code": exc.code, "message": exc.detail},
+            )
+
+        @app.post("/auth")
+        async def auth(body: dict = Body()):
+            await self._simulate_network()
+            if not body.get("api_key") or not body.get("api_secret"):
+                raise FiskalyError(401, "E_UNAUTHORIZED", "invalid api key or secret")
+            token = secrets.token_urlsafe(32)
+            now = time.time()
+            # forget expired tokens
+            self.access_tokens = {t: expiry for t, expiry in self.access_tokens.items() if expiry > now}
+            self.access_tokens[token] = now + self.token_validity
+            return {
+                "access_token": token,
+                "access_token_expires_in": self.token_validity,
+                "access_token_expires_at": int(now + self.token_validity),
+            }
+
+        @app.get("/tss/{tss_id}")
+        async def get_tss(tss_id: str, authorization: Optional[str] = Header(None)):
+            await self._handle(authorization)
+            return self.get_tss(tss_id).get_tss()
+
+        @app.post("/tss/{tss_id}/admin/auth")
+        async def admin_auth(tss_id: str, authorization: Optional[str] = Header(None)):
+            await self._handle(authorization)
+            self.get_tss(tss_id)
+            return {}
+
+        @app.post("/tss/{tss_id}/admin/logout")
+        async def admin_logout(tss_id: str, authorization: Optional[str] = Header(None)):
+            await self._handle(authorization)
+            self.get_tss(tss_id)
+            return {}
+
+        @app.get("/tss/{tss_id}/client")
+        async def list_clients(tss_id: str, authorization: Optional[str] = Header(None)):
+            await self._handle(authorization)
+            clients = list(self.get_tss(tss_id).clients.values())
+            return {"data": clients, "count": len(clients)}
+
+        @app.get("/tss/{tss_id}/client/{client_id}")
+        async def get_client(tss_id: str, client_id: str, authorization: Optional[str] = Header(None)):
+            await self._handle(authorization)
+            return self.get_tss(tss_id).get_client(client_id)
+
+        @app.put("/tss/{tss_id}/client/{client_id}")
+        async def create_client(
+            tss_id: str, client_id: str, body: dict = Body(), authorization: Optional[str] = Header(None)
+        ):
+            await self._handle(authorization)
+            return self.get_tss(tss_id).upsert_client(client_id, serial_number=body.get("serial_number"), state=None)
+
+        @app.patch("/tss/{tss_id}/client/{client_id}")
+        async def update_client(
+            tss_id: str, client_id: str, body: dict = Body(), authorization: Optional[str] = Header(None)
+        ):
+            await self._handle(authorization)
+            tss = self.get_tss(tss_id)
+            tss.get_client(client_id)
+            return tss.upsert_client(client_id, serial_number=None, state=body.get("state"))
+
+        @app.put("/tss/{tss_id}/tx/{tx_id}")
+        async def put_transaction(
+            tss_id: str,
+            tx_id: str,
+            tx_revision: int = Query(),
+            body: dict = Body(),
+            authorization: Optional[str] = Header(None),
+        ):
+            await self._handle(authorization)
+            return self.get_tss(tss_id).put_transaction(tx_id, tx_revision, body)
+
+    async def run(self):
+        uvicorn_config = uvicorn.Config(
+            self.app,
+            host=self.host,
+            port=self.port,
+            log_level=logging.root.level,
+        )
+        webserver = uvicorn.Server(uvicorn_config)
+        await webserver.serve()
@@ -24,7 +24,7 @@ class SignatureProcessor:
         # contains event objects for each object that is waiting for new events.
 
     async def run(self) -> None:
-        self.db_pool = await create_db_pool(self.config.database)
+        self.db_pool = await create_db_pool(self.config.database, pool_config=self.config.tse.db_pool)
 
         async with contextlib.AsyncExitStack() as aes:
             # Clean up pending signatures.
@@ -55,7 +55,11 @@ class SignatureProcessor:
                 tses_in_db = await conn.fetch_many(Tse, "select * from tse")
                 for tse_in_db in tses_in_db:
                     factory = get_tse_handler(tse_in_db, config=self.config)
-                    tse = TSEWrapper(name=tse_in_db.name, factory_function=factory)
+                    tse = TSEWrapper(
+                        name=tse_in_db.name,
+                        factory_function=factory,
+                        signature_concurrency=self.config.tse.get_signature_concurrency(tse_in_db.name),
+                    )
                     tse.start(self.db_pool)
                     aes.push_async_callback(tse.stop)
                     self.tses[tse.name] = tse
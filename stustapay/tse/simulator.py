@@ -1,3 +1,6 @@
 from .diebold_nixdorf_usb.simulator import WebsocketInterface
+from .fiskaly_cloud_tse.simulator import FiskalySimulator
 
 Simulator = WebsocketInterface
+
+__all__ = ["Simulator", "FiskalySimulator"]
@@ -10,7 +10,7 @@ from typing import Callable
 import asyncpg
 
 from stustapay.core.util import create_task_protected
-from stustapay.framework.database import Connection
+from stustapay.framework.database import Connection, register_statement
 
 from .handler import TSEHandler, TSESignature, TSESignatureRequest
 from .fiskaly_cloud_tse.handler import FiskalyCloudTSE
@@ -20,9 +20,138 @@ LOGGER = logging.getLogger(__name__)
 
 PAYMENT_METHOD_TO_ZAHLUNGSART = {"cash": "Bar", "sumup": "Unbar", "tag": "Unbar", "sumup_online": "Unbar"}
 
+_CLAIM_SIGNATURE_REQUESTS_STATEMENT = register_statement(
+    "tse_claim_signature_requests",
+    """
+    with claimable as (
+        select
+            s.id,
+            s.till_id
+        from
+            tse_signature s
+            join till on s.till_id=till.id
+        where
+            s.signature_status='new' and
+            till.tse_id = $1 and
+            -- only the oldest signature of a till, and only if none of the till is currently being signed.
+            -- an older signature which is locked by somebody else is still 'new' in our snapshot,
+            -- so skipping it never lets us claim a later one of the same till.
+            not exists (
+                select
+                    1
+                from
+                    tse_signature other
+                where
+                    other.till_id=s.till_id and
+                    other.signature_status in ('new', 'pending') and
+                    (other.signature_status = 'pending' or other.id < s.id)
+            )
+        order by s.id
+        limit $2
+        for update of s skip locked
+    )
+    update
+        tse_signature
+    set
+        signature_status='pending',
+        tse_id=$1
+    from
+        claimable
+    where
+        tse_signature.id=claimable.id
+    returning
+        claimable.id as order_id,
+        claimable.till_id
+    """,
+)
+
+_SIGNATURE_DONE_STATEMENT = register_statement(
+    "tse_signature_done",
+    """
+    update
+        tse_signature
+    set
+        signature_status='done',
+        result_message='success',
+        transaction_process_type=$1,
+        transaction_process_data=$2,
+        tse_transaction=$3,
+        tse_signaturenr=$4,
+        tse_start=$5,
+        tse_end=$6,
+        tse_signature=$7,
+        tse_duration=$8
+    where
+        id=$9
+    """,
+)
+
+# payment method and line item totals per tax name of a batch of orders,
+# orders without line items are returned as a single row with tax_name null
+_ORDER_SIGNATURE_DATA_STATEMENT = register_statement(
+    "tse_order_signature_data",
+    """
+    select
+        ordr.id as order_id,
+        ordr.payment_method,
+        line_item.tax_name,
+        sum(line_item.total_price) as total_price
+    from
+        ordr
+        left join line_item on line_item.order_id=ordr.id
+    where
+        ordr.id = any($1::bigint[])
+    group by
+        ordr.id, ordr.payment_method, line_item.tax_name
+    """,
+)
+
+
+def assemble_signature_requests(
+    till_ids: dict[int, str], rows: typing.Iterable[typing.Mapping[str, typing.Any]]
+) -> list[TSESignatureRequest]:
+    """
+    Builds the Kassenbeleg-V1 signature requests of a batch of orders from the rows
+    returned by _ORDER_SIGNATURE_DATA_STATEMENT.
+    till_ids maps the order ids to the TSE client ids they are signed with,
+    the requests are returned in the order of till_ids.
+    """
+    belege: dict[int, Kassenbeleg_V1] = {order_id: Kassenbeleg_V1() for order_id in till_ids}
+    totals: dict[int, typing.Any] = {}
+    zahlungsarten: dict[int, str] = {}
+    for row in rows:
+        order_id = row["order_id"]
+        if order_id not in zahlungsarten:
+            try:
+                zahlungsarten[order_id] = PAYMENT_METHOD_TO_ZAHLUNGSART[row["payment_method"]]
+            except KeyError as exc:
+                raise RuntimeError(f"invalid payment_method {row['payment_method']!r}") from exc
+            totals[order_id] = 0
+        if row["tax_name"] is None:
+            continue
+        belege[order_id].add_line_item(row["total_price"], row["tax_name"])
+        totals[order_id] += row["total_price"]
+
+    requests = []
+    for order_id, till_id in till_ids.items():
+        if order_id not in zahlungsarten:
+            raise RuntimeError(f"invalid order {order_id!r}")
+        beleg = belege[order_id]
+        # TODO: get currency from database config
+        beleg.add_zahlung(totals[order_id], zahlungsart=zahlungsarten[order_id], waehrung="EUR")
+        requests.append(
+            TSESignatureRequest(
+                order_id=order_id,
+                till_id=till_id,
+                process_type=beleg.get_process_type(),
+                process_data=beleg.get_process_data(),
+            )
+        )
+    return requests
+
 
 class TSEWrapper:
-    def __init__(self, name: str, factory_function: Callable[[], TSEHandler]):
+    def __init__(self, name: str, factory_function: Callable[[], TSEHandler], signature_concurrency: int = 1):
         # most of these members will be set in run().
 
         # The TSE name (database TSE_name and TSE config entry)
@@ -41,6 +170,12 @@ class TSEWrapper:
         self._stop = False
         # Set this event to notify that new orders are available in the DB
         self._orders_available_event = asyncio.Event()
+        # Number of signatures for different tills which are created at once
+        self._signature_concurrency = signature_concurrency
+        # The pool the connections of concurrently running signatures are taken from
+        self._db_pool: typing.Optional[asyncpg.Pool] = None
+        # Serializes the admin logins of concurrently running signatures at fiskaly
+        self._admin_lock = asyncio.Lock()
 
     def start(self, db_pool: asyncpg.Pool):
         self._task = create_task_protected(self.run(db_pool), f"tse_wrapper_task {self.name}")
@@ -58,6 +193,7 @@ class TSEWrapper:
         Connects to the wrapped TSE and calls _tse_handler_loop.
         This repeats until self._stop is set.
         """
+        self._db_pool = db_pool
         async with contextlib.AsyncExitStack() as es:
             conn: Connection = await es.enter_async_context(db_pool.acquire())
             while True:
@@ -237,9 +373,14 @@ class TSEWrapper:
         # The TSE is now ready to be used.
         # Ready to execute signatures from the database.
 
+        if self._signature_concurrency > 1:
+            await self._sign_pipelined(conn)
+            return
+
         while not self._stop and not self._tse_handler.is_stop_set():
             LOGGER.info(f"TSE {self.name!r}: getting next request")
-            next_request = await self._grab_next_request(conn)
+            next_requests = await self._grab_next_requests(conn, limit=1)
+            next_request = next_requests[0] if next_requests else None
             LOGGER.info(f"TSE {self.name!r}: {next_request=!r}")
 
             if next_request is not None:
@@ -255,14 +396,67 @@ class TSEWrapper:
 
             # TODO break out of while loop if the TSE connection has failed somehow
 
-    async def _grab_next_request(self, conn: Connection, timeout: float = 2) -> typing.Optional[TSESignatureRequest]:
+    async def _sign_pipelined(self, conn: Connection):
+        """
+        Like the loop at the end of _tse_handler_loop, but signs the requests of up to _signature_concurrency tills
+        at once, each on its own database connection.
+        The order of the signatures of a till is preserved as _grab_next_requests skips all tills with a pending
+        signature, so the next request of a till is only grabbed once its previous one is done.
+        """
+        assert self._tse_handler is not None
+        running: set[asyncio.Task] = set()
+        try:
+            while not self._stop and not self._tse_handler.is_stop_set():
+                if len(running) >= self._signature_concurrency:
+                    done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        # raise errors of the signature, just as the serial loop does
+                        task.result()
+                    continue
+
+                LOGGER.info(f"TSE {self.name!r}: getting next requests, {len(running)} signatures running")
+                next_requests = await self._grab_next_requests(conn, limit=self._signature_concurrency - len(running))
+                LOGGER.info(f"TSE {self.name!r}: {next_requests=!r}")
+                for next_request in next_requests:
+                    task_name = f"tse_sign_task {self.name} {next_request.order_id}"
+                    running.add(asyncio.create_task(self._sign_and_store(next_request), name=task_name))
+
+                for task in [task for task in running if task.done()]:
+                    running.remove(task)
+                    task.result()
+        finally:
+            # let the running signatures finish, otherwise their requests would stay pending and block their tills
+            if running:
+                done, _ = await asyncio.wait(running)
+                for task in done:
+                    if not task.cancelled() and task.exception() is not None:
+                        LOGGER.error(
+                            f"TSE {self.name!r}: {task.get_name()} failed while shutting down",
+                            exc_info=task.exception(),
+                        )
+
+    async def _sign_and_store(self, request: TSESignatureRequest):
+        assert self._db_pool is not None
+        try:
+            async with self._db_pool.acquire() as conn:
+                result = await self._sign(conn, request)
+                LOGGER.info(f"signature result: {result!r}")
+                if result is None:
+                    await self._fail_request(conn, request, "TSE operation failed, timeout")
+                else:
+                    await self._request_done(conn, request, result)
+        finally:
+            # the next request of this till can be grabbed now
+            self._orders_available_event.set()
+
+    async def _grab_next_requests(self, conn: Connection, limit: int, timeout: float = 2) -> list[TSESignatureRequest]:
         """
         Waits until the 'order available' event is set,
-        then fetches the next TSE signature request for this TSE from the database,
-        marks it as 'pending' and fetches all the details, returning them as a TSESignatureRequest.
+        then claims up to limit TSE signature requests for this TSE from the database, at most one per till,
+        marks them as 'pending' and fetches all the details, returning them as TSESignatureRequests.
 
         Checks anyway after the timeout has elapsed.
-        Returns None if no signature is pending.
+        Returns an empty list if no signature is pending.
         """
         # wait until an order is potentially available
         try:
@@ -273,99 +467,29 @@ class TSEWrapper:
             LOGGER.info(f"TSE wrapper {self.name}: timeout while waiting for orders available, but checking anyway")
 
         if self._stop:
-            return None
+            return []
 
-        async with conn.transaction(isolation="serializable"):
-            next_sig = await conn.fetchrow(
-                """
-                with currently_signing as (
-                    select
-                        till_id
-                    from
-                        tse_signature
-                        join ordr on ordr.id=tse_signature.id
-                    where
-                        tse_signature.signature_status = 'pending'
-                )
-                select
-                    ordr.id as order_id,
-                    till.id as till_id
-                from
-                    tse_signature
-                    join ordr on ordr.id=tse_signature.id
-                    join till on ordr.till_id=till.id
-                where
-                    tse_signature.signature_status='new' and
-                    till.tse_id = $1 and
-                    not exists (
-                        select
-                            1
-                        from
-                            currently_signing
-                        where
-                            currently_signing.till_id=ordr.till_id
-                    )
-                order by ordr.id
-                limit 1
-                """,
-                self.tse_id,
-            )
-            if next_sig is None:
-                # no orders are available, return None
-                return None
-            else:
-                # set the orders available event;
-                # that way, next time this function is called it will run instantly
-                # instead of first waiting on the event.
-                self._orders_available_event.set()
-
-            order_id = next_sig["order_id"]
-            till_id = str(
-                next_sig["till_id"]
-            )  # use till_id converted to string as TSE ClientID to satisfy naming constraints
-            await conn.execute(
-                """
-                update
-                    tse_signature
-                set
-                    signature_status='pending',
-                    tse_id=$1
-                where
-                    id=$2
-                """,
-                self.tse_id,
-                order_id,
-            )
+        claimed = await conn.fetch(_CLAIM_SIGNATURE_REQUESTS_STATEMENT, self.tse_id, limit)
+        if len(claimed) == 0:
+            # no orders are available
+            return []
 
-        return await self._make_signature_request(conn, order_id, till_id)
+        # set the orders available event;
+        # that way, next time this function is called it will run instantly
+        # instead of first waiting on the event.
+        self._orders_available_event.set()
+
+        # use till_id converted to string as TSE ClientID to satisfy naming constraints
+        till_ids = {row["order_id"]: str(row["till_id"]) for row in sorted(claimed, key=lambda r: r["order_id"])}
+        return await self._make_signature_requests(conn, till_ids)
 
-    async def _make_signature_request(self, conn: Connection, order_id: int, till_id: str):
+    async def _make_signature_requests(self, conn: Connection, till_ids: dict[int, str]) -> list[TSESignatureRequest]:
         """
-        Collects all required information for signing the order,
-        and passes the signing request to the TSE.
+        Collects all required information for signing a batch of orders with a single query.
+        till_ids maps the order ids to the TSE client ids they are signed with.
         """
-        payment_method = await conn.fetchval("select payment_method from ordr where ordr.id=$1", order_id)
-        if payment_method is None:
-            raise RuntimeError(f"invalid order {order_id!r}")
-        beleg = Kassenbeleg_V1()
-        total = 0
-        try:
-            zahlungsart = PAYMENT_METHOD_TO_ZAHLUNGSART[payment_method]
-        except KeyError as exc:
-            raise RuntimeError(f"invalid payment_method {payment_method!r}") from exc
-
-        for row in await conn.fetch("select total_price, tax_name from line_item where order_id = $1", order_id):
-            beleg.add_line_item(row["total_price"], row["tax_name"])
-            total += row["total_price"]
-        # TODO: get currency from database config
-        beleg.add_zahlung(total, zahlungsart=zahlungsart, waehrung="EUR")
-
-        return TSESignatureRequest(
-            order_id=order_id,
-            till_id=till_id,
-            process_type=beleg.get_process_type(),
-            process_data=beleg.get_process_data(),
-        )
+        rows = await conn.fetch(_ORDER_SIGNATURE_DATA_STATEMENT, list(till_ids))
+        return assemble_signature_requests(till_ids, rows)
 
     async def _return_request(self, conn: Connection, request: TSESignatureRequest):
         """
@@ -398,23 +522,7 @@ class TSEWrapper:
         """
         LOGGER.info(f"duration {result.tse_duration}")
         await conn.execute(
-            """
-            update
-                tse_signature
-            set
-                signature_status='done',
-                result_message='success',
-                transaction_process_type=$1,
-                transaction_process_data=$2,
-                tse_transaction=$3,
-                tse_signaturenr=$4,
-                tse_start=$5,
-                tse_end=$6,
-                tse_signature=$7,
-                tse_duration=$8
-            where
-                id=$9
-            """,
+            _SIGNATURE_DONE_STATEMENT,
             request.process_type,
             request.process_data,
             str(result.tse_transaction),
@@ -430,21 +538,22 @@ class TSEWrapper:
         assert self._tse_handler is not None
         # must be called when the TSE is connected and operational.
         till_id = signing_request.till_id
-        if(isinstance(self._tse_handler, FiskalyCloudTSE)):
+        if isinstance(self._tse_handler, FiskalyCloudTSE):
             till_id = await conn.fetchval("select fiskaly_uuid from till where id=$1", int(signing_request.till_id))
         if str(till_id) not in self._tills:
             LOGGER.info(f"registering new ClientID {signing_request.till_id} with TSE {self.name}")
             await self._till_add(conn, signing_request.till_id)
         start = time.monotonic()
         try:
-            if(isinstance(self._tse_handler, FiskalyCloudTSE)):
-                await self._tse_handler.authenticate_admin()
-                client = await self._tse_handler.retrieve_client(client_id=str(till_id))
-                print(client)
-                if client["state"] != "REGISTERED":
-                    await self._tse_handler.register_client_id(client_id=str(till_id))
-                await self._tse_handler.logout_admin()
-            result = await self._tse_handler.sign(signing_request,till_id)  
+            if isinstance(self._tse_handler, FiskalyCloudTSE):
+                async with self._admin_lock:
+                    await self._tse_handler.authenticate_admin()
+                    client = await self._tse_handler.retrieve_client(client_id=str(till_id))
+                    LOGGER.debug(f"{self.name!r}: fiskaly client {client!r}")
+                    if client["state"] != "REGISTERED":
+                        await self._tse_handler.register_client_id(client_id=str(till_id))
+                    await self._tse_handler.logout_admin()
+            result = await self._tse_handler.sign(signing_request, till_id)
         except asyncio.TimeoutError:
             LOGGER.warning("WARNING: TSE request timeout")
             return None
@@ -461,11 +570,12 @@ class TSEWrapper:
         assert self._tse_handler is not None
         LOGGER.info(f"{self.name!r}: adding till {till!r}")
 
-        if(isinstance(self._tse_handler, FiskalyCloudTSE)):
+        if isinstance(self._tse_handler, FiskalyCloudTSE):
             fiskaly_uuid = await conn.fetchval("select fiskaly_uuid from till where id=$1", int(till))
-            await self._tse_handler.authenticate_admin()
-            await self._tse_handler.register_client_id(client_id=str(fiskaly_uuid))
-            await self._tse_handler.logout_admin()
+            async with self._admin_lock:
+                await self._tse_handler.authenticate_admin()
+                await self._tse_handler.register_client_id(client_id=str(fiskaly_uuid))
+                await self._tse_handler.logout_admin()
         else:
             await self._tse_handler.register_client_id(client_id=str(till))
         # get z_nr
@@ -481,14 +591,14 @@ class TSEWrapper:
     async def _till_remove(self, conn: Connection, till):
         assert self._tse_handler is not None
         LOGGER.info(f"{self.name!r}: removing till {till!r}")
-        if(isinstance(self._tse_handler, FiskalyCloudTSE)):
+        if isinstance(self._tse_handler, FiskalyCloudTSE):
             fiskaly_uuid = await conn.fetchval("select fiskaly_uuid from till where id=$1", int(till))
             await self._tse_handler.authenticate_admin()
             await self._tse_handler.deregister_client_id(client_id=str(till))
             await self._tse_handler.logout_admin()
         else:
-            await self._tse_handler.deregister_client_id(str(till))    
-            
+            await self._tse_handler.deregister_client_id(str(till))
+
         if str(till).isnumeric():
             z_nr = await conn.fetchval("select z_nr from till where id=$1", int(till))
         else:
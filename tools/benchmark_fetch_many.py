@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Micro benchmark of the record to model conversion done in Connection.fetch_many.
+
+Decodes rows shaped like those of the order_value view (including the embedded json line items) into Order models.
+No database is needed, the rows are generated.
+"""
+
+import argparse
+import datetime
+import timeit
+import uuid
+
+from stustapay.core.schema.order import Order
+from stustapay.framework.database import model_list_adapter
+
+
+def make_order_rows(n_rows: int, n_line_items: int) -> list[dict]:
+    booked_at = datetime.datetime.now(tz=datetime.timezone.utc)
+    rows = []
+    for i in range(n_rows):
+        line_items = [
+            {
+                "order_id": i,
+                "item_id": j,
+                "quantity": 2,
+                "product": {
+                    "node_id": 1,
+                    "id": j,
+                    "name": f"Product {j}",
+                    "price": 3.5,
+                    "fixed_price": True,
+                    "price_in_vouchers": 1,
+                    "price_per_voucher": 3.5,
+                    "tax_rate_id": 1,
+                    "tax_name": "ust",
+                    "tax_rate": 0.19,
+                    "target_account_id": None,
+                    "type": "user_defined",
+                    "restrictions": ["under_16"],
+                    "is_locked": True,
+                    "is_returnable": False,
+                },
+                "product_price": 3.5,
+                "tax_rate_id": 1,
+                "tax_name": "ust",
+                "tax_rate": 0.19,
+                "total_price": 7.0,
+                "total_tax": 1.12,
+            }
+            for j in range(n_line_items)
+        ]
+        rows.append(
+            {
+                "id": i,
+                "uuid": uuid.uuid4(),
+                "total_price": 7.0 * n_line_items,
+                "total_tax": 1.12 * n_line_items,
+                "total_no_tax": 5.88 * n_line_items,
+                "cancels_order": None,
+                "booked_at": booked_at,
+                "payment_method": "tag",
+                "order_type": "sale",
+                "cashier_id": 1,
+                "till_id": 1,
+                "customer_account_id": 1000 + i,
+                "customer_tag_uid": 1234 + i,
+                "line_items": line_items,
+            }
+        )
+    return rows
+
+
+def main(n_rows: int, n_line_items: int, repeat: int):
+    rows = make_order_rows(n_rows=n_rows, n_line_items=n_line_items)
+    adapter = model_list_adapter(Order)
+
+    # make sure both variants produce the same result before timing them
+    assert [Order.model_validate(r) for r in rows] == adapter.validate_python(rows)
+
+    variants = {
+        "model_validate per row": lambda: [Order.model_validate(r) for r in rows],
+        "TypeAdapter(list[Order])": lambda: adapter.validate_python(rows),
+        # reference only: skips all validation, nested line items stay plain dicts
+        "model_construct (unvalidated)": lambda: [Order.model_construct(**r) for r in rows],
+    }
+    print(f"decoding {n_rows} orders with {n_line_items} line items each, best of {repeat}")
+    for name, func in variants.items():
+        best = min(timeit.repeat(func, number=1, repeat=repeat))
+        print(f"{name:>32}: {best * 1000:8.1f} ms ({best / n_rows * 1e6:.2f} us / row)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the decoding of database rows into pydantic models")
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--line-items", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    main(n_rows=args.rows, n_line_items=args.line_items, repeat=args.repeat)
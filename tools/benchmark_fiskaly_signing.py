@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the signing throughput of FiskalyCloudTSE against the local fiskaly simulator.
+
+The simulator runs in the same process, its latency and error rate can be configured to see how the handler
+behaves on a slow or flaky connection. No database is needed.
+"""
+
+import argparse
+import asyncio
+import time
+
+import uvicorn
+
+from stustapay.tse.fiskaly_cloud_tse.config import FiskalyCloudTSEConfig
+from stustapay.tse.fiskaly_cloud_tse.handler import FiskalyCloudTSE
+from stustapay.tse.fiskaly_cloud_tse.simulator import FiskalySimulator
+from stustapay.tse.handler import TSESignatureRequest
+
+
+async def sign_all(tse: FiskalyCloudTSE, n_signatures: int, n_clients: int) -> int:
+    """signs n_signatures requests, one after another for every client but all clients at once"""
+    n_failed = 0
+
+    async def sign_for_client(client_id: str, order_ids: range):
+        nonlocal n_failed
+        for order_id in order_ids:
+            request = TSESignatureRequest(
+                order_id=order_id,
+                till_id=client_id,
+                process_type="Kassenbeleg-V1",
+                process_data=f"Beleg^{order_id}.00_0.00_0.00_0.00_0.00^{order_id}.00:Bar",
+            )
+            try:
+                await tse.sign(request, client_id)
+            except (TypeError, KeyError):
+                # the handler returns no result for failed requests
+                n_failed += 1
+
+    client_ids = [f"client-{i}" for i in range(n_clients)]
+    for client_id in client_ids:
+        await tse.register_client_id(client_id)
+    await asyncio.gather(
+        *[
+            sign_for_client(client_id, range(i, n_signatures, n_clients))
+            for i, client_id in enumerate(client_ids, start=1)
+        ]
+    )
+    return n_failed
+
+
+async def main(n_signatures: int, n_clients: int, latency: float, error_rate: float, port: int):
+    simulator = FiskalySimulator(host="127.0.0.1", port=port, latency=latency, latency_jitter=0, error_rate=0)
+    server = uvicorn.Server(uvicorn.Config(simulator.app, host="127.0.0.1", port=port, log_level="warning"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+
+    config = FiskalyCloudTSEConfig(
+        base_url=f"http://127.0.0.1:{port}",
+        api_key="key",
+        api_secret="secret",
+        serial_number="benchmark",
+        tss_id="benchmark",
+        password="password",
+    )
+    tse = FiskalyCloudTSE("benchmark", config)
+    try:
+        await tse.start()
+        simulator.error_rate = error_rate
+        start = time.perf_counter()
+        n_failed = await sign_all(tse, n_signatures=n_signatures, n_clients=n_clients)
+        duration = time.perf_counter() - start
+    finally:
+        await tse.stop()
+        server.should_exit = True
+        await server_task
+
+    print(f"signed {n_signatures} requests of {n_clients} clients with {latency * 1000:.0f} ms latency")
+    print(f"{duration:.2f} s, {n_signatures / duration:.1f} signatures / s, {n_failed} failed")
+    print(f"{simulator.n_requests} requests to the simulator, {simulator.n_injected_errors} injected errors")
+    for stats in tse.endpoint_stats():
+        print(
+            f"{stats.name:>28}: {stats.requests:6} requests, {stats.errors:4} errors, "
+            f"avg {stats.total_time / stats.requests * 1000:6.1f} ms, max {stats.max_time * 1000:6.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark signing with the fiskaly cloud TSE simulator")
+    parser.add_argument("--signatures", type=int, default=1000)
+    parser.add_argument("--clients", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--port", type=int, default=10002)
+    args = parser.parse_args()
+    asyncio.run(
+        main(
+            n_signatures=args.signatures,
+            n_clients=args.clients,
+            latency=args.latency,
+            error_rate=args.error_rate,
+            port=args.port,
+        )
+    )
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Benchmark of assembling the Kassenbeleg-V1 signature requests of the TSE wrapper.
+
+Without a database the process data of generated orders is assembled one order at a time and as a single batch.
+Given a config file the newest orders in the database are also assembled with two queries per order,
+as the wrapper used to do, and with the single batch query. The database is only read.
+"""
+
+import argparse
+import asyncio
+import random
+import time
+import timeit
+from decimal import Decimal
+from pathlib import Path
+from typing import Optional
+
+from stustapay.core.config import read_config
+from stustapay.framework.database import create_db_pool
+from stustapay.tse.kassenbeleg_v1 import Kassenbeleg_V1
+from stustapay.tse.wrapper import (
+    _ORDER_SIGNATURE_DATA_STATEMENT,
+    PAYMENT_METHOD_TO_ZAHLUNGSART,
+    assemble_signature_requests,
+)
+
+TAX_NAMES = ["ust", "eust", "none", "transparent"]
+
+
+def make_signature_data_rows(n_orders: int, n_tax_names: int) -> tuple[dict[int, str], list[dict]]:
+    till_ids = {}
+    rows = []
+    for order_id in range(1, n_orders + 1):
+        till_ids[order_id] = str(order_id % 50)
+        payment_method = random.choice(list(PAYMENT_METHOD_TO_ZAHLUNGSART))
+        for tax_name in TAX_NAMES[:n_tax_names]:
+            rows.append(
+                {
+                    "order_id": order_id,
+                    "payment_method": payment_method,
+                    "tax_name": tax_name,
+                    "total_price": Decimal(random.randint(-2000, 10000)) / 100,
+                }
+            )
+    return till_ids, rows
+
+
+def benchmark_assembly(n_orders: int, n_tax_names: int, repeat: int):
+    till_ids, rows = make_signature_data_rows(n_orders=n_orders, n_tax_names=n_tax_names)
+    rows_per_order: dict[int, list[dict]] = {}
+    for row in rows:
+        rows_per_order.setdefault(row["order_id"], []).append(row)
+
+    def per_order():
+        return [
+            request
+            for order_id, till_id in till_ids.items()
+            for request in assemble_signature_requests({order_id: till_id}, rows_per_order[order_id])
+        ]
+
+    def batch():
+        return assemble_signature_requests(till_ids, rows)
+
+    assert per_order() == batch()
+    print(f"assembling {n_orders} orders with {n_tax_names} tax rates each, best of {repeat}")
+    for name, func in {"per order": per_order, "batch": batch}.items():
+        best = min(timeit.repeat(func, number=1, repeat=repeat))
+        print(f"{name:>20}: {best * 1000:8.1f} ms ({best / n_orders * 1e6:.2f} us / order)")
+
+
+async def benchmark_queries(config_path: Path, n_orders: int, repeat: int):
+    config = read_config(config_path)
+    db_pool = await create_db_pool(config.database, n_connections=1)
+    try:
+        async with db_pool.acquire() as conn:
+            rows = await conn.fetch(
+                "select id, coalesce(till_id, 0) as till_id from ordr order by id desc limit $1", n_orders
+            )
+            till_ids = {row["id"]: str(row["till_id"]) for row in reversed(rows)}
+            if len(till_ids) == 0:
+                print("no orders in the database")
+                return
+
+            async def per_order():
+                # the queries the wrapper used to run for every single order
+                requests = []
+                for order_id in till_ids:
+                    payment_method = await conn.fetchval("select payment_method from ordr where ordr.id=$1", order_id)
+                    beleg = Kassenbeleg_V1()
+                    total = 0
+                    for row in await conn.fetch(
+                        "select total_price, tax_name from line_item where order_id = $1", order_id
+                    ):
+                        beleg.add_line_item(row["total_price"], row["tax_name"])
+                        total += row["total_price"]
+                    beleg.add_zahlung(total, zahlungsart=PAYMENT_METHOD_TO_ZAHLUNGSART[payment_method])
+                    requests.append(beleg.get_process_data())
+                return requests
+
+            async def batch():
+                rows = await conn.fetch(_ORDER_SIGNATURE_DATA_STATEMENT, list(till_ids))
+                return [r.process_data for r in assemble_signature_requests(till_ids, rows)]
+
+            assert await per_order() == await batch()
+            print(f"querying and assembling {len(till_ids)} orders from the database, best of {repeat}")
+            for name, func in {"per order queries": per_order, "batch query": batch}.items():
+                best: Optional[float] = None
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    await func()
+                    duration = time.perf_counter() - start
+                    best = duration if best is None else min(best, duration)
+                assert best is not None
+                print(f"{name:>20}: {best * 1000:8.1f} ms ({best / len(till_ids) * 1e6:.2f} us / order)")
+    finally:
+        await db_pool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the assembly of TSE signature requests")
+    parser.add_argument("--orders", type=int, default=10_000)
+    parser.add_argument("--tax-names", type=int, default=2, choices=range(1, len(TAX_NAMES) + 1))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--config", type=Path, help="also benchmark the queries against the configured database")
+    args = parser.parse_args()
+    benchmark_assembly(n_orders=args.orders, n_tax_names=args.tax_names, repeat=args.repeat)
+    if args.config is not None:
+        asyncio.run(benchmark_queries(config_path=args.config, n_orders=args.orders, repeat=args.repeat))
+
+
+if __name__ == "__main__":
+    main()